@@ -1,6 +1,7 @@
 import timewinder
 from timewinder.generators import Set
 from timewinder.functions import ThreadID
+from timewinder.functions import ThreadRef
 
 # These are the variables we'd like to modify to test
 # bigger models.
@@ -26,7 +27,8 @@ class BoundedQueue:
 @timewinder.object
 class CondWait:
     def __init__(self, n_producers, n_consumers):
-        self.status = [True] * (n_producers + n_consumers)
+        # Keyed by thread, so symmetric threads can be renumbered
+        self.status = {ThreadRef(i): True for i in range(n_producers + n_consumers)}
         self.n_producers = n_producers
         self.n_consumers = n_consumers
 
@@ -34,7 +36,7 @@ class CondWait:
         self.status[i] = True
 
     def sleeping(self):
-        return [i for i, x in enumerate(self.status) if x is False]
+        return [i for i, x in self.status.items() if x is False]
 
 
 @timewinder.process
@@ -72,26 +74,23 @@ def consumer(queue, running):
             running.notify(wake_id)
 
 
-THREADS = PRODUCERS + CONSUMERS
 runnable = CondWait(PRODUCERS, CONSUMERS)
 bqueue = BoundedQueue(QUEUE_SIZE)
 
 
-threads = []
-for i in range(THREADS):
-    if i < PRODUCERS:
-        threads.append(producer(bqueue, runnable, i))
-    else:
-        threads.append(consumer(bqueue, runnable, i))
+producers = [producer(bqueue, runnable) for _ in range(PRODUCERS)]
+consumers = [consumer(bqueue, runnable) for _ in range(CONSUMERS)]
 
 
-no_deadlocks = timewinder.ForAll(CondWait, lambda c: any(c.status))
+no_deadlocks = timewinder.ForAll(CondWait, lambda c: any(c.status.values()))
 
 
 ev = timewinder.Evaluator(
     objects=[runnable, bqueue],
     specs=[no_deadlocks],
-    threads=threads,
+    threads=producers + consumers,
+    # Producers are interchangeable, as are consumers
+    symmetry=[producers, consumers],
 )
 
 
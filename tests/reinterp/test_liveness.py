@@ -0,0 +1,72 @@
+import timewinder
+
+from timewinder.generators import Set
+from timewinder.reinterp.process import BytecodeProcess
+
+from tests.reinterp.test_practical_tla_chap_1_reinterp import Account
+from tests.reinterp.test_reinterp import bytecodeClosure
+
+
+def test_dead_locals():
+    def f(acc, n):
+        total = n + 1
+        yield "Step"
+        acc["total"] = total
+        yield "Stored"
+
+    proc = bytecodeClosure(f)({}, 2)
+    proc.execute(None)
+    # n isn't read again; the yielded value is popped unread
+    assert proc.pruned() == ["n"]
+    state = proc.get_state()
+    assert state[2:] == [b"\x05", {}, None, 3, None]
+    proc.execute(None)
+    assert sorted(proc.pruned()) == ["acc", "n", "total"]
+    proc.execute(None)
+    assert not proc.can_execute()
+    assert proc.get_state()[2:] == [b"\x00", None, None, None]
+
+
+def test_loop_liveness():
+    def f(n):
+        i = 0
+        while i < n:
+            last = i
+            yield "Step"
+            i = i + 1
+        return last
+
+    proc = bytecodeClosure(f)(3)
+    proc.execute(None)
+    # Read after the loop, so live throughout it
+    assert proc.pruned() == []
+
+
+def test_pruned_evaluation(monkeypatch):
+    @timewinder.process
+    def check_and_withdraw(sender, reciever, amt):
+        if amt <= sender.acc:
+            sender.acc = sender.acc - amt
+            yield "deposit"
+            reciever.acc = reciever.acc + amt
+
+    def run():
+        alice = Account("alice", 5)
+        bob = Account("bob", 5)
+        ev = timewinder.Evaluator(
+            objects=[alice, bob],
+            threads=[
+                check_and_withdraw(alice, bob, Set(range(1, 6))),
+                check_and_withdraw(alice, bob, Set(range(1, 6))),
+            ],
+        )
+        ev.evaluate(steps=None)
+        return ev.stats
+
+    pruned = run()
+    monkeypatch.setattr(BytecodeProcess, "prune_dead", False)
+    exact = run()
+    assert exact.states == 225
+    # Threads that are done no longer differ by the amount they moved
+    assert pruned.states == 179
+    assert pruned.final_states < exact.final_states
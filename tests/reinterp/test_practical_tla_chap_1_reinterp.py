@@ -4,6 +4,8 @@ import pytest
 from timewinder.generators import Set
 from timewinder.evaluation import ConstraintError
 from timewinder.evaluation import StutterConstraintError
+from timewinder.reinterp.opcodes import OpcodeInterpreter
+from timewinder.reinterp.process import BytecodeProcess
 
 
 @timewinder.object
@@ -66,7 +68,7 @@ def test_overdraft_initial_conditions():
 
 
 @pytest.mark.benchmark(group="practical_tla_1")
-def test_check_and_withdraw_reinterp(benchmark):
+def test_check_and_withdraw_reinterp(benchmark, monkeypatch):
     @timewinder.process
     def check_and_withdraw(sender, reciever, amt):
         if amt <= sender.acc:
@@ -93,7 +95,14 @@ def test_check_and_withdraw_reinterp(benchmark):
 
     stats = benchmark(reset_and_eval)
 
-    assert stats.states == 225
+    # Once a thread is done, or has skipped the withdrawal, its amt is dead.
+    # Pruning dead locals drops it from the state, so threads that differ
+    # only in the amount they no longer need collapse into a single state.
+    assert stats.states == 179
+
+    # Without pruning, those threads are all counted separately
+    monkeypatch.setattr(BytecodeProcess, "prune_dead", False)
+    assert reset_and_eval().states == 225
 
 
 def test_liveness_reinterp():
@@ -139,3 +148,28 @@ def test_liveness_reinterp():
         ev.replay_thunk(s.thunk)
 
     assert got_error
+
+
+def test_native_nondeterminism(monkeypatch):
+    @timewinder.process
+    def pick(sender, reciever):
+        amt = Set(range(1, 4))
+        sender.acc = sender.acc - amt
+        yield "deposit"
+        reciever.acc = reciever.acc + amt
+
+    def run(native):
+        monkeypatch.setattr(OpcodeInterpreter, "native_blocks", native)
+        alice = Account("alice", 5)
+        bob = Account("bob", 5)
+        ev = timewinder.Evaluator(
+            objects=[alice, bob],
+            threads=[pick(alice, bob), pick(bob, alice)],
+        )
+        ev.evaluate()
+        return ev.stats
+
+    # The choice pauses the process in the middle of a native block
+    native = run(True)
+    assert native.states == 64
+    assert native == run(False)
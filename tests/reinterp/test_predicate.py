@@ -0,0 +1,58 @@
+import timewinder
+import timewinder.reinterp.predicate as interpreted
+
+from timewinder.closure import Closure
+from timewinder.functions import ThreadID
+from timewinder.reinterp.predicate import InterpretedPredicate
+
+from tests.reinterp.test_practical_tla_chap_1_reinterp import Account
+
+
+def consistent_total(a, b):
+    total = a.acc + b.acc
+    return total == 10
+
+
+def test_native_predicate(monkeypatch):
+    alice = Account("alice", 5)
+    bob = Account("bob", 5)
+
+    @timewinder.process
+    def withdraw(sender, amt):
+        sender.acc = sender.acc - amt
+
+    ev = timewinder.Evaluator(objects=[alice, bob], threads=[withdraw(alice, 3)])
+    sc = ev.state_controller
+
+    native = Closure(consistent_total, InterpretedPredicate)(alice, b=bob)
+    monkeypatch.setattr(interpreted, "_needs_interpreter", lambda f: True)
+    interp = Closure(consistent_total, InterpretedPredicate)(alice, bob)
+    assert native.native
+    assert not interp.native
+
+    # Checked again for every state, reading the objects as they are
+    for p in (native, interp):
+        assert p.check(sc) is True
+    alice.acc = 2
+    for p in (native, interp):
+        assert p.check(sc) is False
+    alice.acc = 5
+    for p in (native, interp):
+        assert p.check(sc) is True
+
+    sc.accessed = set()
+    native.check(sc)
+    assert sc.accessed == {"alice", "bob"}
+
+
+def test_interpreted_predicate():
+    def own_thread(a):
+        return a.acc == ThreadID()
+
+    def owns_any(objects):
+        return any(ThreadID() == o for o in objects)
+
+    alice = Account("alice", 5)
+    # Tagged functions only mean something to the interpreter
+    assert not Closure(own_thread, InterpretedPredicate)(alice).native
+    assert not Closure(owns_any, InterpretedPredicate)([]).native
@@ -0,0 +1,60 @@
+import pytest
+import timewinder
+
+from timewinder.generators import Set
+
+from tests.reinterp.test_practical_tla_chap_1_reinterp import Account
+
+
+@timewinder.process
+def check_and_withdraw(sender, reciever, amt):
+    if amt <= sender.acc:
+        sender.acc = sender.acc - amt
+        yield "deposit"
+        reciever.acc = reciever.acc + amt
+
+
+def withdraw_example():
+    alice = Account("alice", 5)
+    bob = Account("bob", 5)
+    return timewinder.Evaluator(
+        objects=[alice, bob],
+        threads=[
+            check_and_withdraw(alice, bob, Set(range(1, 6))),
+            check_and_withdraw(alice, bob, Set(range(1, 6))),
+        ],
+    )
+
+
+def test_profile(capsys):
+    exact = withdraw_example()
+    exact.evaluate(steps=None)
+    assert exact.profile is None
+
+    ev = withdraw_example()
+    ev.evaluate(steps=None, profile=True)
+    assert ev.stats.states == exact.stats.states
+    assert all(t.interp.ops.profile is None for t in ev.threads)
+
+    assert ev.profile is not None
+    (f,) = ev.profile.functions.values()
+    count, secs = f.total()
+    assert secs > 0
+    # Every process starts with the comparison on the function's first line
+    first = check_and_withdraw.func.__code__.co_firstlineno
+    lines = f.by_line()
+    assert set(lines) == {first + 2, first + 3, first + 4, first + 5}
+    assert lines[first + 2][0] == f.by_offset()[0][2] * f.lines().count(first + 2)
+    ops = f.by_opcode()
+    assert ops["YIELD_VALUE"][0] > 0
+    assert sum(n for n, _ in ops.values()) == count
+
+    out = capsys.readouterr().out
+    assert "check_and_withdraw" in out
+    assert "reciever.acc = reciever.acc + amt" in out
+
+
+def test_profile_options():
+    ev = withdraw_example()
+    with pytest.raises(ValueError):
+        ev.evaluate(workers=2, profile=True)
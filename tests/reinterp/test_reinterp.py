@@ -1,14 +1,23 @@
+import dis
 import pytest
+import sys
+import timewinder
+import timewinder.statetree.controller as controller
 
+from timewinder.reinterp.opcodes import OpcodeInterpreter
 from timewinder.reinterp.process import BytecodeProcess
 from timewinder.closure import Closure
 from timewinder.functions import Await
+from timewinder.statetree import MemoryCAS
 
 
 def bytecodeClosure(func):
     return Closure(func, BytecodeProcess)
 
 
+OFFSET = 1
+
+
 def Call(x, y):
     pass
     with x in y as foo:
@@ -78,3 +87,121 @@ def test_yield():
     proc.execute(None)
     assert proc.name == "f@Step 2"
     proc.execute(None)
+
+
+def test_decoded_dispatch():
+    def f(n):
+        total = 0
+        i = 0
+        while i < n:
+            if i > 4:
+                total = total + i
+            i = i + 1
+        return total
+
+    a = bytecodeClosure(f)
+    p1 = a(10)
+    p2 = a(10)
+    # Decoded once per function, with jumps as instruction indices
+    assert p1.interp.code is p2.interp.code
+    code = p1.interp.code
+    for inst, arg in zip(code.instructions, code.args):
+        if inst.opcode in dis.hasjabs or inst.opcode in dis.hasjrel:
+            assert code.instructions[arg].offset == inst.argval
+    p1.execute(None)
+    assert p1.interp.return_val == 35
+
+
+def test_native_blocks(monkeypatch):
+    def f(acc, n):
+        total = 0
+        i = 0
+        while i < n:
+            if i > 4:
+                total = total + i
+                acc["total"] = total
+                yield "Step"
+            i = i + 1
+        return total
+
+    def states(native):
+        monkeypatch.setattr(OpcodeInterpreter, "native_blocks", native)
+        proc = bytecodeClosure(f)({}, 8)
+        out = []
+        while proc.can_execute():
+            proc.execute(None)
+            out.append((proc.name, proc.get_state()))
+        return out, proc.interp.return_val
+
+    # Each step stops where, and with the state, interpretation would
+    assert states(True) == states(False)
+    assert states(True)[1] == 18
+
+
+def test_native_block_raises(monkeypatch):
+    def f(x):
+        y = x + 1
+        return x + (y - "a")
+
+    def failure(native):
+        monkeypatch.setattr(OpcodeInterpreter, "native_blocks", native)
+        proc = bytecodeClosure(f)(2)
+        with pytest.raises(timewinder.ProcessException) as info:
+            proc.execute(None)
+        ops = proc.interp.ops
+        return info.value.info, ops.pc, list(ops.stack)
+
+    # Raised in the middle of a block, after it stored y and loaded x
+    info, pc, stack = failure(True)
+    code = bytecodeClosure(f)(2).interp.code
+    assert code.instructions[pc].opname == "BINARY_SUBTRACT"
+    assert info.endswith(f"@{pc}")
+    assert stack == [2]
+    assert failure(True) == failure(False)
+
+
+@pytest.mark.parametrize("native", [False, True])
+def test_rebound_global(monkeypatch, native):
+    monkeypatch.setattr(OpcodeInterpreter, "native_blocks", native)
+
+    def f(n):
+        total = n + OFFSET
+        return total
+
+    def run():
+        proc = bytecodeClosure(f)(1)
+        proc.execute(None)
+        return proc.interp.return_val
+
+    assert run() == 2
+    # Between runs of the same function, which share its decoded code
+    monkeypatch.setattr(sys.modules[__name__], "OFFSET", 10)
+    assert run() == 11
+
+
+@pytest.mark.parametrize("lazy_restore", [False, True])
+def test_slot_state(monkeypatch, lazy_restore):
+    monkeypatch.setattr(BytecodeProcess, "prune_dead", False)
+
+    def f(acc, n):
+        _scratch = 1
+        total = n + _scratch
+        yield "Step"
+        return total
+
+    proc = bytecodeClosure(f)({"k": [1]}, 2)
+    proc.execute(None)
+    state = proc.get_state()
+    # pc, step name, the bitmap of assigned slots, the slots, then the stack
+    assert state == [proc.interp.pc, "Step", b"\x0b", {"k": [1]}, 2, None, 3, "Step"]
+
+    cas = MemoryCAS()
+    cas.lazy_restore = lazy_restore
+    (h,) = controller.flatten_to_cas(state, cas)
+    restored = bytecodeClosure(f)({}, 0)
+    restored.register_cas(cas)
+    restored.set_state(h)
+    assert restored.name == "f@Step"
+    assert restored.interp.locals() == {"acc": {"k": [1]}, "n": 2, "total": 3}
+    restored.execute(None)
+    assert restored.interp.return_val == 3
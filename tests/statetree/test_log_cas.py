@@ -0,0 +1,105 @@
+import os
+import pytest
+import timewinder.statetree.controller as controller
+
+from timewinder.statetree import Hash
+from timewinder.statetree import LogCAS
+from timewinder.statetree.log_cas import _OffsetIndex
+
+from tests.statetree.test_statetree import example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+def test_log_roundtrip(tmp_path):
+    path = str(tmp_path / "cas.log")
+    c = LogCAS(path)
+    h = list(controller.flatten_to_cas(example, c))[0]
+    c.put(h, c.get(h))
+    assert c.size() == 3
+    assert c.restore(h) == example
+    with pytest.raises(KeyError):
+        c.get(Hash(b"\x00" * 32))
+
+    # Other processes can follow along
+    reader = LogCAS(path, readonly=True)
+    assert reader.restore(h) == example
+    nh = Hash(b"\x01" * 32)
+    c.put(nh, [1, "two"])
+    assert reader.get(nh) == [1, "two"]
+    with pytest.raises(TypeError):
+        reader.put(nh, [])
+    reader.close()
+    c.close()
+
+    reopened = LogCAS(path)
+    assert reopened.size() == 4
+    assert reopened.restore(h) == example
+    assert [k for k, _ in reopened.items()][-1] == nh.bytes
+    reopened.close()
+
+
+def test_log_torn_write(tmp_path):
+    path = str(tmp_path / "cas.log")
+    c = LogCAS(path)
+    h = list(controller.flatten_to_cas(example, c))[0]
+    c.close()
+    whole = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b"\x20\x00\x10")
+
+    c = LogCAS(path)
+    assert c.size() == 3
+    assert os.path.getsize(path) == whole
+    assert c.restore(h) == example
+    c.close()
+
+
+def test_log_durable(tmp_path, monkeypatch):
+    syncs = []
+    sync = LogCAS._sync
+
+    def recording(self, start, end):
+        # Whether the record's header was written yet
+        syncs.append((start, end, self._map[self._end] != 0))
+        sync(self, start, end)
+
+    monkeypatch.setattr(LogCAS, "_sync", recording)
+    path = str(tmp_path / "cas.log")
+    c = LogCAS(path, durable=True)
+    h = list(controller.flatten_to_cas(example, c))[0]
+    assert len(syncs) == 2 * 3
+    # Each body goes to disk before its header is written
+    for (_, _, header), (_, _, header_after) in zip(syncs[::2], syncs[1::2]):
+        assert not header and header_after
+    c.close()
+
+    c = LogCAS(path)
+    assert c.restore(h) == example
+    c.close()
+
+
+def test_offset_index():
+    index = _OffsetIndex(capacity=4)
+    # Share a fingerprint, so both candidates have to be checked
+    a = b"\x05" * 8 + b"a"
+    b = b"\x05" * 8 + b"b"
+    index.add(a, 10)
+    index.add(b, 20)
+    for i in range(100):
+        index.add(i.to_bytes(8, "little") + b"x", i)
+    assert len(index) == 102
+    assert sorted(index.candidates(b)) == [10, 20]
+    assert list(index.candidates((7).to_bytes(8, "little"))) == [7]
+
+
+def test_log_evaluation(tmp_path):
+    exact = transmit_example(Queue(4))
+    exact.evaluate(steps=None)
+
+    c = LogCAS(str(tmp_path / "cas.log"))
+    ev = transmit_example(Queue(4), cas=c)
+    ev.evaluate(steps=None)
+    assert ev.stats.states == exact.stats.states
+    assert ev.stats.cas_objects == exact.stats.cas_objects
+    c.close()
@@ -0,0 +1,70 @@
+import multiprocessing
+import pytest
+import timewinder
+import timewinder.statetree.controller as controller
+
+from timewinder.statetree import Hash
+from timewinder.statetree import SharedMemoryCAS
+
+from tests.statetree.test_statetree import example
+from tests.test_blocking_queue import bounded_queue_example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+def _put_range(c, start, n):
+    for i in range(start, start + n):
+        c.put(Hash(i.to_bytes(32, "big")), [i, "node"])
+
+
+def test_shared_roundtrip():
+    c = SharedMemoryCAS(arena_size=1 << 16, slots=64, stripes=4)
+    h = list(controller.flatten_to_cas(example, c))[0]
+    c.put(h, c.get(h))
+    assert c.size() == 3
+    assert c.restore(h) == example
+    assert [k for k, _ in c.items()][-1] == h.bytes
+    with pytest.raises(KeyError):
+        c.get(Hash(b"\x00" * 32))
+    with pytest.raises(MemoryError):
+        _put_range(c, 0, 64)
+    c.close()
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_shared_processes(method):
+    c = SharedMemoryCAS(arena_size=1 << 20, slots=1 << 10)
+    ctx = multiprocessing.get_context(method)
+    # Overlapping ranges, so some nodes are put by several processes
+    procs = [ctx.Process(target=_put_range, args=(c, 100 * i, 200)) for i in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+    assert c.size() == 400
+    assert c.get(Hash((250).to_bytes(32, "big"))) == [250, "node"]
+    assert len(list(c.items())) == 400
+    c.close()
+
+
+def test_shared_parallel_evaluation():
+    exact = transmit_example(Queue(6))
+    exact.evaluate(steps=None)
+
+    c = SharedMemoryCAS(arena_size=1 << 20, slots=1 << 12)
+    ev = transmit_example(Queue(6), cas=c)
+    ev.evaluate(steps=None, workers=2)
+    assert ev.stats.states == exact.stats.states
+    # Stored once, rather than once per worker
+    assert ev.stats.cas_objects == exact.stats.cas_objects
+    c.close()
+
+
+def test_shared_parallel_violation():
+    c = SharedMemoryCAS(arena_size=1 << 20, slots=1 << 12)
+    ev = bounded_queue_example(2, 1, 1, cas=c)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        ev.evaluate(steps=None, workers=2)
+    ev.replay_thunk(info.value.thunk)
+    c.close()
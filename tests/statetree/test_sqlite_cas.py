@@ -0,0 +1,66 @@
+import timewinder.statetree.controller as controller
+
+from timewinder.statetree import Hash
+from timewinder.statetree import SQLiteCAS
+from timewinder.statetree import ThreadRef
+
+from tests.statetree.test_statetree import example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+def test_sqlite_roundtrip(tmp_path):
+    c = SQLiteCAS(str(tmp_path / "cas.db"), cache_size=1, batch_size=2)
+    h = list(controller.flatten_to_cas(example, c))[0]
+    assert c.size() == 3
+    assert c.restore(h) == example
+
+    node = {"t": ThreadRef(1), "h": Hash(b"\x00" * 32), 3: [b"x", 1.5]}
+    nh = Hash(b"\x01" * 32)
+    c.put(nh, node)
+    c.put(nh, node)
+    assert c.size() == 4
+    got = c.get_many([nh, h])
+    assert got[0] == node
+    assert isinstance(got[0]["t"], ThreadRef)
+    assert got[1] == c.get(h)
+    c.close()
+
+    # Everything is still there for the next run to read
+    reopened = SQLiteCAS(str(tmp_path / "cas.db"))
+    assert reopened.size() == 4
+    assert reopened.restore(h) == example
+    assert [k for k, _ in reopened.items()][-1] == nh.bytes
+    reopened.close()
+
+
+def test_sqlite_batched_restore(tmp_path):
+    c = SQLiteCAS(str(tmp_path / "cas.db"), cache_size=1)
+    tree = {"rows": [{"id": i, "tags": [i]} for i in range(20)], "meta": {"n": 20}}
+    (h,) = controller.flatten_to_cas(tree, c)
+    c.flush()
+    c._cache.clear()
+    queries = []
+    c._db.set_trace_callback(queries.append)
+    assert c.restore(h) == tree
+    # One query for the top, then one for each layer below it
+    assert len(queries) == 1 + 3
+
+    # Put again once it's left the cache, it isn't written again
+    top = c.get(h)
+    c._cache.clear()
+    c.put(h, top)
+    assert len(c._pending) == 0
+    c.close()
+
+
+def test_sqlite_evaluation(tmp_path):
+    exact = transmit_example(Queue(4))
+    exact.evaluate(steps=None)
+
+    c = SQLiteCAS(str(tmp_path / "cas.db"), cache_size=16, batch_size=8)
+    ev = transmit_example(Queue(4), cas=c)
+    ev.evaluate(steps=None)
+    assert ev.stats.states == exact.stats.states
+    assert ev.stats.cas_objects == exact.stats.cas_objects
+    c.close()
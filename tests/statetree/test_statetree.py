@@ -1,7 +1,18 @@
+import pytest
+import random
 import timewinder.statetree.cas as cas
 import timewinder.statetree.controller as controller
 import timewinder.generators as gen
 
+from timewinder.statetree import Hash
+from timewinder.statetree.tree import HASH_FUNCTIONS
+from timewinder.statetree.tree import InternTable
+from timewinder.statetree.tree import hash_flat_tree
+from timewinder.statetree.tree import serialize_flat_tree
+
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
 
 example = {
     "name": "a",
@@ -27,7 +38,7 @@ def test_convert_tree():
 
 def test_flatten_to_cas_microbenchmark(benchmark):
     c = cas.MemoryCAS()
-    benchmark(controller.flatten_to_cas, example, c)
+    benchmark(lambda: list(controller.flatten_to_cas(example, c)))
 
 
 def test_flatten_generator(benchmark):
@@ -38,7 +49,7 @@ def test_flatten_generator(benchmark):
 
     c = cas.MemoryCAS()
 
-    shas = list(benchmark(controller.flatten_to_cas, generator, c))
+    shas = benchmark(lambda: list(controller.flatten_to_cas(generator, c)))
     assert len(shas) == 20
     assert len(c.store) == 20
 
@@ -57,7 +68,7 @@ def test_nested_generator(benchmark):
 
     c = cas.MemoryCAS()
 
-    shas = list(benchmark(controller.flatten_to_cas, generator, c))
+    shas = benchmark(lambda: list(controller.flatten_to_cas(generator, c)))
     assert len(shas) == 20
     assert len(c.store) == 25
 
@@ -105,3 +116,155 @@ def test_generator_of_generators():
     shas = list(controller.flatten_to_cas(g, c))
     assert len(shas) == 4
     assert len(set(shas)) == 1
+
+
+def test_streamed_choices():
+    c = cas.MemoryCAS()
+    g = {"a": gen.Range(10**9), "b": gen.Range(2)}
+    # Nothing is expanded until it's asked for
+    shas = controller.flatten_to_cas(g, c)
+    first = next(shas)
+    assert c.get(first) == {"a": 0, "b": 0}
+    assert len(c.store) == 1
+
+    firsts = list(controller.flatten_to_cas(g, c, max_choices=3))
+    assert [c.get(h)["a"] for h in firsts] == [0, 0, 1, 1, 2, 2]
+
+    rng = random.Random(4)
+    sampled = list(controller.flatten_to_cas(g, c, max_choices=3, rng=rng))
+    assert len(sampled) == 6
+    assert all(c.get(h)["a"] < 10**9 for h in sampled)
+    assert sampled != firsts
+    again = list(controller.flatten_to_cas(g, c, 3, random.Random(4)))
+    assert again == sampled
+
+    # Every key is streamed, not only the first
+    g = {"a": gen.Range(10**9), "b": [gen.Range(10**9)], "c": gen.Range(10**9)}
+    shas = controller.flatten_to_cas(g, c)
+    firsts = [next(shas) for _ in range(3)]
+    assert [c.restore(h)["c"] for h in firsts] == [0, 1, 2]
+
+    # Later keys are gone through again for each choice before them
+    g = {"a": gen.Range(2), "b": gen.Set(x for x in "xy"), "c": [gen.Range(2)]}
+    shas = list(controller.flatten_to_cas(g, c))
+    assert len(set(shas)) == 8
+
+
+def test_packed_store():
+    c = cas.MemoryCAS(packed=True, compress_after=1)
+    h = list(controller.flatten_to_cas(example, c))[0]
+    assert h == list(controller.flatten_to_cas(example, cas.MemoryCAS()))[0]
+    assert all(isinstance(v, bytes) for v in c.store.values())
+    assert c.restore(h) == example
+
+    node = ["row", 1, True, Hash(b"\x00" * 32)] * 100
+    hn = c.put_tree(node)
+    assert c.get(hn) == node
+    # Cold nodes are compressed, if that makes them any smaller
+    c.put(Hash(b"\x01" * 32), ["other"])
+    assert len(c.store[hn.bytes]) < len(serialize_flat_tree(node))
+    assert c.get(hn) == node
+    assert dict(c.items())[hn.bytes] == node
+
+    with pytest.raises(ValueError):
+        cas.MemoryCAS(compress_after=10)
+
+
+@pytest.mark.parametrize("strategy", ["bfs", "dfs"])
+def test_packed_evaluation(strategy):
+    exact = transmit_example(Queue(6))
+    exact.evaluate(steps=None, strategy=strategy)
+
+    c = cas.MemoryCAS(packed=True, compress_after=8)
+    ev = transmit_example(Queue(6), cas=c, collect_garbage=strategy == "dfs")
+    ev.evaluate(steps=None, strategy=strategy)
+    assert ev.stats.states == exact.stats.states
+    if strategy == "bfs":
+        assert ev.stats.cas_objects == exact.stats.cas_objects
+
+
+def test_restore_cache():
+    c = cas.MemoryCAS()
+    c.restore_cache = cas.RestoreCache(size=1 << 12)
+    h = list(controller.flatten_to_cas(example, c))[0]
+    assert c.get_shared(h) is c.get_shared(h)
+    assert c.restore_cache.hits == 1
+
+    # Restores hand out copies that are safe to change, made as they're read
+    c.restore_cache = cas.RestoreCache(size=1 << 12)
+    mine = c.restore(h)
+    assert c.restore_cache.misses == 1
+    mine["vals"].append(4)
+    mine["more"]["foo"] = 0
+    assert c.restore_cache.misses == 3
+    assert c.restore(h) == example
+    assert c.restore_cache.misses == 3
+    (h2,) = controller.flatten_to_cas(c.restore(h), c)
+    assert h2 == h
+
+    # Only roughly size bytes of the most recent nodes are kept
+    for i in range(100):
+        c.get_shared(c.put_tree({"x": list(range(i, i + 10))}))
+    assert 0 < c.restore_cache.bytes <= 1 << 12
+    c.get_shared(h)
+    assert c.restore_cache.misses == 3 + 100 + 1
+
+
+def test_restore_cache_stats():
+    uncached = transmit_example(Queue(6), restore_cache=0)
+    uncached.evaluate(steps=None)
+    assert uncached.stats.restore_hits == 0
+
+    ev = transmit_example(Queue(6))
+    ev.evaluate(steps=None)
+    assert ev.stats.states == uncached.stats.states
+    assert ev.stats.restore_hits > ev.stats.restore_misses > 0
+
+
+@pytest.mark.parametrize("name", sorted(HASH_FUNCTIONS))
+def test_hash_microbenchmark(benchmark, name):
+    node = {"name": "a", "vals": [1, 2, 3], "foo": 2.5, "ok": True, "nope": None}
+    h = benchmark(hash_flat_tree, node, HASH_FUNCTIONS[name])
+    assert len(h.bytes) >= 16
+
+
+@pytest.mark.parametrize("name", sorted(HASH_FUNCTIONS))
+def test_hash_function_evaluation(name):
+    default = transmit_example(Queue(6))
+    default.evaluate(steps=None)
+
+    ev = transmit_example(Queue(6), hash_function=name)
+    ev.evaluate(steps=None)
+    assert ev.stats.states == default.stats.states
+    assert ev.stats.cas_objects == default.stats.cas_objects
+    h = ev._graph[0].hash
+    assert len(h.bytes) == len(HASH_FUNCTIONS[name](b""))
+
+
+def test_intern_table():
+    t = InternTable(size=2)
+    node = {"pc": 3, "state": Hash(b"\x01" * 32), "ok": True}
+    assert t.hash(node) == hash_flat_tree(node)
+    assert t.hash(dict(node)) == hash_flat_tree(node)
+    assert (t.hits, t.misses) == (1, 1)
+    assert t.hit_rate() == 0.5
+
+    # Equal, but serialized differently
+    for a, b in [
+        ([1], [True]),
+        ([0.0], [-0.0]),
+        ({1: "a"}, {True: "a"}),
+        ({"p": (1, 2)}, {"p": (True, 2)}),
+        ([(0.0,)], [(-0.0,)]),
+    ]:
+        assert t.hash(a) == hash_flat_tree(a)
+        assert t.hash(b) == hash_flat_tree(b)
+        assert t.hash(a) != t.hash(b)
+
+    # Unhashable inside a tuple
+    node = {"p": (1, [2])}
+    assert t.hash(node) == hash_flat_tree(node)
+
+    assert len(t._hashes) == 2
+    big = list(range(100))
+    assert t.hash(big) == hash_flat_tree(big)
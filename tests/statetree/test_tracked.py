@@ -0,0 +1,202 @@
+import copy
+import heapq
+import timewinder
+
+from timewinder.statetree import Hash
+from timewinder.statetree import MemoryCAS
+from timewinder.statetree import StateController
+from timewinder.statetree.tracked import LazyDict
+from timewinder.statetree.tracked import LazyList
+from timewinder.statetree.tracked import TrackedDict
+from timewinder.statetree.tracked import TrackedList
+from timewinder.statetree.tracked import track
+
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+def test_tracked_containers_notify():
+    changes = []
+    tree = track({"a": [1, 2], "b": {"c": 3}}, lambda: changes.append(1))
+    assert isinstance(tree, TrackedDict)
+    assert isinstance(tree["a"], TrackedList)
+
+    _ = tree["a"][0], tree["b"]["c"], len(tree["a"])
+    assert len(changes) == 0
+    tree["a"].append(3)
+    tree["b"].pop("c")
+    tree["a"].extend([4])
+    assert len(changes) == 3
+    assert tree == {"a": [1, 2, 3, 4], "b": {}}
+
+    plain = copy.copy(tree["a"])
+    assert type(plain) is list
+    plain.append(5)
+    assert len(changes) == 3
+
+
+@timewinder.object
+class Box:
+    def __init__(self):
+        self.items = []
+        self.count = 0
+
+    def add(self, x):
+        self.items.append(x)
+
+    def bump(self):
+        self.count = self.count + 1
+
+
+def test_clean_objects_reuse_hash():
+    box = Box()
+    other = Box()
+    sc = StateController(MemoryCAS())
+    sc.mount("box", box)
+    sc.mount("other", other)
+    (h,) = sc.commit()
+    sc.restore(h)
+
+    assert sc.commit() == [h]
+    box.add(1)
+    assert box.get_state() == {"items": [1], "count": 0}
+    # Untouched, it still stands for its restored hash
+    assert other.get_state() == sc.cas.get(h)["other"]
+    (h2,) = sc.commit()
+    assert h2 != h
+
+    sc.restore(h)
+    box.bump()
+    (h3,) = sc.commit()
+    sc.restore(h)
+    assert box.items == [] and box.count == 0
+    sc.restore(h3)
+    assert box.count == 1
+
+
+@timewinder.object
+class Heap:
+    def __init__(self):
+        self.h = [3, 5]
+        self.size = 2
+
+    def push(self, x):
+        heapq.heappush(self.h, x)
+
+
+def test_untracked_mutation():
+    heap = Heap()
+    sc = StateController(MemoryCAS())
+    sc.mount("heap", heap)
+    (h,) = sc.commit()
+
+    # Written to directly, past the list's own methods
+    sc.restore(h)
+    heapq.heappush(heap.h, 1)
+    (h2,) = sc.commit()
+    assert sc.cas.restore(h2)["heap"]["h"] == [1, 5, 3]
+
+    sc.restore(h)
+    heap.push(4)
+    (h3,) = sc.commit()
+    assert sc.cas.restore(h3)["heap"]["h"] == [3, 5, 4]
+
+    # Reading a scalar can't change it
+    sc.restore(h)
+    assert heap.size == 2
+    assert heap.get_state() == sc.cas.get(h)["heap"]
+
+
+class CountingCAS(MemoryCAS):
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+
+    def get(self, sha):
+        self.gets += 1
+        return super().get(sha)
+
+
+@timewinder.object
+class Table:
+    def __init__(self, n):
+        self.rows = [{"id": i, "tags": [i]} for i in range(n)]
+        self.meta = {"name": "t"}
+        self.count = 0
+
+
+def test_lazy_restore_reads_only_whats_used():
+    cas = CountingCAS()
+    cas.lazy_restore = True
+    table = Table(100)
+    sc = StateController(cas)
+    sc.mount("table", table)
+    (h,) = sc.commit()
+    eager = sc.cas.restore(h)
+
+    table.count = 5
+    sc.restore(h)
+    cas.gets = 0
+    assert table.count == 0
+    assert table.rows[7]["tags"] == [7]
+    # The list of rows with each row in it, then the tags of the one read
+    assert cas.gets == 1 + 100 + 1
+    assert not isinstance(table.rows, LazyList)
+    assert isinstance(table.rows[7], LazyDict)
+
+    # Nothing changed, so the same state, without flattening
+    assert sc.commit() == [h]
+    table.count = 0
+    # Dirty, but the unread subtrees are committed as their Hashes
+    cas.gets = 0
+    assert sc.commit() == [h]
+    assert cas.gets == 0
+
+    table.rows[3]["tags"].append(4)
+    table.meta["size"] = 100
+    (h2,) = sc.commit()
+    expected = copy.deepcopy(eager["table"])
+    expected["rows"][3]["tags"].append(4)
+    expected["meta"]["size"] = 100
+    assert sc.cas.restore(h2)["table"] == expected
+
+    sc.restore(h)
+    assert list(table.rows) == eager["table"]["rows"]
+    assert table.rows == eager["table"]["rows"]
+    assert dict(table.meta) == {"name": "t"}
+    assert table.rows.pop()["id"] == 99
+    assert sorted(table.rows, key=lambda r: -r["id"])[0]["id"] == 98
+
+
+@timewinder.object
+class Grid:
+    def __init__(self, n):
+        self.cells = [[i, {"n": i}] for i in range(n)]
+
+
+def test_lazy_restore_concatenation():
+    cas = MemoryCAS()
+    cas.lazy_restore = True
+    grid = Grid(3)
+    sc = StateController(cas)
+    sc.mount("grid", grid)
+    (h,) = sc.commit()
+    eager = sc.cas.restore(h)["grid"]["cells"]
+
+    sc.restore(h)
+    # Straight out of the list's storage, with nothing read from it before
+    joined = [[9]] + grid.cells
+    assert not any(isinstance(c, Hash) for c in joined)
+    assert joined == [[9]] + eager
+    joined = [[9]] + grid.cells[2]
+    assert joined[2] == {"n": 2}
+
+
+def test_lazy_restore_evaluation():
+    eager = transmit_example(Queue(6))
+    eager.evaluate(steps=None)
+
+    ev = transmit_example(Queue(6), lazy_restore=True)
+    ev.evaluate(steps=None)
+    assert ev.stats.states == eager.stats.states
+    assert ev.stats.thread_executions == eager.stats.thread_executions
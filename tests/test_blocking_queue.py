@@ -66,7 +66,7 @@ def consumer(queue, running, id):
             running.notify(wake_id)
 
 
-def bounded_queue_example(n_producers, n_consumers, queue_size):
+def bounded_queue_example(n_producers, n_consumers, queue_size, **kwargs):
     n_threads = n_producers + n_consumers
     runnable = CondWait(n_producers, n_consumers)
     bqueue = BoundedQueue(queue_size)
@@ -84,6 +84,7 @@ def bounded_queue_example(n_producers, n_consumers, queue_size):
         objects=[runnable, bqueue],
         specs=[no_deadlocks],
         threads=threads,
+        **kwargs,
     )
 
 
@@ -0,0 +1,137 @@
+import msgpack
+import os
+import pytest
+import timewinder
+import timewinder.statetree.controller as controller
+
+from timewinder.statetree import LogCAS
+from timewinder.statetree import MemoryCAS
+from timewinder.statetree import SharedMemoryCAS
+from timewinder.statetree import SQLiteCAS
+
+from tests.statetree.test_statetree import example
+from tests.test_blocking_queue import bounded_queue_example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+class Crash(Exception):
+    pass
+
+
+def _example():
+    # Objects are mounted by name, so every run must build them the same way
+    q = Queue(6)
+    return transmit_example(q)
+
+
+def _crash_after(ev, n):
+    """Makes the Evaluator die part way through, as if the box went away"""
+    eval_state = ev._eval_state
+    count = [0]
+
+    def crashing(*args, **kwargs):
+        count[0] += 1
+        if count[0] > n:
+            raise Crash()
+        return eval_state(*args, **kwargs)
+
+    ev._eval_state = crashing
+
+
+@pytest.mark.parametrize("crash_at", [1, 20, 40])
+def test_resume_after_crash(tmp_path, crash_at):
+    full = _example()
+    full.evaluate(steps=None)
+
+    ev = _example()
+    _crash_after(ev, crash_at)
+    with pytest.raises(Crash):
+        ev.evaluate(steps=None, checkpoint=str(tmp_path), checkpoint_interval=0)
+    assert os.path.exists(tmp_path / "manifest.json")
+
+    resumed = _example()
+    resumed.evaluate(steps=None, checkpoint=str(tmp_path), resume=True)
+    assert resumed.stats.states == full.stats.states
+    assert resumed.stats.final_states == full.stats.final_states
+    assert resumed.stats.steps == full.stats.steps
+    assert len(resumed._graph) == len(full._graph)
+
+
+def test_resume_finds_violation(tmp_path):
+    full = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as full_err:
+        full.evaluate(steps=None)
+
+    ev = bounded_queue_example(2, 1, 1)
+    _crash_after(ev, 10)
+    with pytest.raises(Crash):
+        ev.evaluate(steps=None, checkpoint=str(tmp_path), checkpoint_interval=0)
+
+    resumed = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        resumed.evaluate(steps=None, checkpoint=str(tmp_path), resume=True)
+    assert info.value.thunk.trace == full_err.value.thunk.trace
+    resumed.replay_thunk(info.value.thunk)
+
+
+def test_resume_other_model(tmp_path):
+    ev = _example()
+    ev.evaluate(steps=2, checkpoint=str(tmp_path), checkpoint_interval=0)
+
+    other = bounded_queue_example(1, 1, 1)
+    with pytest.raises(ValueError):
+        other.evaluate(checkpoint=str(tmp_path), resume=True)
+
+
+def test_checkpoint_options():
+    ev = transmit_example(Queue(2))
+    with pytest.raises(ValueError):
+        ev.evaluate(checkpoint="unused", workers=2)
+    with pytest.raises(ValueError):
+        ev.evaluate(resume=True)
+
+
+@pytest.mark.parametrize("kind", ["memory", "packed", "log", "sqlite", "shared"])
+def test_cas_cursor(tmp_path, kind):
+    c = {
+        "memory": lambda: MemoryCAS(),
+        "packed": lambda: MemoryCAS(packed=True),
+        "log": lambda: LogCAS(str(tmp_path / "log")),
+        "sqlite": lambda: SQLiteCAS(str(tmp_path / "db")),
+        "shared": lambda: SharedMemoryCAS(arena_size=1 << 16, slots=64, stripes=4),
+    }[kind]()
+    assert list(c.items_since(0)) == []
+    (h,) = controller.flatten_to_cas(example, c)
+    cursor = c.cursor()
+    assert [k for k, _ in c.items_since(0)] == [k for k, _ in c.items()]
+    assert list(c.items_since(cursor)) == []
+    (h2,) = controller.flatten_to_cas({"x": [1], "more": example["more"]}, c)
+    # The new list and the new top, but not the node both trees share
+    new = list(c.items_since(cursor))
+    assert [k for k, _ in new][-1] == h2.bytes
+    assert len(new) == 2
+    assert new[0][1] == [1]
+    if kind != "memory" and kind != "packed":
+        c.close()
+
+
+def _rows(path):
+    with open(path, "rb") as f:
+        return list(msgpack.Unpacker(f, raw=False, strict_map_key=False))
+
+
+def test_checkpoints_are_incremental(tmp_path):
+    ev = _example()
+    ev.evaluate(steps=None, checkpoint=str(tmp_path), checkpoint_interval=0)
+    names = os.listdir(tmp_path)
+    cas_rows = sum(len(_rows(tmp_path / n)) for n in names if n.startswith("cas-"))
+    graph = sum(len(_rows(tmp_path / n)) for n in names if n.startswith("graph-"))
+    # Each node and state record is written once, however many checkpoints
+    assert cas_rows == ev.stats.cas_objects
+    assert graph == len(ev._graph)
+    # Only the queue segments from the last layer's on are kept
+    queues = sorted(n for n in names if n.startswith("queue-"))
+    layers = {s for n in queues for s, _ in _rows(tmp_path / n)}
+    assert len(queues) < len([n for n in names if n.startswith("cas-")])
+    assert min(layers) == ev.stats.steps
@@ -1,4 +1,5 @@
 import timewinder
+import random
 from timewinder.statetree import StateController
 from timewinder.statetree import MemoryCAS
 import timewinder.generators as gens
@@ -59,3 +60,43 @@ def test_cross_product_b():
     all_states = s.commit()
     states = list(all_states)
     assert len(states) == 144
+
+
+def test_sampled_choices():
+    s = gens.Set(x * x for x in range(100))
+    assert list(s.choices()) == [x * x for x in range(100)]
+
+    t = gens.Set(x * x for x in range(100))
+    picked = list(t.choices(5, random.Random(1)))
+    assert len(picked) == 5
+    assert len(set(picked)) == 5
+    assert all(p in [x * x for x in range(100)] for p in picked)
+
+    r = gens.Range(10**12)
+    assert list(r.choices(3)) == [0, 1, 2]
+    assert len(list(r.choices(3, random.Random(1)))) == 3
+
+
+def test_max_choices_evaluation():
+    @timewinder.object
+    class Counter:
+        def __init__(self):
+            self.n = gens.Range(10**6)
+
+    ctr = Counter()
+
+    @timewinder.process
+    def bump(c):
+        c.n = c.n + 1
+
+    ev = timewinder.Evaluator(objects=[ctr], threads=[bump(ctr)], max_choices=4)
+    ev.evaluate(steps=3)
+    assert ev.stats.states == 8
+
+    # A fresh object, as evaluating leaves the last state in the first
+    other = Counter()
+    sampled = timewinder.Evaluator(
+        objects=[other], threads=[bump(other)], max_choices=4, sample_seed=0
+    )
+    sampled.evaluate(steps=3)
+    assert sampled.stats.states == 8
@@ -0,0 +1,127 @@
+import pytest
+import timewinder
+
+from timewinder.generators import Set
+
+from tests.test_blocking_queue import bounded_queue_example
+
+
+@timewinder.object
+class Queue:
+    def __init__(self, transmit=4):
+        self.queue = []
+        self.to_transmit = transmit
+
+
+@timewinder.object
+class Account:
+    def __init__(self, name):
+        self.name = name
+        self.acc = 5
+
+
+def transmit_example(q, **kwargs):
+    @timewinder.process
+    def writer(q, max):
+        while q.to_transmit != 0:
+            yield "Write"
+            q.queue.append("msg")
+            q.to_transmit -= 1
+            while len(q.queue) >= max:
+                yield "Waiting"
+
+    @timewinder.process
+    def reader(q):
+        while q.to_transmit > 0 or len(q.queue) > 0:
+            yield "Read"
+            if len(q.queue) == 0:
+                continue
+            _ = q.queue[0]
+            q.queue = q.queue[1:]
+
+    @timewinder.predicate
+    def bounded_queue(q, size):
+        return len(q.queue) <= size
+
+    return timewinder.Evaluator(
+        objects=[q],
+        threads=[writer(q, 3), reader(q)],
+        specs=[bounded_queue(q, 3)],
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_matches_serial(workers):
+    serial = transmit_example(Queue(10))
+    serial.evaluate(steps=None)
+
+    parallel = transmit_example(Queue(10))
+    parallel.evaluate(steps=None, workers=workers)
+
+    s, p = serial.stats, parallel.stats
+    assert p.states == s.states
+    assert p.final_states == s.final_states
+    assert p.steps == s.steps
+    assert p.thread_executions == s.thread_executions
+    assert p.cas_objects >= s.cas_objects
+
+
+def test_parallel_step_limit():
+    serial = transmit_example(Queue(10))
+    serial.evaluate(steps=6)
+
+    parallel = transmit_example(Queue(10))
+    parallel.evaluate(steps=6, workers=2)
+    assert parallel.stats.states == serial.stats.states
+
+
+def test_parallel_violation():
+    ev = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        ev.evaluate(steps=None, workers=2)
+
+    err = info.value
+    assert err.state_id is not None
+    assert err.thunk.state_hash() == ev._graph[err.state_id].hash
+    ev.replay_thunk(err.thunk)
+
+
+def test_parallel_process_exception():
+    alice = Account("alice")
+
+    @timewinder.step
+    def withdraw(state, sender):
+        assert sender.acc - state["amt"] >= 0
+
+    alg = timewinder.FuncProcess(withdraw(alice), state={"amt": Set(range(1, 8))})
+    ev = timewinder.Evaluator(objects=[alice], threads=[alg])
+    with pytest.raises(AssertionError):
+        ev.evaluate(workers=2)
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_numbers_states_serially(workers):
+    serial = transmit_example(Queue(6))
+    serial.evaluate(steps=None)
+
+    parallel = transmit_example(Queue(6))
+    parallel.evaluate(steps=None, workers=workers)
+    assert len(parallel._graph) == len(serial._graph)
+    # Hashes differ between runs, as objects get fresh ids, but the shape of
+    # the graph doesn't.
+    for sid in range(len(serial._graph)):
+        p, s = parallel._graph[sid], serial._graph[sid]
+        assert (p.parent, p.thread_id, p.predicates) == (
+            s.parent,
+            s.thread_id,
+            s.predicates,
+        )
+
+
+def test_parallel_violation_matches_serial():
+    with pytest.raises(timewinder.ConstraintError) as serial:
+        bounded_queue_example(2, 1, 1).evaluate(steps=None)
+    with pytest.raises(timewinder.ConstraintError) as parallel:
+        bounded_queue_example(2, 1, 1).evaluate(steps=None, workers=3)
+    assert parallel.value.state_id == serial.value.state_id
@@ -0,0 +1,108 @@
+import pytest
+import timewinder
+
+from timewinder.generators import Set
+
+from tests.test_blocking_queue import bounded_queue_example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+@timewinder.object
+class Counter:
+    def __init__(self):
+        self.n = 0
+
+
+@timewinder.process
+def count_to(counter, total, limit):
+    while counter.n < limit:
+        yield "count"
+        counter.n = counter.n + 1
+        if counter.n == limit:
+            total.n = total.n + 1
+
+
+def counters_example(limit, shared):
+    a = Counter()
+    b = Counter()
+    c = Counter()
+    done = Counter()
+    a_done = Counter()
+    b_done = Counter()
+    c_done = Counter()
+    dones = [done] * 3 if shared else [a_done, b_done, c_done]
+    threads = [count_to(x, d, limit) for x, d in zip([a, b, c], dones)]
+    in_bounds = timewinder.ForAll(Counter, lambda x: x.n <= 3)
+    return timewinder.Evaluator(
+        objects=[a, b, c, done, a_done, b_done, c_done],
+        threads=threads,
+        specs=[in_bounds],
+    )
+
+
+def _compare(make, **kwargs):
+    full = make()
+    full.evaluate(steps=None, **kwargs)
+    reduced = make()
+    reduced.evaluate(steps=None, partial_order=True, **kwargs)
+    assert reduced.stats.states == full.stats.states
+    assert reduced.stats.final_states == full.stats.final_states
+    assert reduced.stats.thread_executions <= full.stats.thread_executions
+    return full.stats, reduced.stats
+
+
+def test_independent_threads():
+    full, reduced = _compare(lambda: counters_example(2, shared=False))
+    # Every order of the independent increments reaches the same states
+    assert reduced.thread_executions < full.thread_executions / 2
+
+
+def test_partially_shared_threads():
+    full, reduced = _compare(lambda: counters_example(3, shared=True))
+    assert reduced.thread_executions < full.thread_executions
+
+
+def test_dependent_threads():
+    _compare(lambda: transmit_example(Queue(4)))
+
+
+def test_nondeterministic_steps():
+    @timewinder.object
+    class Account:
+        def __init__(self):
+            self.acc = 5
+
+    def make():
+        accounts = [Account(), Account()]
+
+        @timewinder.step
+        def withdraw(state, account):
+            account.acc = account.acc - state["amt"]
+
+        threads = [
+            timewinder.FuncProcess(withdraw(a), state={"amt": Set(range(1, 4))})
+            for a in accounts
+        ]
+        return timewinder.Evaluator(objects=accounts, threads=threads)
+
+    _compare(make)
+
+
+def test_partial_order_keeps_violations():
+    full = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError):
+        full.evaluate(steps=None)
+
+    ev = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        ev.evaluate(steps=None, partial_order=True)
+    ev.replay_thunk(info.value.thunk)
+
+
+def test_partial_order_options():
+    ev = counters_example(1, shared=False)
+    with pytest.raises(ValueError):
+        ev.evaluate(partial_order=True, strategy="dfs")
+    with pytest.raises(ValueError):
+        ev.evaluate(partial_order=True, workers=2)
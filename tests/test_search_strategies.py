@@ -0,0 +1,95 @@
+import pytest
+import timewinder
+
+from timewinder.statetree import SQLiteCAS
+
+from tests.test_blocking_queue import bounded_queue_example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+@pytest.mark.parametrize("steps", [None, 3, 8])
+def test_dfs_visits_same_states(steps):
+    bfs = transmit_example(Queue(6))
+    bfs.evaluate(steps=steps)
+
+    dfs = transmit_example(Queue(6))
+    dfs.evaluate(steps=steps, strategy="dfs")
+
+    assert dfs.stats.states == bfs.stats.states
+    # Only the current path is kept once the search is done
+    assert len(dfs._graph) == 0
+
+
+def test_iddfs_visits_same_states():
+    bfs = transmit_example(Queue(6))
+    bfs.evaluate(steps=None)
+
+    iddfs = transmit_example(Queue(6))
+    iddfs.evaluate(steps=None, strategy="iddfs")
+
+    assert iddfs.stats.states == bfs.stats.states
+    assert iddfs.stats.steps == bfs.stats.steps
+
+
+@pytest.mark.parametrize("strategy", ["dfs", "iddfs"])
+@pytest.mark.parametrize("steps", [14, 16, 20, 30])
+def test_depth_first_final_states(strategy, steps):
+    bfs = transmit_example(Queue(5))
+    bfs.evaluate(steps=steps)
+
+    ev = transmit_example(Queue(5))
+    ev.evaluate(steps=steps, strategy=strategy)
+
+    # States reached again by a shorter path aren't counted twice
+    assert ev.stats.states == bfs.stats.states
+    assert ev.stats.final_states == bfs.stats.final_states
+
+
+@pytest.mark.parametrize("strategy", ["dfs", "iddfs"])
+def test_depth_first_violation(strategy):
+    bfs = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as bfs_err:
+        bfs.evaluate(steps=None)
+
+    ev = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        ev.evaluate(steps=None, strategy=strategy)
+
+    thunk = info.value.thunk
+    ev.replay_thunk(thunk)
+    if strategy == "iddfs":
+        assert len(thunk.trace) == len(bfs_err.value.thunk.trace)
+
+
+def test_unknown_strategy():
+    ev = transmit_example(Queue(2))
+    with pytest.raises(ValueError):
+        ev.evaluate(strategy="astar")
+    with pytest.raises(ValueError):
+        ev.evaluate(strategy="dfs", workers=2)
+
+
+@pytest.mark.parametrize("strategy", ["dfs", "iddfs"])
+def test_depth_first_collects_garbage(strategy):
+    exact = transmit_example(Queue(6))
+    exact.evaluate(steps=None, strategy=strategy)
+
+    ev = transmit_example(Queue(6), collect_garbage=True)
+    ev.evaluate(steps=None, strategy=strategy)
+    assert ev.stats.states == exact.stats.states
+    assert ev.stats.cas_reclaimed > 0
+    assert ev.stats.cas_objects < exact.stats.cas_objects
+    if strategy == "dfs":
+        # With the path unwound, nothing is left to keep
+        assert ev.stats.cas_objects == 0
+
+
+def test_collect_garbage_options(tmp_path):
+    ev = transmit_example(Queue(2), collect_garbage=True)
+    with pytest.raises(ValueError):
+        ev.evaluate(workers=2)
+    with pytest.raises(ValueError):
+        ev.evaluate(checkpoint=str(tmp_path))
+    with pytest.raises(ValueError):
+        transmit_example(Queue(2), cas=SQLiteCAS(":memory:"), collect_garbage=True)
@@ -0,0 +1,73 @@
+import hashlib
+import pytest
+import timewinder
+
+from timewinder.graph import PendingState
+from timewinder.spill import SpillingQueue
+from timewinder.spill import SpillingSet
+from timewinder.statetree import Hash
+
+from tests.test_blocking_queue import bounded_queue_example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+def _key(i):
+    return hashlib.sha256(str(i).encode()).digest()
+
+
+def test_spilling_set(tmp_path):
+    s = SpillingSet(str(tmp_path), threshold=10)
+    for i in range(1000):
+        if _key(i) not in s:
+            s.add(_key(i))
+    assert len(s) == 1000
+    # Merging keeps only logarithmically many runs
+    assert s.on_disk() >= 990
+    assert len(s._runs) <= 10
+    assert all(_key(i) in s for i in range(1000))
+    assert not any(_key(i) in s for i in range(1000, 2000))
+
+    s.clear()
+    assert len(s) == 0
+    assert _key(1) not in s
+
+
+def test_spilling_queue(tmp_path):
+    q = SpillingQueue(str(tmp_path), threshold=4)
+    states = [PendingState(Hash(_key(i)), i or None, i % 3, None) for i in range(11)]
+    q.extend(states[:6])
+    assert list(q) == states[:6]
+    q.extend(states[6:])
+    assert len(q) == 11
+    assert list(q) == states
+    q.close()
+
+
+@pytest.mark.parametrize("strategy", ["bfs", "dfs", "iddfs"])
+def test_spill_evaluation(tmp_path, strategy):
+    exact = transmit_example(Queue(6))
+    exact.evaluate(steps=None, strategy=strategy)
+
+    ev = transmit_example(Queue(6))
+    ev.evaluate(
+        steps=None, strategy=strategy, spill_dir=str(tmp_path), spill_threshold=5
+    )
+    assert ev.stats.states == exact.stats.states
+    assert ev.stats.thread_executions == exact.stats.thread_executions
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spill_violation(tmp_path):
+    ev = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        ev.evaluate(steps=None, spill_dir=str(tmp_path), spill_threshold=3)
+    ev.replay_thunk(info.value.thunk)
+
+
+def test_spill_options(tmp_path):
+    ev = transmit_example(Queue(2))
+    with pytest.raises(ValueError):
+        ev.evaluate(spill_dir=str(tmp_path), fingerprints=True)
+    with pytest.raises(ValueError):
+        ev.evaluate(spill_dir=str(tmp_path), workers=2)
@@ -0,0 +1,72 @@
+import timewinder
+
+from timewinder.generators import Set
+from timewinder.graph import StateGraph
+from timewinder.graph import StateRecord
+from timewinder.statetree import Hash
+
+
+def _overdraft_evaluator():
+    @timewinder.object
+    class Account:
+        def __init__(self, name):
+            self.name = name
+            self.acc = 5
+
+    alice = Account("alice")
+    bob = Account("bob")
+
+    @timewinder.step
+    def withdraw(state, sender):
+        sender.acc = sender.acc - state["amt"]
+
+    @timewinder.step
+    def deposit(state, reciever):
+        reciever.acc = reciever.acc + state["amt"]
+
+    def alg():
+        return timewinder.FuncProcess(
+            withdraw(alice),
+            deposit(bob),
+            state={"amt": Set(range(1, 6))},
+        )
+
+    no_overdrafts = timewinder.ForAll(Account, lambda a: a.acc >= 0)
+
+    return timewinder.Evaluator(
+        objects=[alice, bob],
+        threads=[alg(), alg()],
+        specs=[no_overdrafts],
+    )
+
+
+def test_graph_path():
+    g = StateGraph()
+    root = g.add(StateRecord(Hash(b"a"), None, None, 0b1))
+    child = g.add(StateRecord(Hash(b"b"), root, 1, 0b0))
+    leaf = g.add(StateRecord(Hash(b"c"), child, 0, 0b1))
+
+    path = g.path(leaf)
+    assert [r.hash for r in path] == [Hash(b"a"), Hash(b"b"), Hash(b"c")]
+    traces = g.predicate_traces(leaf, 1)
+    assert traces[0].trace == [True, False, True]
+
+
+def test_counterexample_from_state_id():
+    ev = _overdraft_evaluator()
+    err = None
+    try:
+        ev.evaluate()
+    except timewinder.ConstraintError as e:
+        err = e
+
+    assert err is not None
+    assert err.state_id is not None
+    thunk = ev.counterexample(err.state_id)
+    assert thunk == err.thunk
+    assert len(thunk.hashes) == len(thunk.trace) + 1
+    assert thunk.state_hash() == ev._graph[err.state_id].hash
+    # The last predicate result along the path is the violation
+    assert thunk.predicate_traces[0].trace[-1] is False
+    assert all(thunk.predicate_traces[0].trace[:-1])
+    ev.replay_thunk(err.state_id)
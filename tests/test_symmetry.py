@@ -0,0 +1,162 @@
+import pytest
+import timewinder
+
+from timewinder.functions import ThreadID
+from timewinder.functions import ThreadRef
+from timewinder.generators import Set
+
+
+@timewinder.object
+class BoundedQueue:
+    def __init__(self, max_length):
+        self._max = max_length
+        self.queue = []
+
+
+@timewinder.object
+class CondWait:
+    def __init__(self, n_threads):
+        # Keyed by thread, so that renumbering threads carries their status
+        self.status = {ThreadRef(i): True for i in range(n_threads)}
+
+    def sleeping(self):
+        return [i for i, x in self.status.items() if x is False]
+
+
+@timewinder.process
+def producer(queue, running):
+    while True:
+        if not running.status[ThreadID()]:
+            yield "paused"
+            continue
+        if len(queue.queue) >= queue._max:
+            running.status[ThreadID()] = False
+            continue
+        queue.queue.append(4)
+        sleeping = running.sleeping()
+        if len(sleeping) != 0:
+            wake_id = Set(sleeping)
+            running.status[wake_id] = True
+
+
+@timewinder.process
+def consumer(queue, running):
+    while True:
+        if not running.status[ThreadID()]:
+            yield "paused"
+            continue
+        if len(queue.queue) == 0:
+            running.status[ThreadID()] = False
+            continue
+        queue.queue.pop()
+        sleeping = running.sleeping()
+        if len(sleeping) != 0:
+            wake_id = Set(sleeping)
+            running.status[wake_id] = True
+
+
+def symmetric_queue(n_prod, n_cons, size, symmetric, **kwargs):
+    runnable = CondWait(n_prod + n_cons)
+    bqueue = BoundedQueue(size)
+    producers = [producer(bqueue, runnable) for _ in range(n_prod)]
+    consumers = [consumer(bqueue, runnable) for _ in range(n_cons)]
+    # As in examples/blocking_queue.py, a group may have a single member
+    groups = [producers, consumers]
+    no_deadlocks = timewinder.ForAll(CondWait, lambda c: any(c.status.values()))
+    return timewinder.Evaluator(
+        objects=[runnable, bqueue],
+        threads=producers + consumers,
+        specs=[no_deadlocks],
+        symmetry=groups if symmetric else None,
+        **kwargs,
+    )
+
+
+def _outcome(ev):
+    try:
+        ev.evaluate(steps=None)
+    except timewinder.ConstraintError as e:
+        return e
+    return None
+
+
+@pytest.mark.parametrize("config", [(1, 2, 2), (2, 2, 3), (3, 1, 3)])
+def test_symmetry_reduces_states(config):
+    full = symmetric_queue(*config, symmetric=False)
+    reduced = symmetric_queue(*config, symmetric=True)
+    assert _outcome(full) is None
+    assert _outcome(reduced) is None
+    assert reduced.stats.states < full.stats.states
+
+
+@pytest.mark.parametrize("config", [(2, 1, 1), (3, 2, 1)])
+def test_symmetry_keeps_violations(config):
+    full = _outcome(symmetric_queue(*config, symmetric=False))
+    ev = symmetric_queue(*config, symmetric=True)
+    err = _outcome(ev)
+    assert full is not None
+    assert err is not None
+    assert len(err.thunk.trace) == len(full.thunk.trace)
+    ev.replay_thunk(err.thunk)
+
+
+def test_symmetric_objects():
+    @timewinder.object
+    class Account:
+        def __init__(self):
+            self.acc = 2
+
+    a = Account()
+    b = Account()
+
+    @timewinder.step
+    def withdraw(state, account):
+        account.acc = account.acc - 1
+
+    threads = [
+        timewinder.FuncProcess(withdraw(a), withdraw(a)),
+        timewinder.FuncProcess(withdraw(b), withdraw(b)),
+    ]
+    ev = timewinder.Evaluator(
+        objects=[a, b],
+        threads=threads,
+        symmetry=[[(threads[0], a), (threads[1], b)]],
+    )
+    ev.evaluate(steps=None)
+    # Balances (2, 2), (1, 2), (0, 2), (1, 1), (0, 1), (0, 0)
+    assert ev.stats.states == 6
+
+
+def test_single_member_symmetry():
+    full = symmetric_queue(1, 1, 2, symmetric=False)
+    ev = symmetric_queue(1, 1, 2, symmetric=True)
+    assert _outcome(full) is None
+    assert _outcome(ev) is None
+    # Nothing to permute
+    assert ev.stats.states == full.stats.states
+
+
+def test_bad_symmetry():
+    ev = symmetric_queue(2, 2, 1, symmetric=False)
+    with pytest.raises(ValueError):
+        timewinder.Evaluator(
+            objects=[],
+            threads=ev.threads[:2],
+            symmetry=[[ev.threads[0], ev.threads[3]]],
+        )
+
+
+def test_symmetry_garbage():
+    full = symmetric_queue(2, 2, 3, symmetric=True)
+    assert _outcome(full) is None
+    ev = symmetric_queue(2, 2, 3, symmetric=True, collect_garbage=True)
+    assert _outcome(ev) is None
+    assert ev.stats.states == full.stats.states
+    # The states put before being replaced by their canonical form
+    assert ev.stats.cas_reclaimed > 0
+
+    ev = symmetric_queue(3, 2, 1, symmetric=True, collect_garbage=True)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        ev.evaluate(steps=None, strategy="dfs")
+    # The path to the violation is kept
+    ev.replay_thunk(info.value.thunk)
@@ -0,0 +1,62 @@
+import hashlib
+import pytest
+import timewinder
+
+from timewinder.visited import FingerprintSet
+from timewinder.visited import collision_probability
+
+from tests.test_blocking_queue import bounded_queue_example
+from tests.test_parallel import Queue
+from tests.test_parallel import transmit_example
+
+
+def _key(i):
+    return hashlib.sha256(str(i).encode()).digest()
+
+
+def test_fingerprint_set():
+    s = FingerprintSet(capacity=4)
+    for i in range(1000):
+        s.add(_key(i))
+        s.add(_key(i))
+    assert len(s) == 1000
+    assert all(_key(i) in s for i in range(1000))
+    assert not any(_key(i) in s for i in range(1000, 2000))
+    # Each entry costs a few slots of eight bytes, rather than a bytes object
+    assert s.memory() <= 1000 * 8 * 3
+
+    # Only the fingerprint is kept, so these can't be told apart
+    s.add(b"\x01" * 8 + b"a" * 24)
+    assert b"\x01" * 8 + b"b" * 24 in s
+
+    s.clear()
+    assert len(s) == 0
+    assert _key(1) not in s
+
+
+def test_collision_probability():
+    assert collision_probability(0) == 0
+    assert collision_probability(1) == 0
+    p = collision_probability(10**6)
+    assert 0 < p < 1e-7
+    assert collision_probability(10**9) > p
+    assert collision_probability(2**40) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("strategy", ["bfs", "dfs"])
+def test_fingerprint_evaluation(strategy):
+    exact = transmit_example(Queue(6))
+    exact.evaluate(steps=None, strategy=strategy)
+
+    ev = transmit_example(Queue(6))
+    ev.evaluate(steps=None, strategy=strategy, fingerprints=True)
+    assert ev.stats.states == exact.stats.states
+    assert 0 < ev.stats.collision_probability < 1e-12
+    assert exact.stats.collision_probability == 0
+
+
+def test_fingerprint_violation():
+    ev = bounded_queue_example(2, 1, 1)
+    with pytest.raises(timewinder.ConstraintError) as info:
+        ev.evaluate(steps=None, fingerprints=True)
+    ev.replay_thunk(info.value.thunk)
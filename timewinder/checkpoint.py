@@ -0,0 +1,262 @@
+"""
+Checkpoints of a breadth-first evaluation, so a long run can be resumed.
+
+A checkpoint directory holds:
+  cas-NNNNNN.msgpack: the CAS nodes put since the previous checkpoint
+  graph-NNNNNN.msgpack: the StateRecords added since the previous checkpoint
+  queue-NNNNNN.msgpack: the states queued since the previous checkpoint, each
+    with the layer it's queued in
+  manifest.json: how many segments are valid, the layer being evaluated and
+    how far into it the search is, and the stats so far
+
+The CAS, the StateGraph and the queue of the next layer only ever grow during
+a breadth-first search, so each checkpoint appends a segment holding just
+what's new, which the CAS keeps track of with a cursor. The queue segments
+from before the layer being evaluated are deleted. The manifest is replaced
+last, atomically, so a crash part way through a checkpoint leaves the previous
+one intact.
+
+The visited set isn't stored: it's exactly the evaluated states in the graph
+plus the queued ones, and is rebuilt from those when resuming.
+"""
+
+import json
+import msgpack
+import os
+import time
+
+from dataclasses import asdict
+from itertools import islice
+
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+from timewinder.statetree import Hash
+from timewinder.statetree.tree import DEFAULT_HASH
+from timewinder.statetree.tree import msgpack_ext_default
+from timewinder.statetree.tree import msgpack_ext_hook
+
+from .graph import PendingState
+from .graph import StateRecord
+
+if TYPE_CHECKING:
+    from .evaluation import Evaluator
+
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 2
+
+
+def _segment_name(kind: str, n: int) -> str:
+    return f"{kind}-{n:06d}.msgpack"
+
+
+def _after(queue: Iterable[PendingState], n: int) -> Iterable[PendingState]:
+    """The states queued after the first n"""
+    if isinstance(queue, list):
+        return queue[n:]
+    return islice(queue, n, None)
+
+
+class Checkpointer:
+    def __init__(self, directory: str, interval: float = 300.0):
+        self.directory = directory
+        self.interval = interval
+        self._segments = 0
+        self._cas_cursor = 0
+        self._graph_saved = 0
+        # The layer being evaluated at the last checkpoint, how far into it
+        # the search was resumed, and how many of the next layer are saved
+        self._step: Optional[int] = None
+        self._resumed_at = 0
+        self._next_saved = 0
+        # The first queue segment holding each layer
+        self._layer_segments: Dict[int, int] = {}
+        self._queue_from = 1
+        self._last = time.monotonic()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write(self, name: str, rows: Iterable[Any]):
+        tmp = self._path(name + ".tmp")
+        packer = msgpack.Packer(default=msgpack_ext_default, strict_types=True)
+        with open(tmp, "wb") as f:
+            for row in rows:
+                f.write(packer.pack(row))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(name))
+
+    def _read(self, name: str) -> Iterable[Any]:
+        with open(self._path(name), "rb") as f:
+            unpacker = msgpack.Unpacker(
+                f, ext_hook=msgpack_ext_hook, raw=False, strict_map_key=False
+            )
+            yield from unpacker
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path(MANIFEST))
+
+    def clear(self):
+        """Removes an earlier checkpoint, before starting over"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name == MANIFEST or name.endswith(".msgpack"):
+                os.remove(self._path(name))
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last >= self.interval
+
+    def save(
+        self,
+        ev: "Evaluator",
+        step: int,
+        position: int,
+        state_queue: Iterable[PendingState],
+        next_queue: Iterable[PendingState],
+    ):
+        """
+        Checkpoints a search part way through evaluating layer `step`, having
+        evaluated the first `position` states of its state_queue
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        cas = ev.state_controller.cas
+        n = self._segments + 1
+        cas_cursor = cas.cursor()
+        self._write(
+            _segment_name("cas", n),
+            ([k, v] for k, v in cas.items_since(self._cas_cursor)),
+        )
+        graph_size = ev._graph.next_id
+        self._write(
+            _segment_name("graph", n),
+            (
+                [r.hash.bytes, r.parent, r.thread_id, r.predicates]
+                for r in ev._graph.records_since(self._graph_saved)
+            ),
+        )
+
+        queued: List[Any] = []
+        if step != self._step:
+            # A new layer: whatever of it wasn't saved as it was queued
+            saved = self._next_saved if self._step == step - 1 else 0
+            self._layer_segments.setdefault(step, n)
+            queued.extend([step, p.to_row()] for p in _after(state_queue, saved))
+            self._step = step
+            self._resumed_at = 0
+            self._next_saved = 0
+        rows = [[step + 1, p.to_row()] for p in _after(next_queue, self._next_saved)]
+        if len(rows) != 0:
+            self._layer_segments.setdefault(step + 1, n)
+        queued.extend(rows)
+        self._write(_segment_name("queue", n), queued)
+        queue_from = self._layer_segments[step]
+
+        manifest = {
+            "version": FORMAT_VERSION,
+            "segments": n,
+            "hash": cas.hash_name,
+            "step": step,
+            "position": self._resumed_at + position,
+            "queue_from": queue_from,
+            "stats": asdict(ev._stats),
+        }
+        tmp = self._path(MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(MANIFEST))
+
+        # The layers before this one are done with
+        for i in range(self._queue_from, queue_from):
+            os.remove(self._path(_segment_name("queue", i)))
+        for layer in [k for k in self._layer_segments if k < step]:
+            del self._layer_segments[layer]
+        self._queue_from = queue_from
+        self._segments = n
+        self._cas_cursor = cas_cursor
+        self._graph_saved = graph_size
+        self._next_saved += len(rows)
+        self._last = time.monotonic()
+
+    def load(
+        self, ev: "Evaluator"
+    ) -> Tuple[int, List[PendingState], List[PendingState], Dict[str, int]]:
+        """
+        Restores the CAS, StateGraph and visited set of a freshly initialized
+        Evaluator from the last checkpoint.
+
+        Returns the step being evaluated, the states left in that layer, those
+        queued for the next, and the stats.
+        """
+        with open(self._path(MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported checkpoint in {self.directory}")
+        if len(ev._graph) != 0:
+            raise ValueError("Can only resume into a fresh Evaluator")
+
+        cas = ev.state_controller.cas
+        # Checkpoints from before the hash was configurable used SHA-256
+        hash_name = manifest.get("hash", DEFAULT_HASH)
+        if hash_name != cas.hash_name:
+            raise ValueError(
+                f"The checkpoint in {self.directory} hashes states with {hash_name}"
+            )
+        n = manifest["segments"]
+        for i in range(1, n + 1):
+            for k, node in self._read(_segment_name("cas", i)):
+                cas.put(Hash(k), node)
+            for h, parent, thread_id, preds in self._read(_segment_name("graph", i)):
+                ev._graph.add(StateRecord(Hash(h), parent, thread_id, preds))
+
+        if len(ev._graph) != 0:
+            mounted = set(ev.state_controller.tree.keys())
+            top = cas.get(ev._graph[0].hash)
+            assert isinstance(top, dict)
+            if set(top.keys()) != mounted:
+                raise ValueError(
+                    f"The checkpoint in {self.directory} is of a different model"
+                )
+
+        step = manifest["step"]
+        queue_from = manifest["queue_from"]
+        layer: List[Any] = []
+        queued: List[Any] = []
+        self._layer_segments = {step: queue_from}
+        for i in range(queue_from, n + 1):
+            for layer_step, row in self._read(_segment_name("queue", i)):
+                if layer_step == step:
+                    layer.append(row)
+                elif layer_step == step + 1:
+                    self._layer_segments.setdefault(layer_step, i)
+                    queued.append(row)
+        position = manifest["position"]
+        state_queue = [PendingState.from_row(r) for r in layer[position:]]
+        next_queue = [PendingState.from_row(r) for r in queued]
+
+        seen = ev._evaled_states
+        for r in ev._graph.records_since(0):
+            seen.add(r.hash.bytes)
+        for p in state_queue:
+            seen.add(p.hash.bytes)
+        for p in next_queue:
+            seen.add(p.hash.bytes)
+
+        self._segments = n
+        self._cas_cursor = cas.cursor()
+        self._graph_saved = ev._graph.next_id
+        self._step = step
+        self._resumed_at = position
+        self._next_saved = len(queued)
+        self._queue_from = queue_from
+        self._last = time.monotonic()
+        return step, state_queue, next_queue, manifest["stats"]
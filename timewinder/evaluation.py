@@ -1,18 +1,41 @@
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Set
 from typing import Optional
+from typing import Tuple
+from typing import Union
 import progressbar
+import random
 
 from copy import copy
 from dataclasses import dataclass
-from dataclasses import field
 from inspect import isfunction
 
 from timewinder.statetree import StateController
+from timewinder.statetree import CAS
 from timewinder.statetree import MemoryCAS
+from timewinder.statetree.cas import RefCounts
+from timewinder.statetree.cas import RestoreCache
+from timewinder.statetree.tree import DEFAULT_HASH
+from timewinder.statetree.tree import HASH_FUNCTIONS
+from timewinder.statetree.tree import InternTable
 from timewinder.statetree import Hash
+from timewinder.statetree.symmetry import Symmetry
 from timewinder.pause import Fairness
 
+from .checkpoint import Checkpointer
+from .parallel import ParallelSearch
+from .reduction import SleepSets
+from .spill import SpillingQueue
+from .spill import SpillingSet
+from .visited import FingerprintSet
+from .visited import collision_probability
+from .graph import PendingState
+from .graph import StateGraph
+from .graph import StateRecord
+from .graph import traces_for_path
 from .ltl import TTrace
 from .ltl import LTLOp
 from .ltl import Always
@@ -20,11 +43,16 @@ from .ltl import Always
 from .process import Process
 from .process import Step
 from .process import FuncProcess
+from .reinterp.profiler import Profile
 
 from .predicate import Predicate
 from .predicate import predicate
 
 
+# A breadth-first layer's states, in memory or partly on disk
+Queue = Union[List[PendingState], SpillingQueue]
+
+
 @dataclass
 class EvaluatorStats:
     thread_executions: int = 0
@@ -32,17 +60,26 @@ class EvaluatorStats:
     cas_objects: int = 0
     steps: int = 0
     final_states: int = 0
+    # Only estimated when visited states are kept as fingerprints
+    collision_probability: float = 0.0
+    restore_hits: int = 0
+    restore_misses: int = 0
+    intern_hits: int = 0
+    intern_misses: int = 0
+    # Nodes collected from the CAS, which cas_objects no longer counts
+    cas_reclaimed: int = 0
 
 
 @dataclass
 class EvalThunk:
+    """A path through the state space, rebuilt from the StateGraph."""
+
     trace: List[int]
     # hashes is one longer than trace.
     # it's roughly a graph with edges
     # hashes[n] --trace[n]--> hashes[n + 1]
     hashes: List[Hash]
     predicate_traces: List[TTrace]
-    must_run: List[int] = field(default_factory=list)
 
     def state_hash(self) -> Hash:
         return self.hashes[-1]
@@ -50,14 +87,6 @@ class EvalThunk:
     def initial_hash(self) -> Hash:
         return self.hashes[0]
 
-    def clone(self) -> "EvalThunk":
-        return EvalThunk(
-            trace=self.trace[:],
-            hashes=self.hashes[:],
-            predicate_traces=[x.clone() for x in self.predicate_traces],
-            must_run=self.must_run[:],
-        )
-
 
 def _prepare_threads(threads) -> List[Process]:
     out = []
@@ -87,9 +116,87 @@ def _prepare_specs(specs) -> List[LTLOp]:
     return out
 
 
+def _close(queue: Queue):
+    if isinstance(queue, SpillingQueue):
+        queue.close()
+
+
 class Evaluator:
-    def __init__(self, *, objects=None, threads: List = None, specs: List = None):
-        self.state_controller = StateController(MemoryCAS())
+    def __init__(
+        self,
+        *,
+        objects=None,
+        threads: List = None,
+        specs: List = None,
+        symmetry: Optional[List[List]] = None,
+        cas: Optional[CAS] = None,
+        restore_cache: int = 32 << 20,
+        hash_function: str = DEFAULT_HASH,
+        intern_table: int = 1 << 16,
+        lazy_restore: bool = False,
+        max_choices: Optional[int] = None,
+        sample_seed: Optional[int] = None,
+        collect_garbage: bool = False,
+    ):
+        """
+        `symmetry` declares groups of interchangeable threads or objects,
+        such as identical workers, so that states differing only by a
+        permutation of a group are explored once. Each group is a list of
+        members; a member is a thread, an object, or a tuple of them that are
+        permuted together (such as a thread and an object it alone uses).
+        Thread references are only renumbered when they come from ThreadID().
+
+        `cas` is where the states are stored; by default, in memory. An
+        SQLiteCAS or a LogCAS keeps them on disk instead, past the end of the run.
+        Up to roughly `restore_cache` bytes of decoded nodes are kept, so
+        that restoring them again skips fetching and decoding them; restored
+        objects and processes then copy each node only once they read it. 0
+        turns that off, restoring every tree whole.
+
+        `hash_function` names what states are hashed with, out of
+        HASH_FUNCTIONS; "blake2b-128" and "md5" are quicker than the default
+        SHA-256, and still far from colliding across any feasible run.
+        The hashes of up to `intern_table` small nodes are remembered by
+        their contents, to skip serializing them again; 0 turns that off.
+
+        With `lazy_restore`, objects and bytecode processes leave the parts of
+        their state they don't read in the CAS, and commit them unchanged.
+        That pays off when states are large and each step reads little of them.
+
+        Nondeterministic choices are expanded into states as they're explored,
+        rather than all at once. `max_choices` bounds how many values of each
+        choice are explored: the first ones, or given a `sample_seed`, a random
+        sample of them. Either way, the search is no longer exhaustive.
+
+        With `collect_garbage`, nodes of the (in-memory) CAS are reference
+        counted, and reclaimed once no queued state, nor any state kept in
+        the state graph for counterexamples, reaches them. Breadth-first
+        searches keep every evaluated state, so only shed the states nothing
+        leads to, such as those replaced by their canonical form under
+        symmetry; depth-first ones only keep the current path.
+        """
+        if hash_function not in HASH_FUNCTIONS:
+            raise ValueError(f"Unknown hash function {hash_function}")
+        if max_choices is not None and max_choices < 1:
+            raise ValueError("max_choices must be at least 1")
+        if sample_seed is not None and max_choices is None:
+            raise ValueError("Sampling choices needs max_choices")
+        if cas is None:
+            cas = MemoryCAS()
+        if collect_garbage:
+            if not isinstance(cas, MemoryCAS):
+                raise ValueError("Only an in-memory CAS can collect garbage")
+            cas.refcounts = RefCounts()
+        cas.hash_name = hash_function
+        if intern_table > 0:
+            cas.interner = InternTable(HASH_FUNCTIONS[hash_function], intern_table)
+        cas.lazy_restore = lazy_restore
+        if restore_cache > 0:
+            cas.restore_cache = RestoreCache(restore_cache)
+        self.state_controller = StateController(cas)
+        self.state_controller.max_choices = max_choices
+        if sample_seed is not None:
+            self.state_controller.rng = random.Random(sample_seed)
         if objects is not None:
             for m in objects:
                 self.state_controller.mount(m._name, m)
@@ -102,8 +209,43 @@ class Evaluator:
                 t.on_register_evaluator(i)
                 self.state_controller.mount(f"_thread_{i}", t)
         self.specs = _prepare_specs(specs)
-        self._evaled_states: Set[bytes] = set()
+        if symmetry is not None:
+            self.state_controller.symmetry = self._prepare_symmetry(symmetry)
+        # Hashes of every state discovered so far, queued or evaluated
+        self._evaled_states: Union[Set[bytes], FingerprintSet, SpillingSet] = set()
+        # Set while evaluating with a spill directory, for the frontier
+        self._spill: Optional[Tuple[Optional[str], int]] = None
+        # Shallowest depth each state was discovered at, kept only by
+        # depth-bounded depth-first searches
+        self._depths: Optional[Dict[bytes, int]] = None
+        self._readmitted: Set[bytes] = set()
+        # Whether a depth-bounded search left states unexpanded
+        self._cutoff = False
+        self._graph = StateGraph()
         self._stats: EvaluatorStats = EvaluatorStats()
+        self._workers = 1
+        self._reduction: Optional[SleepSets] = None
+        # The profile of the last evaluation run with one
+        self.profile: Optional[Profile] = None
+
+    def _prepare_symmetry(self, groups: List[List]) -> Symmetry:
+        mounts = {id(m): k for k, m in self.state_controller.tree.items()}
+        thread_mounts = {f"_thread_{i}": i for i in range(len(self.threads))}
+
+        def mount_of(x) -> str:
+            if id(x) not in mounts:
+                raise ValueError(f"{x} is not an object or thread of this Evaluator")
+            return mounts[id(x)]
+
+        out = []
+        for group in groups:
+            members = []
+            for member in group:
+                if not isinstance(member, tuple):
+                    member = (member,)
+                members.append(tuple(mount_of(x) for x in member))
+            out.append(members)
+        return Symmetry(out, thread_mounts)
 
     def _initialize_evaluation(self):
         self._stats = EvaluatorStats()
@@ -113,115 +255,433 @@ class Evaluator:
         for i, p in enumerate(self.preds):
             p.set_index(i)
 
-    def evaluate(self, steps: Optional[int] = 5):
+    def _admit(self, h: Hash, depth: int) -> bool:
+        """Marks a discovered state as seen, returning whether to explore it"""
+        if h.bytes not in self._evaled_states:
+            self._evaled_states.add(h.bytes)
+            if self._depths is not None:
+                self._depths[h.bytes] = depth
+            # Until its record is released from the state graph
+            self.state_controller.cas.pin(h)
+            return True
+        if self._depths is None:
+            return False
+        # A depth-first search may first reach a state by a long path and
+        # cut it off at the depth bound. Reaching it again by a shorter path
+        # means its successors may still be in bounds.
+        if depth < self._depths[h.bytes]:
+            self._depths[h.bytes] = depth
+            self._readmitted.add(h.bytes)
+            self.state_controller.cas.pin(h)
+            return True
+        return False
+
+    def _initial_states(
+        self, hashes: Optional[Iterable[Hash]] = None
+    ) -> List[PendingState]:
+        if hashes is None:
+            hashes = (h for h, _ in self.state_controller.commit_renumbered())
+        out = []
+        for h in hashes:
+            if self._admit(h, 1):
+                out.append(PendingState(h, None, None, None))
+        return out
+
+    def evaluate(
+        self,
+        steps: Optional[int] = 5,
+        workers: int = 1,
+        strategy: str = "bfs",
+        checkpoint: Optional[str] = None,
+        checkpoint_interval: float = 300.0,
+        resume: bool = False,
+        partial_order: bool = False,
+        fingerprints: bool = False,
+        spill_dir: Optional[str] = None,
+        spill_threshold: int = 1_000_000,
+        profile: bool = False,
+    ):
+        """
+        Explores the state space, up to `steps` states deep.
+
+        The strategy is one of:
+          "bfs": breadth-first, layer by layer. With workers > 1, the layers
+            are expanded by that many forked processes, each owning a shard
+            of the visited states.
+          "dfs": depth-first. Working memory is proportional to the depth
+            rather than to the width of a layer.
+          "iddfs": iterative deepening; repeated depth-first searches with an
+            increasing bound, so the first violation found is a shortest one.
+
+        With `checkpoint` set to a directory, a serial breadth-first search
+        saves its progress there every `checkpoint_interval` seconds. Passing
+        `resume=True` to an Evaluator built the same way carries on from the
+        last checkpoint in that directory, if there is one, rather than
+        starting over.
+
+        `partial_order` skips running threads whose steps commute with the
+        ones already explored, using sleep sets. The same states are visited,
+        with fewer thread executions. It's limited to serial breadth-first
+        searches of safety properties, without symmetry.
+
+        `fingerprints` keeps only 64 bits of each visited state's hash, in a
+        compact table, rather than the whole hash. The estimated probability
+        that a fingerprint collision hid a state is reported at the end.
+
+        With `spill_dir` set, the visited states are moved out to sorted files
+        in that directory every `spill_threshold` of them, and so are a
+        breadth-first layer's queued states. The directory has to exist; the
+        files are removed when done with.
+
+        With `profile`, the instructions that bytecode processes execute are
+        counted and timed, per opcode and per source line of each process
+        function, and reported at the end. The profile is kept as `profile`.
+        Profiled processes are interpreted an instruction at a time, so run
+        slower than usual.
+        """
+        self._check_options(
+            strategy,
+            workers,
+            checkpoint,
+            resume,
+            partial_order,
+            fingerprints,
+            spill_dir,
+            spill_threshold,
+            profile,
+        )
         self._initialize_evaluation()
-        initial_hashes = self.state_controller.commit()
-        next_queue = []
-        for h in initial_hashes:
-            pred_traces = [TTrace([]) for i in self.preds]
-            next_queue.append(
-                EvalThunk(trace=[], hashes=[h], predicate_traces=pred_traces)
-            )
+        self._workers = workers
+        self._reduction = SleepSets(self) if partial_order else None
+        if fingerprints:
+            self._evaled_states = FingerprintSet()
+        self._spill = None
+        if spill_dir is not None:
+            self._spill = (spill_dir, spill_threshold)
+            self._evaled_states = SpillingSet(spill_dir, spill_threshold)
+        checkpointer = None
+        if checkpoint is not None:
+            checkpointer = Checkpointer(checkpoint, checkpoint_interval)
+        prof = Profile() if profile else None
+        if prof is not None:
+            self.profile = prof
+            for t in self.threads:
+                t.set_profile(prof)
+        try:
+            self._search(steps, strategy, workers, checkpointer, resume)
+        finally:
+            if prof is not None:
+                for t in self.threads:
+                    t.set_profile(None)
+                print(prof.report())
+            self.state_controller.cas.collect()
+            self.state_controller.cas.flush()
+            if isinstance(self._evaled_states, SpillingSet):
+                print(f"Visited states on disk: {self._evaled_states.on_disk()}")
+                self._evaled_states.clear()
+        if fingerprints:
+            p = collision_probability(self._stats.states)
+            self._stats.collision_probability = p
+            print(f"Estimated probability a fingerprint collision hid a state: {p:.2g}")
+
+    def _check_options(
+        self,
+        strategy: str,
+        workers: int,
+        checkpoint: Optional[str],
+        resume: bool,
+        partial_order: bool,
+        fingerprints: bool,
+        spill_dir: Optional[str],
+        spill_threshold: int,
+        profile: bool,
+    ):
+        if strategy not in ("bfs", "dfs", "iddfs"):
+            raise ValueError(f"Unknown search strategy {strategy}")
+        if workers > 1 and strategy != "bfs":
+            raise ValueError("Parallel evaluation is only breadth-first")
+        cas = self.state_controller.cas
+        if workers > 1 and not (isinstance(cas, MemoryCAS) or cas.shared):
+            raise ValueError("Parallel workers need an in-memory or a shared CAS")
+        if cas.refcounts is not None and (workers > 1 or checkpoint is not None):
+            raise ValueError("Garbage is only collected by serial, uncheckpointed runs")
+        if checkpoint is not None and (workers > 1 or strategy != "bfs"):
+            raise ValueError("Checkpoints are only taken by serial breadth-first")
+        if resume and checkpoint is None:
+            raise ValueError("Resuming needs the checkpoint directory")
+        if partial_order:
+            if workers > 1 or strategy != "bfs" or checkpoint is not None:
+                raise ValueError("Partial-order reduction is only serial breadth-first")
+            if self.state_controller.symmetry is not None:
+                raise ValueError("Partial-order reduction can't be used with symmetry")
+            if any(s.is_liveness() for s in self.specs):
+                raise ValueError("Partial-order reduction only keeps safety results")
+        if spill_dir is not None:
+            if workers > 1:
+                raise ValueError("Parallel workers keep their visited states in memory")
+            if fingerprints:
+                raise ValueError("Fingerprints and spilling to disk are exclusive")
+            if spill_threshold < 1:
+                raise ValueError("The spill threshold must be positive")
+        if profile and workers > 1:
+            raise ValueError("Profiles are only gathered by serial evaluations")
+
+    def _search(
+        self,
+        steps: Optional[int],
+        strategy: str,
+        workers: int,
+        checkpointer: Optional[Checkpointer],
+        resume: bool,
+    ):
+        if strategy == "dfs":
+            self._depth_first(steps)
+            return
+        if strategy == "iddfs":
+            self._iterative_deepening(steps)
+            return
 
         if steps is None:
             steps = 2 ** 30
-        for step in range(1, steps + 1):
-            state_queue = next_queue
-            next_queue = []
-            if len(state_queue) == 0:
+        if workers > 1:
+            ParallelSearch(self, workers).run(steps)
+            return
+        self._breadth_first(steps, checkpointer, resume)
+
+    def _queue(self, states: Iterable[PendingState] = ()) -> Queue:
+        if self._spill is None:
+            return list(states)
+        q = SpillingQueue(*self._spill)
+        q.extend(states)
+        return q
+
+    def _breadth_first(
+        self, steps: int, checkpointer: Optional[Checkpointer], resume: bool
+    ):
+        first_step = 1
+        state_queue = self._queue()
+        if checkpointer is not None and resume and checkpointer.exists():
+            first_step, rest, queued, stats = checkpointer.load(self)
+            state_queue = self._queue(rest)
+            next_queue = self._queue(queued)
+            self._stats = EvaluatorStats(**stats)
+            print(f"Resuming Step {first_step} from {checkpointer.directory}")
+        else:
+            if checkpointer is not None:
+                checkpointer.clear()
+            next_queue = self._queue(self._initial_states())
+            resume = False
+
+        try:
+            for step in range(first_step, steps + 1):
+                if resume:
+                    # The rest of the layer the checkpoint was taken in
+                    resume = False
+                else:
+                    _close(state_queue)
+                    state_queue = next_queue
+                    next_queue = self._queue()
+                    if len(state_queue) == 0:
+                        print("No more states to evaluate")
+                        break
+                    self._stats.steps += 1
+                print(f"Evaluating Step {step} ({len(state_queue)} states)...")
+                for i, pending in enumerate(progressbar.progressbar(state_queue)):
+                    _, new_runs = self._eval_state(pending, step)
+                    next_queue.extend(new_runs)
+                    if checkpointer is not None and checkpointer.due():
+                        checkpointer.save(self, step, i + 1, state_queue, next_queue)
+        finally:
+            _close(state_queue)
+            _close(next_queue)
+
+    def _depth_first(
+        self, max_depth: Optional[int], initial: Optional[List[Hash]] = None
+    ):
+        print(f"Evaluating depth-first (max depth {max_depth})...")
+        self._depths = None if max_depth is None else {}
+        self._readmitted = set()
+        self._cutoff = False
+        try:
+            self._depth_first_search(max_depth, initial)
+            if self._depths:
+                # The deepest layer a breadth-first search would have reached
+                self._stats.steps = max(self._depths.values())
+        finally:
+            self._depths = None
+
+    def _depth_first_search(
+        self, max_depth: Optional[int], initial: Optional[List[Hash]] = None
+    ):
+        # Each frame is an evaluated state and its successors still to be
+        # explored, kept in reverse so the first thread runs first.
+        frames: List[Tuple[Optional[int], List[PendingState]]] = [
+            (None, self._initial_states(initial)[::-1])
+        ]
+        while len(frames) != 0:
+            parent, children = frames[-1]
+            if len(children) == 0:
+                frames.pop()
+                if parent is not None:
+                    # Only the current path needs keeping for counterexamples
+                    self.state_controller.cas.unpin(self._graph[parent].hash)
+                    self._graph.release(parent)
+                continue
+            pending = children.pop()
+            depth = len(frames)
+            self._stats.steps = max(self._stats.steps, depth)
+            expand = max_depth is None or depth < max_depth
+            sid, successors = self._eval_state(pending, depth, expand)
+            frames.append((sid, successors[::-1]))
+
+    def _iterative_deepening(self, max_depth: Optional[int]):
+        if max_depth is None:
+            max_depth = 2**30
+        # Every round restarts from the same initial states
+        initial = list(self.state_controller.commit())
+        for h in initial:
+            self.state_controller.cas.pin(h)
+        previous = -1
+        for depth in range(1, max_depth + 1):
+            # Each round is a fresh search; only the work done accumulates
+            executions = self._stats.thread_executions
+            self._stats = EvaluatorStats(thread_executions=executions)
+            self._evaled_states.clear()
+            self._depth_first(depth, initial)
+            # Going one deeper without finding a new state means there are
+            # none left to find.
+            if not self._cutoff or self._stats.states == previous:
                 print("No more states to evaluate")
                 break
-            print(f"Evaluating Step {step} ({len(state_queue)} states)...")
-            self._stats.steps += 1
-            for thunk in progressbar.progressbar(state_queue):
-                new_runs = self._eval_state(thunk)
-                next_queue.extend(new_runs)
+            previous = self._stats.states
 
-    def _eval_preds(self, t: EvalThunk):
+    def _eval_preds(self) -> int:
+        mask = 0
         for i, p in enumerate(self.preds):
-            b = p.check(self.state_controller)
-            t.predicate_traces[i].append(b)
+            if p.check(self.state_controller):
+                mask |= 1 << i
+        return mask
 
     def _should_stutter(self) -> bool:
         # TODO: Fairness, etc.
         return True
 
-    def _check_liveness(self, spec, t: EvalThunk):
-        if self._should_stutter():
-            trace = spec.eval_traces(t.predicate_traces)
-            ok = trace[0]
-            if not ok:
-                err = StutterConstraintError(str(spec))
-                err.thunk = t
-                err.state = self.state_controller.tree
-                raise err
-
-    def _check_safety(self, spec, t: EvalThunk):
-        trace = spec.eval_traces(t.predicate_traces)
-        ok = trace[0]
-        if not ok:
-            err = ConstraintError(str(spec))
-            err.thunk = t
-            err.state = self.state_controller.tree
-            raise err
-
-    def _check_constraints(self, t: EvalThunk):
+    def _find_violation(self, traces: List[TTrace]) -> Optional["ConstraintError"]:
         for spec in self.specs:
-            if spec.is_liveness():
-                self._check_liveness(spec, t)
-            else:
-                self._check_safety(spec, t)
-
-    def _eval_state(self, t: EvalThunk) -> List[EvalThunk]:
-        if t.state_hash().bytes in self._evaled_states:
-            return []
-        self._stats.states += 1
-        self._evaled_states.add(t.state_hash().bytes)
-        self.state_controller.restore(t.state_hash())
-        self._eval_preds(t)
-        try:
-            self._check_constraints(t)
-        except ConstraintError as e:
-            raise e
-        if len(t.must_run) == 0:
-            runnable_threads = [
-                i for i, t in enumerate(self.threads) if t.can_execute()
-            ]
+            trace = spec.eval_traces(traces)
+            ok = trace[0]
+            if ok:
+                continue
+            if not spec.is_liveness():
+                return ConstraintError(str(spec))
+            if self._should_stutter():
+                return StutterConstraintError(str(spec))
+        return None
+
+    def _raise_violation(self, err: "ConstraintError", sid: int):
+        err.state_id = sid
+        err.thunk = self.counterexample(sid)
+        err.state = self.state_controller.tree
+        raise err
+
+    def _check_constraints(self, sid: int):
+        if len(self.specs) == 0:
+            return
+        traces = self._graph.predicate_traces(sid, len(self.preds))
+        err = self._find_violation(traces)
+        if err is not None:
+            self._raise_violation(err, sid)
+
+    def _runnable_threads(self, must_run: Optional[int]) -> List[int]:
+        if must_run is not None:
+            return [must_run]
+        return [i for i, t in enumerate(self.threads) if t.can_execute()]
+
+    def _eval_state(
+        self, pending: PendingState, depth: int, expand: bool = True
+    ) -> Tuple[int, List[PendingState]]:
+        if self._reduction is not None and self._reduction.is_wakeup(pending):
+            return self._reduction.wake(pending, depth + 1)
+        # A state readmitted at a shallower depth was counted when first found
+        readmitted = pending.hash.bytes in self._readmitted
+        if readmitted:
+            self._readmitted.discard(pending.hash.bytes)
         else:
-            runnable_threads = t.must_run
-
+            self._stats.states += 1
+        # Everything committed since the last state is pinned, or garbage
+        self.state_controller.cas.collect()
+        self.state_controller.restore(pending.hash)
+        record = StateRecord(
+            hash=pending.hash,
+            parent=pending.parent,
+            thread_id=pending.thread_id,
+            predicates=self._eval_preds(),
+        )
+        sid = self._graph.add(record)
+        self._check_constraints(sid)
+        runnable_threads = self._runnable_threads(pending.must_run)
         if len(runnable_threads) == 0:
-            self._stats.final_states += 1
+            if not readmitted:
+                self._stats.final_states += 1
             # TODO: Check for deadlocking when awaiting
-            return []
-        return self._execute_threads(runnable_threads, t)
-
-    def _execute_threads(self, thread_ids: List[int], t: EvalThunk):
+            return sid, []
+        if not expand:
+            self._cutoff = True
+            return sid, []
+        if self._reduction is not None:
+            return sid, self._reduction.expand(
+                sid, pending, runnable_threads, depth + 1
+            )
+        return sid, self._execute_threads(runnable_threads, sid, depth + 1)
+
+    def _expand(
+        self, state_hash: Hash, thread_ids: List[int]
+    ) -> Iterator[Tuple[int, Optional[int], Hash]]:
+        """
+        Runs each thread from the given (already restored) state, yielding
+        (thread_id, must_run, successor_hash) for every resulting state.
+        """
         pre_restored = True
-        out = []
         for thread_id in thread_ids:
             if pre_restored:
                 pre_restored = False
             else:
-                self.state_controller.restore(t.state_hash())
-            new_thunk = t.clone()
-            new_thunk.must_run = []
-            new_thunk.trace.append(thread_id)
+                self.state_controller.restore(state_hash)
             thread = self.threads[thread_id]
             self._stats.thread_executions += 1
             cont = thread.execute(self.state_controller)
-            next_hashes = self.state_controller.commit()
-            for h in next_hashes:
-                if h.bytes in self._evaled_states:
-                    continue
-                t_with_hash = new_thunk.clone()
-                t_with_hash.hashes.append(h)
-                if cont.fairness == Fairness.IMMEDIATE:
-                    t_with_hash.must_run = [thread_id]
-                out.append(t_with_hash)
+            must_run = None
+            if cont.fairness == Fairness.IMMEDIATE:
+                must_run = thread_id
+            for h, renumbered in self.state_controller.commit_renumbered():
+                # Under symmetry, the thread may have moved in the new state
+                pinned = must_run
+                if pinned is not None:
+                    pinned = renumbered.get(pinned, pinned)
+                yield thread_id, pinned, h
+
+    def _execute_threads(
+        self, thread_ids: List[int], sid: int, depth: int
+    ) -> List[PendingState]:
+        out = []
+        for thread_id, must_run, h in self._expand(self._graph[sid].hash, thread_ids):
+            if not self._admit(h, depth):
+                continue
+            out.append(PendingState(h, sid, thread_id, must_run))
         return out
 
-    def replay_thunk(self, t: EvalThunk):
+    def counterexample(self, sid: int) -> EvalThunk:
+        """Rebuilds the path leading to the given state id"""
+        path = self._graph.path(sid)
+        return EvalThunk(
+            trace=[r.thread_id for r in path[1:] if r.thread_id is not None],
+            hashes=[r.hash for r in path],
+            predicate_traces=traces_for_path(path, len(self.preds)),
+        )
+
+    def replay_thunk(self, t: Union[EvalThunk, int]):
+        if isinstance(t, int):
+            t = self.counterexample(t)
         print("Initial State:")
         self.state_controller.restore(t.initial_hash())
         print(self.state_controller.state_to_str())
@@ -243,7 +703,20 @@ class Evaluator:
     @property
     def stats(self) -> EvaluatorStats:
         s = copy(self._stats)
-        s.cas_objects = self.state_controller.cas.size()
+        if self._workers == 1:
+            # Parallel runs total up the worker stores themselves
+            s.cas_objects = self.state_controller.cas.size()
+        refcounts = self.state_controller.cas.refcounts
+        if refcounts is not None:
+            s.cas_reclaimed = refcounts.reclaimed
+        cache = self.state_controller.cas.restore_cache
+        if cache is not None:
+            s.restore_hits = cache.hits
+            s.restore_misses = cache.misses
+        interner = self.state_controller.cas.interner
+        if interner is not None:
+            s.intern_hits = interner.hits
+            s.intern_misses = interner.misses
         return s
 
 
@@ -251,6 +724,7 @@ class ConstraintError(BaseException):
     def __init__(self, name, thunk=None):
         self.name = name
         self.thunk = thunk
+        self.state_id: Optional[int] = None
         self.state = None
 
 
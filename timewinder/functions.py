@@ -8,6 +8,10 @@ the important part -- looking at the function by tag allows for correct pausing
 
 from typing import Iterable
 
+# ThreadID() returns a ThreadRef in an evaluation, which symmetry reduction
+# knows to renumber. Per-thread state is best keyed by them, not positions.
+from timewinder.statetree import ThreadRef  # noqa: F401
+
 
 abiV1 = {}
 
@@ -1,14 +1,53 @@
+import random
+
+from itertools import islice
+
 from typing import Iterable
+from typing import Iterator
 from typing import Optional
+from typing import Sequence
 
 
 class NonDeterministicSet:
     def __init__(self, s: Iterable):
+        # The choices may be gone through more than once, which one-shot
+        # iterators can't be
+        if iter(s) is s:
+            s = list(s)
         self.set = s
 
     def to_generator(self):
         return (x for x in self.set)
 
+    def choices(
+        self, limit: Optional[int] = None, rng: Optional[random.Random] = None
+    ) -> Iterator:
+        """
+        The values to explore: all of them, the first `limit`, or with `rng`,
+        `limit` of them sampled at random.
+        """
+        if limit is None:
+            return self.to_generator()
+        if rng is None:
+            return islice(self.set, limit)
+        if isinstance(self.set, Sequence):
+            # Ranges sample without being expanded
+            n = len(self.set)
+            return (self.set[i] for i in rng.sample(range(n), min(limit, n)))
+        return iter(_reservoir(self.set, limit, rng))
+
+
+def _reservoir(vals: Iterable, k: int, rng: random.Random) -> list:
+    out: list = []
+    for i, v in enumerate(vals):
+        if i < k:
+            out.append(v)
+        else:
+            j = rng.randrange(i + 1)
+            if j < k:
+                out[j] = v
+    return out
+
 
 def Set(vals: Iterable) -> NonDeterministicSet:
     return NonDeterministicSet(vals)
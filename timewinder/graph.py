@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from timewinder.statetree import Hash
+
+from .ltl import TTrace
+
+
+@dataclass
+class PendingState:
+    """A discovered state that has yet to be evaluated."""
+
+    __slots__ = ("hash", "parent", "thread_id", "must_run")
+    hash: Hash
+    # State id of the state this was reached from, None if initial
+    parent: Optional[int]
+    # The thread whose execution produced this state
+    thread_id: Optional[int]
+    # Set when the producing thread must run again immediately
+    must_run: Optional[int]
+
+    def to_row(self) -> List:
+        """A plain form, for writing out with msgpack"""
+        return [self.hash.bytes, self.parent, self.thread_id, self.must_run]
+
+    @classmethod
+    def from_row(cls, row: List) -> "PendingState":
+        return cls(Hash(row[0]), row[1], row[2], row[3])
+
+
+@dataclass
+class StateRecord:
+    """An evaluated state, stored once in the StateGraph."""
+
+    __slots__ = ("hash", "parent", "thread_id", "predicates")
+    hash: Hash
+    parent: Optional[int]
+    thread_id: Optional[int]
+    # Bitmask of predicate results in this state; bit i is predicate i
+    predicates: int
+
+
+class StateGraph:
+    """
+    Every evaluated state, indexed by state id.
+
+    Instead of each state carrying the whole trace that led to it, a record
+    only points back at its parent. Paths -- and the predicate traces along
+    them -- are rebuilt on demand by walking the parents.
+    """
+
+    def __init__(self):
+        self._records: Dict[int, StateRecord] = {}
+        self._next_id = 0
+
+    def add(self, record: StateRecord) -> int:
+        sid = self._next_id
+        self._next_id += 1
+        self._records[sid] = record
+        return sid
+
+    def release(self, sid: int):
+        """Forgets a record no longer needed to rebuild any path"""
+        del self._records[sid]
+
+    def __getitem__(self, sid: int) -> StateRecord:
+        return self._records[sid]
+
+    def __contains__(self, sid: int) -> bool:
+        return sid in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    def records_since(self, sid: int) -> Iterator[StateRecord]:
+        """Records added from sid onwards, in order; none may be released"""
+        for i in range(sid, self._next_id):
+            yield self._records[i]
+
+    def path(self, sid: int) -> List[StateRecord]:
+        """Returns the records from an initial state up to and including sid"""
+        out = []
+        cur: Optional[int] = sid
+        while cur is not None:
+            rec = self._records[cur]
+            out.append(rec)
+            cur = rec.parent
+        out.reverse()
+        return out
+
+    def predicate_traces(self, sid: int, n_preds: int) -> List[TTrace]:
+        return traces_for_path(self.path(sid), n_preds)
+
+
+def traces_for_path(path: List[StateRecord], n_preds: int) -> List[TTrace]:
+    return traces_for_masks([r.predicates for r in path], n_preds)
+
+
+def traces_for_masks(masks: List[int], n_preds: int) -> List[TTrace]:
+    return [TTrace([bool((m >> i) & 1) for m in masks]) for i in range(n_preds)]
@@ -4,9 +4,19 @@ from abc import abstractproperty
 from uuid import uuid4
 from varname import varname
 
+from typing import Dict
+from typing import Optional
+from typing import Set
+
 from timewinder.statetree import CAS
 from timewinder.statetree import Hash
 from timewinder.statetree import TreeableType
+from timewinder.statetree.tracked import lazy
+from timewinder.statetree.tracked import track
+
+
+# What reading can hand out without the object possibly changing
+_IMMUTABLE = (str, int, float, bool, bytes, type(None), Hash)
 
 
 def object(cls):
@@ -38,40 +48,153 @@ class Object(ABC):
         """Takes ownership of the given state"""
         pass
 
+    def register_access_log(self, log: Optional[Set[str]]) -> None:
+        """Objects add their name to the log whenever they're accessed"""
+        pass
+
 
 class ClassObject(Object):
     """Represents a class as a timewinder object"""
 
+    _access_log: Optional[Set[str]] = None
+
     def __init__(self, cls, name, args, kwargs):
         self._cls = cls
         self._instance = cls(*args, **kwargs)
+        # Attributes restored lazily, and not read since
+        self._unread: Dict[str, Hash] = {}
+        # Attribute writes made by the instance's own methods mark it dirty
+        self._instance.__class__ = _tracked_class(cls, self)
         if name is not None:
             self._name = name
         else:
             self._name = uuid4().hex
+        # The hash last restored, which stands for the state until it's dirty
+        self._set_hash: Optional[Hash] = None
+        self._dirty = True
 
     def register_cas(self, cas: CAS) -> None:
         self._cas = cas
 
+    def _changed(self) -> None:
+        self._dirty = True
+
     def get_state(self) -> TreeableType:
+        if not self._dirty and self._set_hash is not None:
+            return self._set_hash
+        if len(self._unread) != 0:
+            return dict(self._unread, **self._instance.__dict__)
         return self._instance.__dict__
 
     def set_state(self, state_hash: Hash) -> None:
-        state = self._cas.restore(state_hash)
-        self._instance.__dict__ = state
+        if not self._dirty and state_hash == self._set_hash:
+            return
+        # Lists and dicts put in by the model itself aren't tracked, but
+        # putting them in dirties the object until the next restore.
+        if self._cas.lazy_restore:
+            state = self._cas.get_shared(state_hash)
+            assert isinstance(state, dict)
+            self._unread = {k: v for k, v in state.items() if isinstance(v, Hash)}
+            self._instance.__dict__ = {
+                k: v for k, v in state.items() if not isinstance(v, Hash)
+            }
+        elif self._cas.restore_cache is not None:
+            # Copied on write, out of the nodes the cache shares
+            state = self._cas.get_shared(state_hash)
+            assert isinstance(state, dict)
+            self._instance.__dict__ = {
+                k: lazy(self._cas, v, self._changed) for k, v in state.items()
+            }
+            self._unread = {}
+        else:
+            state = self._cas.restore(state_hash)
+            assert isinstance(state, dict)
+            self._instance.__dict__ = {
+                k: track(v, self._changed) for k, v in state.items()
+            }
+            self._unread = {}
+        self._set_hash = state_hash
+        self._dirty = False
+
+    def _load(self, key: str):
+        """Restores an attribute left unread by a lazy restore"""
+        v = lazy(self._cas, self._unread.pop(key), self._changed)
+        self._instance.__dict__[key] = v
+        return v
 
     @property
     def name(self) -> str:
         return self._name
 
+    def register_access_log(self, log: Optional[Set[str]]) -> None:
+        self._access_log = log
+
     def __getattr__(self, key):
-        return getattr(self._instance, key)
+        if self._access_log is not None:
+            self._access_log.add(self._name)
+        v = getattr(self._instance, key)
+        if not isinstance(v, _IMMUTABLE):
+            # Containers and methods can change the state where tracking
+            # can't see, such as by heapq writing to a list directly
+            self._changed()
+        return v
 
     def __setattr__(self, key, val):
-        if key in ["_instance", "_cls", "_name", "_cas"]:
+        if key in [
+            "_instance",
+            "_cls",
+            "_name",
+            "_cas",
+            "_access_log",
+            "_set_hash",
+            "_dirty",
+            "_unread",
+        ]:
             self.__dict__[key] = val
             return
+        if self._access_log is not None:
+            self._access_log.add(self._name)
         return setattr(self._instance, key, val)
 
     def __repr__(self):
-        return "%s: %s" % (self._name, self.get_state())
+        for key in list(self._unread):
+            self._load(key)
+        return "%s: %s" % (self._name, self._instance.__dict__)
+
+
+def _tracked_class(cls, owner: ClassObject):
+    """
+    A subclass of cls that reports changes to its attributes to their owner,
+    and loads the ones it left unread
+    """
+    fallback = getattr(cls, "__getattr__", None)
+
+    def __getattr__(self, key):
+        # Only called for attributes missing from the instance
+        if key in owner._unread:
+            return owner._load(key)
+        if fallback is not None:
+            return fallback(self, key)
+        raise AttributeError(f"'{cls.__name__}' object has no attribute '{key}'")
+
+    def __setattr__(self, key, val):
+        owner._changed()
+        owner._unread.pop(key, None)
+        cls.__setattr__(self, key, val)
+
+    def __delattr__(self, key):
+        owner._changed()
+        if owner._unread.pop(key, None) is None:
+            cls.__delattr__(self, key)
+
+    return type(
+        cls.__name__,
+        (cls,),
+        {
+            "__getattr__": __getattr__,
+            "__setattr__": __setattr__,
+            "__delattr__": __delattr__,
+            "__module__": cls.__module__,
+            "__qualname__": cls.__qualname__,
+        },
+    )
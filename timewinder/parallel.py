@@ -0,0 +1,394 @@
+"""
+Multi-process breadth-first exploration.
+
+Each worker is a fork of the Evaluator that owns a shard of the visited
+states, chosen by hash prefix. A layer takes two rounds. First, every worker
+deduplicates, evaluates and expands the candidate states it owns, with the
+usual restore-execute-commit cycle on its own StateController, and reports
+them to the coordinating process. The coordinator keeps the StateGraph: it
+numbers the new states in the order a serial search would have reached them,
+and hands the numbers back. Then every worker sends its successors, tagged
+with the number of the state they came from, straight to the workers that own
+them, along with the CAS nodes needed to restore them. With a shared CAS,
+such as a SharedMemoryCAS, only the hashes travel.
+
+Candidates never carry their path. When there are specs to check, the
+coordinator sends every worker the parent and predicates of each state in the
+layer instead, from which workers rebuild the traces along any path.
+"""
+
+import multiprocessing
+import pickle
+
+from array import array
+from dataclasses import dataclass
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+from timewinder.statetree import Hash
+from timewinder.statetree import TreeType
+
+from .graph import PendingState
+from .graph import StateRecord
+from .graph import traces_for_masks
+
+if TYPE_CHECKING:
+    from .evaluation import Evaluator
+
+
+@dataclass
+class Candidate:
+    """A state on its way to the worker that owns it."""
+
+    __slots__ = ("key", "pending")
+    # The id of its parent, then its position among the parent's successors,
+    # which sorts candidates in the order a serial search would reach them
+    key: Tuple[int, int]
+    pending: PendingState
+
+
+@dataclass
+class Expansion:
+    """A worker's result for one newly visited candidate."""
+
+    __slots__ = ("key", "pending", "predicates", "final", "error")
+    key: Tuple[int, int]
+    pending: PendingState
+    predicates: int
+    final: bool
+    error: Optional[BaseException]
+
+
+def _owner(h: Hash, n: int) -> int:
+    return int.from_bytes(h.bytes[:4], "big") % n
+
+
+def _collect_nodes(
+    get: Callable[[Hash], TreeType], h: Hash, into: Dict[bytes, TreeType]
+):
+    """Gathers every node needed to restore h into the given dict"""
+    stack = [h]
+    while len(stack) != 0:
+        cur = stack.pop()
+        if cur.bytes in into:
+            continue
+        node = get(cur)
+        into[cur.bytes] = node
+        children = node.values() if isinstance(node, dict) else node
+        stack.extend(v for v in children if isinstance(v, Hash))
+
+
+def _portable(e: BaseException) -> BaseException:
+    try:
+        pickle.dumps(e)
+    except Exception:
+        return RuntimeError(f"{e!r} (raised in a worker process)")
+    return e
+
+
+class ParallelSearch:
+    def __init__(self, evaluator: "Evaluator", workers: int):
+        self.ev = evaluator
+        self.n = workers
+        self._ctx = multiprocessing.get_context("fork")
+        self._stop = self._ctx.Event()
+        self._conns: List[Any] = []
+        self._procs: List[Any] = []
+
+    def owner(self, h: Hash) -> int:
+        return _owner(h, self.n)
+
+    def run(self, steps: int):
+        self._start()
+        try:
+            self._run(steps)
+        finally:
+            self._shutdown()
+
+    def _start(self):
+        inboxes = [self._ctx.Queue() for _ in range(self.n)]
+        for w in range(self.n):
+            parent_conn, child_conn = self._ctx.Pipe()
+            p = self._ctx.Process(
+                target=_worker_main,
+                args=(self.ev, w, child_conn, inboxes, self._stop),
+                daemon=True,
+            )
+            p.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(p)
+
+    def _shutdown(self):
+        for conn in self._conns:
+            try:
+                conn.send(("exit",))
+            except (OSError, EOFError):
+                pass
+            conn.close()
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+
+    def _recv(self, w: int) -> Any:
+        try:
+            return self._conns[w].recv()
+        except EOFError:
+            raise RuntimeError(f"Evaluation worker {w} exited unexpectedly")
+
+    def _request(self, w: int, msg: Tuple) -> Any:
+        self._conns[w].send(msg)
+        return self._recv(w)
+
+    def _run(self, steps: int):
+        ev = self.ev
+        cas = ev.state_controller.cas
+        seeds: List[List[Candidate]] = [[] for _ in range(self.n)]
+        for i, h in enumerate(ev.state_controller.commit()):
+            c = Candidate((-1, i), PendingState(h, None, None, None))
+            seeds[self.owner(h)].append(c)
+        for w, batch in enumerate(seeds):
+            nodes: Dict[bytes, TreeType] = {}
+            if not cas.shared:
+                for c in batch:
+                    _collect_nodes(cas.get, c.pending.hash, nodes)
+            self._conns[w].send(("seed", batch, nodes))
+
+        candidates = sum(len(batch) for batch in seeds)
+        for step in range(1, steps + 1):
+            if candidates == 0:
+                print("No more states to evaluate")
+                break
+            print(f"Evaluating Step {step} ({candidates} candidate states)...")
+            ev._stats.steps += 1
+            first = ev._graph.next_id
+            sids = self._record(self._evaluate_layer())
+            if step != steps:
+                candidates = self._route(sids, first)
+
+        if cas.shared:
+            ev._stats.cas_objects = cas.size()
+        else:
+            ev._stats.cas_objects = sum(
+                self._request(w, ("size",)) for w in range(self.n)
+            )
+
+    def _evaluate_layer(self) -> List[List[Expansion]]:
+        for conn in self._conns:
+            conn.send(("evaluate",))
+        results = []
+        for w in range(self.n):
+            expansions, executions = self._recv(w)
+            results.append(expansions)
+            self.ev._stats.thread_executions += executions
+        return results
+
+    def _record(self, results: List[List[Expansion]]) -> List[List[int]]:
+        """Adds the layer to the graph; returns the ids, as laid out in results"""
+        ev = self.ev
+        # Numbering in candidate order means the first path to reach a state
+        # wins, and states get the ids they would get evaluating serially.
+        order = sorted(
+            (e.key, w, i)
+            for w, batch in enumerate(results)
+            for i, e in enumerate(batch)
+        )
+        sids = [[0] * len(batch) for batch in results]
+        for _, w, i in order:
+            exp = results[w][i]
+            p = exp.pending
+            record = StateRecord(p.hash, p.parent, p.thread_id, exp.predicates)
+            sid = ev._graph.add(record)
+            sids[w][i] = sid
+            ev._stats.states += 1
+            if exp.error is not None:
+                self._fail(exp.error, sid)
+            if exp.final:
+                ev._stats.final_states += 1
+        return sids
+
+    def _route(self, sids: List[List[int]], first: int) -> int:
+        """Has the workers send their successors on; returns how many went"""
+        table = None
+        if len(self.ev.specs) != 0:
+            rows = [
+                (-1 if r.parent is None else r.parent, r.predicates)
+                for r in self.ev._graph.records_since(first)
+            ]
+            # Pickled once, rather than once per worker
+            table = pickle.dumps(rows)
+        for w, conn in enumerate(self._conns):
+            conn.send(("route", sids[w], table))
+        return sum(self._recv(w) for w in range(self.n))
+
+    def _fail(self, err: BaseException, sid: int):
+        from .evaluation import ConstraintError
+
+        if not isinstance(err, ConstraintError):
+            raise err
+        ev = self.ev
+        path = ev._graph.path(sid)
+        if not ev.state_controller.cas.shared:
+            # Pull the states along the counterexample into the local store,
+            # so that it can be restored and replayed from here.
+            by_owner: Dict[int, List[Hash]] = {}
+            for r in path:
+                by_owner.setdefault(self.owner(r.hash), []).append(r.hash)
+            for w, hashes in by_owner.items():
+                exported = self._request(w, ("export", hashes))
+                for k, node in exported.items():
+                    ev.state_controller.cas.put(Hash(k), node)
+        ev.state_controller.restore(path[-1].hash)
+        ev._raise_violation(err, sid)
+
+
+class _Worker:
+    def __init__(self, ev: "Evaluator", w: int, inboxes: List[Any], stop):
+        self.ev = ev
+        self.w = w
+        self.inboxes = inboxes
+        self.stop = stop
+        self.cas = ev.state_controller.cas
+        # Candidates to evaluate next, and the nodes peers sent with them
+        self.pending: List[Candidate] = []
+        self.nodes: Dict[bytes, TreeType] = {}
+        # How many peer batches are due before the next evaluation
+        self.due = 0
+        # The successors of each state just evaluated, until they're numbered
+        self.expanded: List[List[Tuple[int, Optional[int], Hash]]] = []
+        # The parent and predicates of every state, by id, to check specs
+        self.parents = array("q")
+        self.masks: List[int] = []
+
+    def evaluate(self) -> Tuple[List[Expansion], int]:
+        ev = self.ev
+        inbox = self.inboxes[self.w]
+        for _ in range(self.due):
+            batch, nodes = inbox.get()
+            self.pending.extend(batch)
+            self.nodes.update(nodes)
+        self.due = 0
+        self.pending.sort(key=lambda c: c.key)
+
+        executions = ev._stats.thread_executions
+        n_preds = len(ev.preds)
+        out: List[Expansion] = []
+        self.expanded = []
+        for c in self.pending:
+            if self.stop.is_set():
+                break
+            h = c.pending.hash
+            if h.bytes in ev._evaled_states:
+                continue
+            ev._evaled_states.add(h.bytes)
+            if h.bytes in self.nodes:
+                restore_nodes: Dict[bytes, TreeType] = {}
+                _collect_nodes(lambda x: self.nodes[x.bytes], h, restore_nodes)
+                for k, node in restore_nodes.items():
+                    self.cas.put(Hash(k), node)
+
+            exp = Expansion(c.key, c.pending, 0, False, None)
+            out.append(exp)
+            successors: List[Tuple[int, Optional[int], Hash]] = []
+            self.expanded.append(successors)
+            try:
+                ev.state_controller.restore(h)
+                exp.predicates = ev._eval_preds()
+                if len(ev.specs) != 0:
+                    masks = self._path_masks(c.pending.parent) + [exp.predicates]
+                    exp.error = ev._find_violation(traces_for_masks(masks, n_preds))
+                    if exp.error is not None:
+                        self.stop.set()
+                        break
+                runnable = ev._runnable_threads(c.pending.must_run)
+                if len(runnable) == 0:
+                    exp.final = True
+                    continue
+                successors.extend(ev._expand(h, runnable))
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException as e:
+                exp.error = _portable(e)
+                self.stop.set()
+                break
+        self.pending = []
+        self.nodes = {}
+        return out, ev._stats.thread_executions - executions
+
+    def route(self, sids: List[int], table: Optional[bytes]) -> int:
+        if table is not None:
+            for parent, mask in pickle.loads(table):
+                self.parents.append(parent)
+                self.masks.append(mask)
+
+        n = len(self.inboxes)
+        batches: List[List[Candidate]] = [[] for _ in range(n)]
+        nodes: List[Dict[bytes, TreeType]] = [{} for _ in range(n)]
+        sent = set()
+        for sid, successors in zip(sids, self.expanded):
+            for i, (thread_id, must_run, h) in enumerate(successors):
+                # Only the first copy of a successor can be the first to
+                # reach it, so later ones needn't travel.
+                if h.bytes in sent:
+                    continue
+                sent.add(h.bytes)
+                dest = _owner(h, n)
+                c = Candidate((sid, i), PendingState(h, sid, thread_id, must_run))
+                batches[dest].append(c)
+                if not self.cas.shared and dest != self.w:
+                    _collect_nodes(self.cas.get, h, nodes[dest])
+        self.expanded = []
+
+        for dest in range(n):
+            if dest == self.w:
+                self.pending = batches[dest]
+            else:
+                self.inboxes[dest].put((batches[dest], nodes[dest]))
+        self.due = n - 1
+        return len(sent)
+
+    def _path_masks(self, parent: Optional[int]) -> List[int]:
+        out = []
+        cur = -1 if parent is None else parent
+        while cur != -1:
+            out.append(self.masks[cur])
+            cur = self.parents[cur]
+        out.reverse()
+        return out
+
+
+def _worker_main(ev: "Evaluator", w: int, conn, inboxes: List[Any], stop):
+    worker = _Worker(ev, w, inboxes, stop)
+    cas = ev.state_controller.cas
+    try:
+        while True:
+            msg = conn.recv()
+            if msg[0] == "seed":
+                worker.pending, worker.nodes = msg[1], msg[2]
+            elif msg[0] == "evaluate":
+                conn.send(worker.evaluate())
+            elif msg[0] == "route":
+                conn.send(worker.route(msg[1], msg[2]))
+            elif msg[0] == "export":
+                out: Dict[bytes, TreeType] = {}
+                for h in msg[1]:
+                    _collect_nodes(cas.get, h, out)
+                conn.send(out)
+            elif msg[0] == "size":
+                conn.send(cas.size())
+            else:
+                return
+    except (EOFError, KeyboardInterrupt):
+        return
+    finally:
+        # Batches left for peers that stopped reading mustn't hold up exit
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+        conn.close()
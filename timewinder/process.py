@@ -7,6 +7,7 @@ from .closure import Closure
 from inspect import isfunction
 
 from typing import List
+from typing import Optional
 
 from timewinder.statetree import CAS
 from timewinder.statetree import Hash
@@ -40,6 +41,10 @@ class Process(Object, ABC):
     def on_register_evaluator(self, idx: int) -> None:
         pass
 
+    def set_profile(self, profile) -> None:
+        """Gathers a profile of what's executed, if the process keeps one"""
+        pass
+
 
 class Step:
     def __init__(self, func, args, kwargs):
@@ -56,6 +61,8 @@ class FuncProcess(Process):
         self.steps: List[Step] = args
         self.pc = 0
         self.state = state
+        # The hash last restored, while it hasn't executed since
+        self.set_hash: Optional[Hash] = None
 
     @property
     def name(self):
@@ -65,6 +72,8 @@ class FuncProcess(Process):
         self._cas = cas
 
     def get_state(self) -> TreeableType:
+        if self.set_hash is not None:
+            return self.set_hash
         return {
             "pc": self.pc,
             "state": self.state,
@@ -74,6 +83,9 @@ class FuncProcess(Process):
         pass
 
     def set_state(self, hash: Hash) -> None:
+        if hash == self.set_hash:
+            return
+        self.set_hash = hash
         state = self._cas.restore(hash)
         assert isinstance(state, dict)
         self.pc = state["pc"]
@@ -86,6 +98,7 @@ class FuncProcess(Process):
 
     def execute(self, state_controller) -> Continue:
         assert self.can_execute()
+        self.set_hash = None
         try:
             self.steps[self.pc]._eval(self.state)
             self.pc += 1
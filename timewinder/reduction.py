@@ -0,0 +1,172 @@
+"""
+Partial-order reduction with sleep sets.
+
+Running two threads whose steps touch disjoint objects in either order reaches
+the same state, so only one of the orders needs exploring. Every thread
+execution records its footprint: the objects it read (any access through the
+StateController's access log) and those it wrote (the mounts whose sub-hash
+changed). After a thread has been explored from a state, it is put to sleep in
+the states its siblings lead to, for as long as the steps taken since are
+independent of its own.
+
+A state reached again with a smaller sleep set than it was expanded with has
+the threads that woke up run from it then, so every reachable state is still
+visited and safety results are unchanged; only thread executions are saved.
+"""
+
+from itertools import chain
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+from timewinder.pause import Fairness
+from timewinder.statetree import Hash
+
+from .graph import PendingState
+
+if TYPE_CHECKING:
+    from .evaluation import Evaluator
+
+
+# (reads, writes), as bitmasks over the mounts. Reads include the writes.
+Footprint = Tuple[int, int]
+# Each sleeping thread, with the footprint of its next step
+Sleep = Dict[int, Footprint]
+
+# For steps that can't be reordered with any other
+DEPENDENT: Footprint = (-1, -1)
+
+
+def independent(a: Footprint, b: Footprint) -> bool:
+    return a[1] & b[0] == 0 and b[1] & a[0] == 0
+
+
+class SleepSets:
+    def __init__(self, evaluator: "Evaluator"):
+        self.ev = evaluator
+        sc = evaluator.state_controller
+        self._bits = {name: 1 << i for i, name in enumerate(sc.tree)}
+        sc.track_accesses()
+        # The sleep set each discovered state is expanded with; empty ones,
+        # which can't shrink, aren't kept.
+        self._sleep: Dict[bytes, Sleep] = {}
+        # State ids of the evaluated states
+        self._sids: Dict[bytes, int] = {}
+        # Threads woken up at already evaluated states, waiting to be run
+        self._wakeups: Dict[bytes, int] = {}
+
+    def is_wakeup(self, pending: PendingState) -> bool:
+        return pending.hash.bytes in self._sids
+
+    def expand(
+        self, sid: int, pending: PendingState, runnable: List[int], depth: int
+    ) -> List[PendingState]:
+        """Runs the threads that aren't asleep in a newly evaluated state"""
+        h = pending.hash
+        self._sids[h.bytes] = sid
+        sleep = self._sleep.get(h.bytes, {})
+        threads = [t for t in runnable if t not in sleep]
+        return self._run(sid, h, threads, sleep, depth, pending.must_run is not None)
+
+    def wake(self, pending: PendingState, depth: int) -> Tuple[int, List[PendingState]]:
+        """Runs the threads woken up in an already evaluated state"""
+        h = pending.hash
+        sid = self._sids[h.bytes]
+        woken = self._wakeups.pop(h.bytes)
+        self.ev.state_controller.restore(h)
+        threads = [
+            t
+            for t, thread in enumerate(self.ev.threads)
+            if (woken >> t) & 1 and thread.can_execute()
+        ]
+        sleep = self._sleep.get(h.bytes, {})
+        return sid, self._run(sid, h, threads, sleep, depth, False)
+
+    def _run(
+        self,
+        sid: int,
+        h: Hash,
+        threads: List[int],
+        sleep: Sleep,
+        depth: int,
+        pinned: bool,
+    ) -> List[PendingState]:
+        ev = self.ev
+        sc = ev.state_controller
+        before = sc.cas.get(h)
+        assert isinstance(before, dict)
+        assert sc.accessed is not None
+        out: List[PendingState] = []
+        explored: Sleep = {}
+        for i, thread_id in enumerate(threads):
+            if i != 0:
+                sc.restore(h)
+            sc.accessed.clear()
+            ev._stats.thread_executions += 1
+            cont = ev.threads[thread_id].execute(sc)
+            must_run = None
+            if cont.fairness == Fairness.IMMEDIATE:
+                must_run = thread_id
+            hashes = list(sc.commit())
+
+            reads = 0
+            for name in sc.accessed:
+                reads |= self._bits[name]
+            writes = 0
+            for succ in hashes:
+                after = sc.cas.get(succ)
+                assert isinstance(after, dict)
+                for name, bit in self._bits.items():
+                    if after[name] != before[name]:
+                        writes |= bit
+            fp = (reads | writes, writes)
+            # Pinning a thread, or branching nondeterministically, changes
+            # what else may run; keep it simple and reorder neither.
+            if pinned or must_run is not None or len(hashes) != 1:
+                fp = DEPENDENT
+
+            succ_sleep = {
+                u: f
+                for u, f in chain(sleep.items(), explored.items())
+                if independent(f, fp)
+            }
+            explored[thread_id] = fp
+            for succ in hashes:
+                self._discover(
+                    PendingState(succ, sid, thread_id, must_run), succ_sleep, depth, out
+                )
+        return out
+
+    def _discover(
+        self, p: PendingState, sleep: Sleep, depth: int, out: List[PendingState]
+    ):
+        key = p.hash.bytes
+        if self.ev._admit(p.hash, depth):
+            if len(sleep) != 0:
+                self._sleep[key] = sleep
+            out.append(p)
+            return
+        old: Optional[Sleep] = self._sleep.get(key)
+        if old is None:
+            return
+        woken = 0
+        for t in old:
+            if t not in sleep:
+                woken |= 1 << t
+        if woken == 0:
+            return
+        kept = {t: f for t, f in old.items() if t in sleep}
+        if len(kept) != 0:
+            self._sleep[key] = kept
+        else:
+            del self._sleep[key]
+        if key not in self._sids:
+            # Still queued, and will be expanded with the smaller sleep set
+            return
+        if key not in self._wakeups:
+            out.append(p)
+            self._wakeups[key] = 0
+        self._wakeups[key] |= woken
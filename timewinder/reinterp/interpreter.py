@@ -1,5 +1,4 @@
 import builtins
-import dis
 import sys
 import inspect
 from dataclasses import dataclass
@@ -9,8 +8,11 @@ from timewinder.pause import Continue
 from timewinder.pause import PauseReason
 from timewinder.pause import Fairness
 from timewinder.generators import NonDeterministicSet
+from timewinder.statetree import ThreadRef
 
 from .opcodes import OpcodeInterpreter
+from .opcodes import decode
+from .slots import UNSET
 
 from typing import Any
 from typing import Callable
@@ -27,10 +29,12 @@ OBJECT_PREFIX = "__object__"
 class Interpreter:
     def __init__(self, func: Callable, in_args=None, in_kwargs=None):
         self.func = func
-        instructions = list(dis.get_instructions(self.func))
-        self.ops = OpcodeInterpreter(self, instructions)
+        self.code = decode(func.__code__)
+        self.ops = OpcodeInterpreter(self, self.code)
+        self.varnames = func.__code__.co_varnames
         self.binds: Dict[str, Any] = {}
-        self.state: Dict[str, Any] = {}
+        # Locals, by their index in co_varnames
+        self.slots: List[Any] = [UNSET] * len(self.varnames)
         self.return_val = None
         self.done = False
         self.thread_idx: Optional[int] = None
@@ -44,26 +48,28 @@ class Interpreter:
         if in_args is None:
             in_args = []
         n_args = self.func.__code__.co_argcount
-        argnames = list(self.func.__code__.co_varnames)[:n_args]
-        for name, a in zip(argnames, in_args):
+        for i, a in enumerate(in_args[:n_args]):
             if isinstance(a, Object):
-                self.binds[name] = OBJECT_PREFIX + a.name
+                self.binds[self.varnames[i]] = OBJECT_PREFIX + a.name
             else:
-                self.state[name] = a
+                self.slots[i] = a
 
     def interpret_instruction(self) -> Continue:
         return self.ops.interpret_instruction()
 
+    def run(self) -> Continue:
+        return self.ops.run()
+
     def on_return(self, val):
         self.return_val = val
         return Continue(PauseReason.DONE)
 
-    def on_store_fast(self, name, val):
-        self.state[name] = val
+    def on_store_fast(self, slot: int, val):
+        self.slots[slot] = val
         if isinstance(val, NonDeterministicSet):
             return Continue(
                 kind=PauseReason.YIELD,
-                yield_msg=f"NonDeterminism({name})",
+                yield_msg=f"NonDeterminism({self.varnames[slot]})",
                 fairness=Fairness.IMMEDIATE,
             )
         return None
@@ -71,7 +77,8 @@ class Interpreter:
     def resolve_call_function(self, func, args):
         if isinstance(func, TagStub):
             if func.tag == "thread_id":
-                return self.thread_idx
+                assert self.thread_idx is not None
+                return ThreadRef(self.thread_idx)
             raise NotImplementedError()
         else:
             return func(*args)
@@ -85,14 +92,23 @@ class Interpreter:
             is_bound = True
         return (is_bound, method)
 
-    def resolve_var_by_name(self, varname: str):
-        if varname in self.state:
-            return self.state[varname]
+    def resolve_fast(self, slot: int):
+        v = self.slots[slot]
+        if v is UNSET:
+            return self.resolve_unset(slot)
+        return v
+
+    def resolve_unset(self, slot: int):
+        varname = self.varnames[slot]
         if varname in self.binds:
             ref = self.binds[varname]
             return self._get_from_tree(ref)
         raise LookupError(f"Couldn't find variable {varname}")
 
+    def locals(self) -> Dict[str, Any]:
+        """The assigned locals, by name"""
+        return {name: v for name, v in zip(self.varnames, self.slots) if v is not UNSET}
+
     def resolve_var(self, var):
         if isinstance(var, str):
             if var.startswith(OBJECT_PREFIX):
@@ -125,30 +141,47 @@ class Interpreter:
     def _get_from_tree(self, base):
         assert self.state_controller is not None
         object_name = base[len(OBJECT_PREFIX) :]
+        if self.state_controller.accessed is not None:
+            self.state_controller.accessed.add(object_name)
         return self.state_controller.tree[object_name]
 
     def debug_print(self):
         import pprint
 
         print("\n\nState:\n")
-        pprint.pprint(self.state)
+        pprint.pprint(self.locals())
         print("\nInstructions:\n")
         _print_list(self.ops.instructions, self.ops.pc)
         print("\n\n")
 
     def resolve_global(self, name):
-        func_mod = sys.modules[self.func.__module__]
-        g = getattr(func_mod, name, None)
-        if g is None:
-            g = self.func.__globals__.get(name, None)
-        if g is None:
-            g = getattr(builtins, name)
-        tag = getattr(g, "__timewinder_tag", None)
+        # Globals are looked up once per function, and again whenever the
+        # name is rebound in the function's globals.
+        bound = self.func.__globals__.get(name)
+        resolved = self.code.globals.get(name)
+        if resolved is None or resolved[2] is not bound:
+            g = find_global(self.func, name)
+            if g is None:
+                g = getattr(builtins, name)
+            resolved = (g, getattr(g, "__timewinder_tag", None), bound)
+            self.code.globals[name] = resolved
+        g, tag, _ = resolved
         if tag is None:
             return g
         return TagStub(tag, self.pc)
 
 
+def find_global(func: Callable, name: str):
+    """What a global name in func refers to, or None"""
+    func_mod = sys.modules[func.__module__]
+    g = getattr(func_mod, name, None)
+    if g is None:
+        g = func.__globals__.get(name, None)
+    if g is None:
+        g = getattr(builtins, name, None)
+    return g
+
+
 @dataclass
 class TagStub:
     tag: str
@@ -0,0 +1,81 @@
+"""
+Which locals of a function may still be read, at each of its instructions.
+
+A local is live at a pc if some path from there loads it before storing to
+it. The others are dead: whatever they hold can't change what the process
+does any more, so they're left out of its state, and states that differ
+only by them are the same state. Likewise, values on top of the stack that
+are about to be popped unread, like the value of a yield statement, are
+stored as None.
+"""
+
+import dis
+
+from typing import List
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .opcodes import DecodedCode
+
+
+# Instructions that never carry on to the next one
+_ENDS = {"RETURN_VALUE", "RAISE_VARARGS", "RERAISE"}
+_GOTOS = {"JUMP_ABSOLUTE", "JUMP_FORWARD"}
+_JUMPS = set(dis.hasjabs) | set(dis.hasjrel)
+
+
+class Liveness:
+    def __init__(self, code: "DecodedCode"):
+        n = len(code.instructions)
+        self.varnames = code.code.co_varnames
+        succs: List[List[int]] = []
+        uses = [0] * n
+        defs = [0] * n
+        for pc, inst in enumerate(code.instructions):
+            out = []
+            if inst.opname not in _ENDS and inst.opname not in _GOTOS:
+                out.append(pc + 1)
+            if inst.opcode in _JUMPS:
+                out.append(code.args[pc])
+            succs.append([s for s in out if s < n])
+            if inst.opname == "LOAD_FAST":
+                uses[pc] = 1 << code.args[pc]
+            elif inst.opname in ("STORE_FAST", "DELETE_FAST"):
+                defs[pc] = 1 << code.args[pc]
+
+        # Bitmaps of the slots live on entering each instruction
+        self.live = [0] * n
+        changed = True
+        while changed:
+            changed = False
+            for pc in range(n - 1, -1, -1):
+                live_out = 0
+                for s in succs[pc]:
+                    live_out |= self.live[s]
+                live_in = uses[pc] | (live_out & ~defs[pc])
+                if live_in != self.live[pc]:
+                    self.live[pc] = live_in
+                    changed = True
+
+        # How many values on top of the stack each instruction starts by
+        # discarding
+        self.dead_tops = [0] * (n + 1)
+        for pc in range(n - 1, -1, -1):
+            if code.instructions[pc].opname == "POP_TOP":
+                self.dead_tops[pc] = 1 + self.dead_tops[pc + 1]
+
+    def live_at(self, pc: int) -> int:
+        """The bitmap of the slots that may still be read, resuming at pc"""
+        if 0 <= pc < len(self.live):
+            return self.live[pc]
+        # Done
+        return 0
+
+    def dead_top(self, pc: int) -> int:
+        if 0 <= pc < len(self.live):
+            return self.dead_tops[pc]
+        return 0
+
+    def dead_names(self, pc: int) -> List[str]:
+        live = self.live_at(pc)
+        return [v for i, v in enumerate(self.varnames) if not live >> i & 1]
@@ -0,0 +1,281 @@
+"""
+Compiles the straight-line stretches of a function's bytecode to Python.
+
+Starting from the pc a process enters it at, a block runs forward over the
+instructions that can't pause the process, up to the first one that can (a
+yield, a return, anything unsupported), and is generated as Python source and
+exec'd. The block keeps the operand stack in locals, only spilling what's left
+of it back to the process's stack on the way out, and leaves through its
+conditional jumps as it reaches them. A jump back to where it was entered,
+with the stack as it found it, loops without leaving.
+
+A block takes the OpcodeInterpreter, its Interpreter, the locals' slots and
+the stack, and returns the pc to carry on from. If a store pauses the process,
+it sets the pc itself and returns the Continue instead. If an instruction
+raises, the block sets the pc to it and spills the operands under the ones it
+popped before re-raising, leaving the process as interpretation would have.
+
+Everything that reads or changes process state goes through the same
+Interpreter delegates the handlers use, so the steps and the state they
+leave behind are the ones interpretation would give.
+"""
+
+from timewinder.generators import NonDeterministicSet as _NDS
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import TYPE_CHECKING
+
+from .slots import UNSET
+
+if TYPE_CHECKING:
+    from .opcodes import DecodedCode
+
+
+NativeBlock = Callable[..., Any]
+
+# Not worth a call for fewer instructions than this
+MIN_BLOCK = 2
+
+
+class _BlockWriter:
+    def __init__(self, code: "DecodedCode", entry: int):
+        self.code = code
+        self.entry = entry
+        self.lines: List[str] = []
+        self.names: Dict[str, Any] = {"_NDS": _NDS, "_UNSET": UNSET}
+        # Operands pushed by the block and not yet spilled, as local names
+        self.sim: List[str] = []
+        self.temps = 0
+        # Whether the block has popped below the stack it was entered with
+        self.underflow = False
+        # How far the instruction being written has popped into sim
+        self.floor = 0
+        # For each instruction that can raise, the operands left under the
+        # ones it pops, to spill as its handler would have left them
+        self.live: Dict[int, List[str]] = {}
+        self.indent = 3
+
+    def emit(self, line: str):
+        self.lines.append("    " * self.indent + line)
+
+    def const(self, v: Any) -> str:
+        name = f"_k{len(self.names)}"
+        self.names[name] = v
+        return name
+
+    def push(self, expr: str) -> str:
+        t = f"_t{self.temps}"
+        self.temps += 1
+        self.emit(f"{t} = {expr}")
+        self.sim.append(t)
+        return t
+
+    def pop(self) -> str:
+        if self.sim:
+            v = self.sim.pop()
+            self.floor = min(self.floor, len(self.sim))
+            return v
+        self.underflow = True
+        t = f"_t{self.temps}"
+        self.temps += 1
+        self.emit(f"{t} = stack.pop()")
+        return t
+
+    def leave(self, pc: int, cont: Optional[str] = None):
+        if cont is not None:
+            # Before spilling, in case it raises
+            self.emit(f"_r = {cont}")
+        if self.sim:
+            self.emit(f"stack.extend(({', '.join(self.sim)},))")
+        if cont is not None:
+            self.emit(f"ops.pc = {pc}")
+            self.emit("return _r")
+        elif pc == self.entry and not self.sim and not self.underflow:
+            self.emit("continue")
+        else:
+            self.emit(f"return {pc}")
+
+    def branch(self, cond: str, pc: int):
+        self.emit(f"if {cond}:")
+        self.indent += 1
+        self.leave(pc)
+        self.indent -= 1
+
+    def write(self, pc: int) -> bool:
+        """Writes the instruction at pc, returning whether the block goes on"""
+        inst = self.code.instructions[pc]
+        writer = getattr(self, "write_" + inst.opname.lower())
+        start, sim = len(self.lines), list(self.sim)
+        self.floor = len(sim)
+        goes_on = writer(pc, self.code.args[pc]) is not False
+        # Only instructions that emit code can raise
+        if len(self.lines) != start:
+            self.lines.insert(start, "    " * self.indent + f"_pc = {pc}")
+            if self.floor != 0:
+                self.live[pc] = sim[: self.floor]
+        return goes_on
+
+    def write_load_const(self, pc, arg):
+        self.sim.append(self.const(arg))
+
+    def write_load_fast(self, pc, arg):
+        t = self.push(f"slots[{arg}]")
+        self.emit(f"if {t} is _UNSET:")
+        self.emit(f"    {t} = proc.resolve_unset({arg})")
+
+    def write_store_fast(self, pc, arg):
+        v = self.pop()
+        self.emit(f"slots[{arg}] = {v}")
+        if v in self.names and not isinstance(self.names[v], _NDS):
+            return
+        # As on_store_fast would pause, which is rare enough to ask it
+        self.emit(f"if isinstance({v}, _NDS):")
+        self.indent += 1
+        self.leave(pc + 1, f"proc.on_store_fast({arg}, {v})")
+        self.indent -= 1
+
+    def write_load_global(self, pc, arg):
+        # Tagged globals remember the pc they were loaded at
+        self.emit(f"ops.pc = {pc}")
+        self.push(f"proc.resolve_global({arg!r})")
+
+    def write_load_attr(self, pc, arg):
+        self.push(f"proc.resolve_getattr({self.pop()}, {arg!r})")
+
+    def write_store_attr(self, pc, arg):
+        tos = self.pop()
+        tos1 = self.pop()
+        self.emit(f"proc.on_setattr({tos}, {arg!r}, {tos1})")
+
+    def write_load_method(self, pc, arg):
+        tos = self.pop()
+        b, m = f"_b{self.temps}", f"_m{self.temps}"
+        self.emit(f"{b}, {m} = proc.resolve_load_method({tos}, {arg!r})")
+        self.push(f"None if {b} else {m}")
+        self.push(f"{m} if {b} else {tos}")
+
+    def write_call_method(self, pc, arg):
+        args = [self.pop() for _ in range(arg)][::-1]
+        tos = self.pop()
+        tos1 = self.pop()
+        bound = ", ".join([tos] + args)
+        unbound = ", ".join(args)
+        self.push(
+            f"call({tos}, [{unbound}]) if {tos1} is None else call({tos1}, [{bound}])"
+        )
+
+    def write_call_function(self, pc, arg):
+        args = [self.pop() for _ in range(arg)][::-1]
+        func = self.pop()
+        self.push(f"call({func}, [{', '.join(args)}])")
+
+    def write_store_subscr(self, pc, arg):
+        tos = self.pop()
+        tos1 = self.pop()
+        tos2 = self.pop()
+        self.emit(f"{tos1}[{tos}] = {tos2}")
+
+    def write_binary_subscr(self, pc, arg):
+        tos = self.pop()
+        tos1 = self.pop()
+        self.push(f"proc.resolve_var({tos1})[{tos}]")
+
+    def write_build_slice(self, pc, arg):
+        tos = self.pop()
+        tos1 = self.pop()
+        if arg == 2:
+            self.push(f"slice({tos1}, {tos})")
+        else:
+            self.push(f"slice({self.pop()}, {tos1}, {tos})")
+
+    def write_pop_top(self, pc, arg):
+        self.pop()
+
+    def write_dup_top(self, pc, arg):
+        tos = self.pop()
+        self.sim.extend((tos, tos))
+
+    def write_rot_two(self, pc, arg):
+        tos = self.pop()
+        tos1 = self.pop()
+        self.sim.extend((tos, tos1))
+
+    def write_nop(self, pc, arg):
+        pass
+
+    def write_binary_add(self, pc, arg):
+        self._write_binop("+")
+
+    def write_binary_subtract(self, pc, arg):
+        self._write_binop("-")
+
+    def write_inplace_subtract(self, pc, arg):
+        self._write_binop("-")
+
+    def _write_binop(self, op: str):
+        tos = self.pop()
+        tos1 = self.pop()
+        self.push(f"{tos1} {op} {tos}")
+
+    def write_compare_op(self, pc, arg):
+        self._write_binop(self.code.instructions[pc].argval)
+
+    def write_pop_jump_if_false(self, pc, arg):
+        self.branch(f"not {self.pop()}", arg)
+
+    def write_pop_jump_if_true(self, pc, arg):
+        self.branch(self.pop(), arg)
+
+    def write_jump_absolute(self, pc, arg):
+        self.leave(arg)
+        return False
+
+    def source(self) -> str:
+        head = [
+            "def _block(ops, proc, slots, stack):",
+            "    call = proc.resolve_call_function",
+            f"    _pc = {self.entry}",
+            "    try:",
+            "        while True:",
+        ]
+        # Leave the process where interpretation would have stopped
+        tail = [
+            "    except BaseException:",
+            "        ops.pc = _pc",
+        ]
+        for pc, live in self.live.items():
+            tail.append(f"        if _pc == {pc}:")
+            tail.append(f"            stack.extend(({', '.join(live)},))")
+        tail.append("        raise")
+        return "\n".join(head + self.lines + tail) + "\n"
+
+
+def _writable(code: "DecodedCode", pc: int) -> bool:
+    # None of the instructions with a writer pause the process, short of a store
+    inst = code.instructions[pc]
+    writer = getattr(_BlockWriter, "write_" + inst.opname.lower(), None)
+    if code.handlers[pc] is None or writer is None:
+        return False
+    return inst.opname != "BUILD_SLICE" or code.args[pc] in (2, 3)
+
+
+def compile_block(code: "DecodedCode", entry: int) -> Optional[NativeBlock]:
+    """The native block entered at pc entry, or None if it would be too short"""
+    w = _BlockWriter(code, entry)
+    pc = entry
+    goes_on = True
+    # Up to the first instruction left to the interpreter
+    while goes_on and pc < len(code.instructions) and _writable(code, pc):
+        goes_on = w.write(pc)
+        pc += 1
+    if pc - entry < MIN_BLOCK:
+        return None
+    if goes_on:
+        w.leave(pc)
+    namespace = dict(w.names)
+    exec(compile(w.source(), f"<native block {entry}>", "exec"), namespace)
+    return namespace["_block"]
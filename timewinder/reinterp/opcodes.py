@@ -1,55 +1,173 @@
 import dis
 import operator
+import time
 from timewinder.pause import Continue
 from timewinder.pause import PauseReason
 
+from types import CodeType
+
 from typing import Any
+from typing import Callable
 from typing import List
 from typing import Dict
 from typing import Optional
 from typing import Union
 from typing import TYPE_CHECKING
 
+from .liveness import Liveness
+from .native import compile_block
+
 if TYPE_CHECKING:
     from .interpreter import Interpreter
+    from .profiler import Profile
 
 
 ProgressType = Optional[Union[PauseReason, Continue]]
 DEFAULT_CONTINUE = Continue()
+_NORMAL = PauseReason.NORMAL
+_JUMPED = PauseReason.PC_JUMPED
+
+Handler = Callable[["OpcodeInterpreter", Any], ProgressType]
+_JUMPS = set(dis.hasjabs) | set(dis.hasjrel)
+# Locals are addressed by their slot
+_LOCALS = set(dis.haslocal)
+_UNCOMPILED = object()
+_COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+}
+
+
+class DecodedCode:
+    """
+    A function's instructions, decoded once and shared by every interpreter
+    running it: the handler for each, its argument, with jump targets as
+    pcs rather than offsets and locals as slots rather than names, and the
+    globals it has resolved so far.
+    """
+
+    def __init__(self, code: CodeType):
+        self.code = code
+        self.instructions = list(dis.get_instructions(code))
+        self.pcs = {inst.offset: i for i, inst in enumerate(self.instructions)}
+        self.handlers: List[Optional[Handler]] = []
+        self.args: List[Any] = []
+        for inst in self.instructions:
+            handler = getattr(OpcodeInterpreter, "exec_" + inst.opname.lower(), None)
+            arg = inst.argval
+            if inst.opcode in _JUMPS:
+                arg = self.pcs[arg]
+            elif inst.opcode in _LOCALS:
+                arg = inst.arg
+            elif inst.opname == "COMPARE_OP":
+                arg = _COMPARISONS.get(arg)
+                if arg is None:
+                    handler = None
+            self.handlers.append(handler)
+            self.args.append(arg)
+        # Global name -> (value, timewinder tag, what the name was bound to)
+        self.globals: Dict[str, Any] = {}
+        # The native block entered at each pc, compiled on first entry
+        self.natives: List[Any] = [_UNCOMPILED] * len(self.instructions)
+        self.liveness = Liveness(self)
+
+
+_decoded: Dict[CodeType, DecodedCode] = {}
+
+
+def decode(code: CodeType) -> DecodedCode:
+    d = _decoded.get(code)
+    if d is None:
+        d = _decoded[code] = DecodedCode(code)
+    return d
 
 
 class OpcodeInterpreter:
-    def __init__(self, proc: "Interpreter", instructions):
+    # Whether run() executes straight-line code through native blocks
+    native_blocks = True
+    # Set to have run() count and time each instruction
+    profile: Optional["Profile"] = None
+
+    def __init__(self, proc: "Interpreter", code: DecodedCode):
         self.proc = proc
         self.stack: List[Any] = []
-        self.instructions: Dict[int, dis.Instruction] = {i: inst for (i, inst) in enumerate(instructions)}
+        self.code = code
+        self.instructions = code.instructions
         self.pc = 0
 
+    # The handlers below use the stack directly, for speed
     def push_stack(self, v: Any):
-        # As a debugging strategy, find when an unusual value is pushed on the
-        # stack and start a breakpoint, right here.
         self.stack.append(v)
 
     def pop_stack(self) -> Any:
-        assert len(self.stack) > 0
-        v = self.stack[-1]
-        self.stack = self.stack[:-1]
-        return v
+        return self.stack.pop()
 
     def find_pc_for_offset(self, offset):
-        for i, x in self.instructions.items():
-            if x.offset == offset:
-                return i
+        return self.code.pcs[offset]
 
     def interpret_instruction(self) -> Continue:
-        inst = self.instructions[self.pc]
-        methodname = "exec_" + inst.opname.lower()
-        try:
-            method = self.__getattribute__(methodname)
-            ret: ProgressType = method(inst)
-        except AttributeError as e:
-            print(e)
-            return self._exec_debug(inst)
+        pc = self.pc
+        handler = self.code.handlers[pc]
+        if handler is None:
+            return self._exec_debug(self.instructions[pc])
+        return self._advance(handler(self, self.code.args[pc]))
+
+    def run(self) -> Continue:
+        """Interprets instructions until the process yields or returns"""
+        if self.profile is not None:
+            return self._run_profiled(self.profile)
+        handlers = self.code.handlers
+        args = self.code.args
+        natives = self.code.natives if self.native_blocks else None
+        proc = self.proc
+        n = len(handlers)
+        cont = DEFAULT_CONTINUE
+        while self.pc < n:
+            pc = self.pc
+            if natives is not None:
+                block = natives[pc]
+                if block is _UNCOMPILED:
+                    block = natives[pc] = compile_block(self.code, pc)
+                if block is not None:
+                    ret = block(self, proc, proc.slots, self.stack)
+                    if ret.__class__ is int:
+                        self.pc = ret
+                        continue
+                    return ret
+            handler = handlers[pc]
+            if handler is None:
+                return self._exec_debug(self.instructions[pc])
+            ret = handler(self, args[pc])
+            if ret is None or ret is _NORMAL:
+                self.pc = pc + 1
+            elif ret is not _JUMPED:
+                cont = self._advance(ret)
+                if cont.kind == PauseReason.DONE or cont.kind == PauseReason.YIELD:
+                    return cont
+        return cont
+
+    def _run_profiled(self, profile: "Profile") -> Continue:
+        stats = profile.function(self.code)
+        clock = time.perf_counter
+        n = len(self.instructions)
+        cont = DEFAULT_CONTINUE
+        while self.pc < n:
+            pc = self.pc
+            start = clock()
+            try:
+                cont = self.interpret_instruction()
+            finally:
+                stats.counts[pc] += 1
+                stats.times[pc] += clock() - start
+            if cont.kind == PauseReason.DONE or cont.kind == PauseReason.YIELD:
+                return cont
+        return cont
+
+    def _advance(self, ret: ProgressType) -> Continue:
         # Unify return types into Continue
         # None case
         out: Continue
@@ -74,154 +192,140 @@ class OpcodeInterpreter:
             f"instructions of type {inst.opname} aren't supported yet"
         )
 
-    def exec_load_const(self, inst):
-        self.push_stack(inst.argval)
+    def exec_load_const(self, arg):
+        self.stack.append(arg)
 
-    def exec_load_fast(self, inst):
-        self.push_stack(self.proc.resolve_var_by_name(inst.argval))
+    def exec_load_fast(self, arg):
+        self.stack.append(self.proc.resolve_fast(arg))
 
-    def exec_load_global(self, inst):
-        val = self.proc.resolve_global(inst.argval)
-        self.push_stack(val)
+    def exec_load_global(self, arg):
+        val = self.proc.resolve_global(arg)
+        self.stack.append(val)
 
-    def exec_load_attr(self, inst):
-        val = self.proc.resolve_getattr(self.pop_stack(), inst.argval)
-        self.push_stack(val)
+    def exec_load_attr(self, arg):
+        val = self.proc.resolve_getattr(self.stack.pop(), arg)
+        self.stack.append(val)
 
-    def exec_load_method(self, inst):
-        tos = self.pop_stack()
-        bound, method = self.proc.resolve_load_method(tos, inst.argval)
+    def exec_load_method(self, arg):
+        tos = self.stack.pop()
+        bound, method = self.proc.resolve_load_method(tos, arg)
         if bound:
-            self.push_stack(None)
-            self.push_stack(method)
+            self.stack.append(None)
+            self.stack.append(method)
         else:
-            self.push_stack(method)
-            self.push_stack(tos)
+            self.stack.append(method)
+            self.stack.append(tos)
 
-    def exec_store_fast(self, inst):
-        return self.proc.on_store_fast(inst.argval, self.pop_stack())
+    def exec_store_fast(self, arg):
+        return self.proc.on_store_fast(arg, self.stack.pop())
 
-    def exec_store_attr(self, inst):
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
-        return self.proc.on_setattr(tos, inst.argval, tos1)
+    def exec_store_attr(self, arg):
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
+        return self.proc.on_setattr(tos, arg, tos1)
 
-    def exec_nop(self, inst):
+    def exec_nop(self, arg):
         pass
 
-    def exec_dup_top(self, inst):
-        tos = self.pop_stack()
-        self.push_stack(tos)
-        self.push_stack(tos)
+    def exec_dup_top(self, arg):
+        tos = self.stack.pop()
+        self.stack.append(tos)
+        self.stack.append(tos)
 
-    def exec_store_subscr(self, inst):
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
-        tos2 = self.pop_stack()
+    def exec_store_subscr(self, arg):
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
+        tos2 = self.stack.pop()
         tos1[tos] = tos2
 
-    def exec_binary_subscr(self, inst):
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
+    def exec_binary_subscr(self, arg):
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
         v = self.proc.resolve_var(tos1)
-        self.push_stack(v[tos])
-
-    def exec_build_slice(self, inst):
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
-        if inst.argval == 2:
-            self.push_stack(slice(tos1, tos))
-        elif inst.argval == 3:
-            tos2 = self.pop_stack()
-            self.push_stack(slice(tos2, tos1, tos))
+        self.stack.append(v[tos])
+
+    def exec_build_slice(self, arg):
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
+        if arg == 2:
+            self.stack.append(slice(tos1, tos))
+        elif arg == 3:
+            tos2 = self.stack.pop()
+            self.stack.append(slice(tos2, tos1, tos))
         else:
             assert False, "instruction has invalid argval"
 
-    def exec_call_method(self, inst):
+    def exec_call_method(self, arg):
         args = []
-        for i in range(inst.argval):
-            args.append(self.pop_stack())
+        for i in range(arg):
+            args.append(self.stack.pop())
         args.reverse()
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
         if tos1 is None:
             ret = self.proc.resolve_call_function(tos, args)
         else:
             args.insert(0, tos)
             ret = self.proc.resolve_call_function(tos1, args)
-        self.push_stack(ret)
+        self.stack.append(ret)
 
-    def exec_call_function(self, inst):
+    def exec_call_function(self, arg):
         args = []
-        for i in range(inst.argval):
-            args.append(self.pop_stack())
+        for i in range(arg):
+            args.append(self.stack.pop())
         args.reverse()
-        func = self.pop_stack()
+        func = self.stack.pop()
         # Delegate to the process to do the rest
         ret = self.proc.resolve_call_function(func, args)
-        self.push_stack(ret)
-
-    def exec_pop_top(self, inst):
-        self.pop_stack()
-
-    def exec_rot_two(self, inst):
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
-        self.push_stack(tos)
-        self.push_stack(tos1)
-
-    def exec_binary_add(self, inst):
-        self._exec_binop(inst, operator.add)
-
-    def exec_binary_subtract(self, inst):
-        self._exec_binop(inst, operator.sub)
-
-    def exec_inplace_subtract(self, inst):
-        self._exec_binop(inst, operator.sub)
-
-    def _exec_binop(self, inst, op):
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
-        self.push_stack(op(tos1, tos))
-
-    def exec_compare_op(self, inst):
-        tos = self.pop_stack()
-        tos1 = self.pop_stack()
-        if inst.argval == "==":
-            self.push_stack(tos1 == tos)
-        elif inst.argval == "!=":
-            self.push_stack(tos1 != tos)
-        elif inst.argval == "<":
-            self.push_stack(tos1 < tos)
-        elif inst.argval == ">":
-            self.push_stack(tos1 > tos)
-        elif inst.argval == "<=":
-            self.push_stack(tos1 <= tos)
-        elif inst.argval == ">=":
-            self.push_stack(tos1 >= tos)
-        else:
-            self.proc.debug_print()
-            assert False, f"unknown operator {inst.argval}"
+        self.stack.append(ret)
+
+    def exec_pop_top(self, arg):
+        self.stack.pop()
+
+    def exec_rot_two(self, arg):
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
+        self.stack.append(tos)
+        self.stack.append(tos1)
+
+    def exec_binary_add(self, arg):
+        self._exec_binop(operator.add)
+
+    def exec_binary_subtract(self, arg):
+        self._exec_binop(operator.sub)
+
+    def exec_inplace_subtract(self, arg):
+        self._exec_binop(operator.sub)
+
+    def _exec_binop(self, op):
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
+        self.stack.append(op(tos1, tos))
+
+    def exec_compare_op(self, op):
+        tos = self.stack.pop()
+        tos1 = self.stack.pop()
+        self.stack.append(op(tos1, tos))
 
-    def exec_pop_jump_if_false(self, inst):
-        if not self.pop_stack():
-            self.pc = self.find_pc_for_offset(inst.argval)
+    def exec_pop_jump_if_false(self, arg):
+        if not self.stack.pop():
+            self.pc = arg
             return PauseReason.PC_JUMPED
         return PauseReason.NORMAL
 
-    def exec_pop_jump_if_true(self, inst):
-        if self.pop_stack():
-            self.pc = self.find_pc_for_offset(inst.argval)
+    def exec_pop_jump_if_true(self, arg):
+        if self.stack.pop():
+            self.pc = arg
             return PauseReason.PC_JUMPED
         return PauseReason.NORMAL
 
-    def exec_jump_absolute(self, inst):
-        self.pc = self.find_pc_for_offset(inst.argval)
+    def exec_jump_absolute(self, arg):
+        self.pc = arg
         return PauseReason.PC_JUMPED
 
-    def exec_return_value(self, inst):
+    def exec_return_value(self, arg):
         self.pc = -1
-        return self.proc.on_return(self.pop_stack())
+        return self.proc.on_return(self.stack.pop())
 
-    def exec_yield_value(self, inst):
+    def exec_yield_value(self, arg):
         return Continue(PauseReason.YIELD, self.stack[-1])
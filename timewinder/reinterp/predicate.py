@@ -1,24 +1,101 @@
+import inspect
+
+from timewinder.object import Object
 from timewinder.predicate import Predicate
 from timewinder.statetree import StateController
 from timewinder.pause import Continue
 from timewinder.pause import PauseReason
 
 from .interpreter import Interpreter
+from .interpreter import find_global
+
+from types import CodeType
+
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+_SUSPENDING = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
 
 
 class InterpretedPredicate(Predicate):
+    """
+    A predicate that only reads state is called natively, with its object
+    arguments swapped for the objects mounted under their names. One that
+    yields, or calls timewinder's tagged functions, is interpreted.
+    """
+
     def __init__(self, func, args, kwargs):
         self._name = func.__name__
-        self.interp = Interpreter(func, args, kwargs)
+        self.func = func
+        self.native = not _needs_interpreter(func)
+        if self.native:
+            # Checked by calling the function itself, over these
+            self._args = list(args)
+            self._kwargs = dict(kwargs)
+            # Where the objects go, and their names
+            self._objects: List[Tuple[int, str]] = []
+            self._kwobjects: List[Tuple[str, str]] = []
+            for i, a in enumerate(args):
+                if isinstance(a, Object):
+                    self._objects.append((i, a.name))
+            for k, a in kwargs.items():
+                if isinstance(a, Object):
+                    self._kwobjects.append((k, a.name))
+            self._names = [n for _, n in self._objects + self._kwobjects]
+        else:
+            self.interp = Interpreter(func, args, kwargs)
+            self._slots = list(self.interp.slots)
 
     def check(self, sc: StateController) -> bool:
-        self.interp.state_controller = sc
+        if self.native:
+            return self._check_native(sc)
+        return self._check_interpreted(sc)
+
+    def _check_interpreted(self, sc: StateController) -> bool:
+        interp = self.interp
+        # From the top, every time
+        interp.slots = list(self._slots)
+        interp.ops.stack = []
+        interp.ops.pc = 0
+        interp.state_controller = sc
         cont = Continue()
         while not cont.kind == PauseReason.DONE:
-            cont = self.interp.interpret_instruction()
-        self.interp.state_controller = None
-        return self.interp.return_val
+            cont = interp.run()
+        interp.state_controller = None
+        return interp.return_val
+
+    def _check_native(self, sc: StateController) -> bool:
+        tree = sc.tree
+        args = self._args
+        for i, name in self._objects:
+            args[i] = tree[name]
+        if sc.accessed is not None:
+            sc.accessed.update(self._names)
+        if not self._kwargs:
+            return self.func(*args)
+        kwargs = self._kwargs
+        for k, name in self._kwobjects:
+            kwargs[k] = tree[name]
+        return self.func(*args, **kwargs)
 
     @property
     def name(self) -> str:
         return self._name
+
+
+def _needs_interpreter(func: Callable, code: Optional[CodeType] = None) -> bool:
+    if code is None:
+        code = func.__code__
+    if code.co_flags & _SUSPENDING:
+        return True
+    # Attribute names are in co_names too, so this errs towards interpreting
+    for name in code.co_names:
+        if getattr(find_global(func, name), "__timewinder_tag", None) is not None:
+            return True
+    # Lambdas and comprehensions inside it
+    for c in code.co_consts:
+        if isinstance(c, CodeType) and _needs_interpreter(func, c):
+            return True
+    return False
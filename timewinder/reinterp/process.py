@@ -3,21 +3,34 @@ from timewinder.process import ProcessException
 from timewinder.statetree import CAS
 from timewinder.statetree import Hash
 from timewinder.statetree import TreeableType
-from timewinder.pause import Continue
+from timewinder.statetree.tracked import LazyList
 from timewinder.pause import PauseReason
 
 from .interpreter import Interpreter
+from .profiler import Profile
+from .slots import decode_state
+from .slots import encode_state
 
 from typing import Callable
+from typing import List
 from typing import Optional
 
 
 class BytecodeProcess(Process):
+    # Whether locals that won't be read again are left out of the state, so
+    # that states differing only by them are explored once
+    prune_dead = True
+
     def __init__(self, func: Callable, in_args=None, in_kwargs=None):
         self._funcname = func.__name__
         self._stepname = "start"
         self.interp = Interpreter(func, in_args, in_kwargs)
         self.set_hash: Optional[Hash] = None
+        # Locals named with a leading underscore aren't kept between steps
+        self._kept = 0
+        for i, v in enumerate(self.interp.varnames):
+            if not v.startswith("_"):
+                self._kept |= 1 << i
 
     def on_register_evaluator(self, idx: int) -> None:
         self.interp.thread_idx = idx
@@ -26,6 +39,9 @@ class BytecodeProcess(Process):
     def name(self) -> str:
         return f"{self._funcname}@{self._stepname}"
 
+    def set_profile(self, profile: Optional[Profile]) -> None:
+        self.interp.ops.profile = profile
+
     def can_execute(self) -> bool:
         if self.interp.pc < 0:
             return False
@@ -34,14 +50,10 @@ class BytecodeProcess(Process):
     def execute(self, state_controller):
         self.set_hash = None
         self.interp.state_controller = state_controller
-        cont = Continue()
-        while self.interp.pc < len(self.interp.instructions):
-            try:
-                cont = self.interp.interpret_instruction()
-            except Exception as e:
-                raise ProcessException(f"{self.name}@{self.interp.pc}", e)
-            if cont.kind == PauseReason.DONE or cont.kind == PauseReason.YIELD:
-                break
+        try:
+            cont = self.interp.run()
+        except Exception as e:
+            raise ProcessException(f"{self.name}@{self.interp.pc}", e)
 
         if cont.kind == PauseReason.YIELD:
             if cont.yield_msg != "":
@@ -55,29 +67,43 @@ class BytecodeProcess(Process):
     def get_state(self) -> TreeableType:
         if self.set_hash is not None:
             return self.set_hash
-        save_state = {
-            k: v for (k, v) in self.interp.state.items()
-            if not k.startswith("_")
-        }
-        return {
-            "state": save_state,
-            "stack": self.interp.ops.stack,
-            "pc": self.interp.ops.pc,
-            "_stepname": self._stepname,
-            "_funcname": self._funcname,
-        }
+        pc = self.interp.ops.pc
+        kept, dead_top = self._kept, 0
+        if self.prune_dead:
+            liveness = self.interp.code.liveness
+            kept &= liveness.live_at(pc)
+            dead_top = liveness.dead_top(pc)
+        return encode_state(
+            pc, self._stepname, self.interp.slots, kept, self.interp.ops.stack, dead_top
+        )
+
+    def pruned(self) -> List[str]:
+        """The assigned locals left out of the state, being dead where it's at"""
+        dead = self.interp.code.liveness.dead_names(self.interp.ops.pc)
+        assigned = self.interp.locals()
+        return [v for v in dead if v in assigned] if self.prune_dead else []
 
     def set_state(self, hash: Hash):
         if hash == self.set_hash:
             return
         self.set_hash = hash
-        state = self._cas.restore(hash)
-        assert isinstance(state, dict)
-        self.interp.state = state["state"]
-        self.interp.ops.stack = state["stack"]
-        self.interp.ops.pc = state["pc"]
-        self._stepname = state["_stepname"]
-        self._funcname = state["_funcname"]
+        if self._cas.lazy_restore:
+            node = self._cas.get(hash)
+        else:
+            node = self._cas.restore(hash)
+        assert isinstance(node, list)
+        pc, self._stepname, slots, stack = decode_state(node, len(self.interp.varnames))
+        if self._cas.lazy_restore:
+            slots = LazyList(slots, _unchanged, self._cas)
+            stack = LazyList(stack, _unchanged, self._cas)
+        self.interp.slots = slots
+        self.interp.ops.stack = stack
+        self.interp.ops.pc = pc
 
     def __repr__(self) -> str:
-        return f"{self.name}: {self.interp.state}"
+        return f"{self.name}: {self.interp.locals()}"
+
+
+def _unchanged():
+    # A process is recommitted after every execution anyway
+    pass
@@ -0,0 +1,109 @@
+"""
+Counts and times the instructions bytecode processes execute.
+
+A profiled process is interpreted an instruction at a time, without native
+blocks, so that each instruction's time is its own. The totals are kept per
+function, by the pc of each instruction, and summed up from there by opcode
+and by source line.
+"""
+
+import inspect
+
+from collections import defaultdict
+
+from types import CodeType
+
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .opcodes import DecodedCode
+
+
+class FunctionProfile:
+    """The executions and seconds spent on each instruction of a function"""
+
+    def __init__(self, code: "DecodedCode"):
+        self.code = code
+        self.counts: List[int] = [0] * len(code.instructions)
+        self.times: List[float] = [0.0] * len(code.instructions)
+
+    @property
+    def name(self) -> str:
+        co = self.code.code
+        return f"{co.co_name} ({co.co_filename}:{co.co_firstlineno})"
+
+    def total(self) -> Tuple[int, float]:
+        return sum(self.counts), sum(self.times)
+
+    def by_offset(self) -> List[Tuple[int, str, int, float]]:
+        """(offset, opname, count, seconds) for each instruction, in order"""
+        return [
+            (inst.offset, inst.opname, n, t)
+            for inst, n, t in zip(self.code.instructions, self.counts, self.times)
+        ]
+
+    def by_opcode(self) -> Dict[str, Tuple[int, float]]:
+        return self._sum(inst.opname for inst in self.code.instructions)
+
+    def by_line(self) -> Dict[int, Tuple[int, float]]:
+        return self._sum(self.lines())
+
+    def lines(self) -> List[int]:
+        """The source line of each instruction"""
+        out = []
+        line = self.code.code.co_firstlineno
+        for inst in self.code.instructions:
+            if inst.starts_line is not None:
+                line = inst.starts_line
+            out.append(line)
+        return out
+
+    def _sum(self, keys) -> Dict:
+        out: Dict = defaultdict(lambda: (0, 0.0))
+        for k, n, t in zip(keys, self.counts, self.times):
+            count, secs = out[k]
+            out[k] = (count + n, secs + t)
+        return dict(out)
+
+    def annotate(self) -> str:
+        """The function's source, with the executions and time of each line"""
+        try:
+            source, first = inspect.getsourcelines(self.code.code)
+        except (OSError, TypeError):
+            return "  (source unavailable)"
+        lines = self.by_line()
+        out = [f"  {'count':>9} {'ms':>9}"]
+        for i, text in enumerate(source):
+            n, t = lines.get(first + i, (0, 0.0))
+            stats = f"{n:>9} {t * 1000:>9.3f}" if n else " " * 19
+            out.append(f"  {stats}  {first + i:>4}  {text.rstrip()}")
+        return "\n".join(out)
+
+
+class Profile:
+    """Profiles of every function run by the processes it's given to"""
+
+    def __init__(self):
+        self.functions: Dict[CodeType, FunctionProfile] = {}
+
+    def function(self, code: "DecodedCode") -> FunctionProfile:
+        f = self.functions.get(code.code)
+        if f is None:
+            f = self.functions[code.code] = FunctionProfile(code)
+        return f
+
+    def report(self) -> str:
+        out = []
+        for f in sorted(self.functions.values(), key=lambda f: -f.total()[1]):
+            n, t = f.total()
+            out.append(f"{f.name}: {n} instructions, {t * 1000:.3f} ms")
+            ops = sorted(f.by_opcode().items(), key=lambda kv: -kv[1][1])
+            for opname, (count, secs) in ops:
+                if count:
+                    out.append(f"  {opname:<20} {count:>9} {secs * 1000:>9.3f} ms")
+            out.append(f.annotate())
+            out.append("")
+        return "\n".join(out)
@@ -0,0 +1,57 @@
+"""
+The state of a bytecode process, as a single flat node.
+
+    [pc, step name, assigned, slot 0, ..., slot n - 1, stack...]
+
+Locals are kept in slots ordered as the function's co_varnames, so their
+names are never stored. `assigned` is a bitmap, as little-endian bytes, of
+the slots that hold a value; the others are stored as None, as are those a
+process leaves out of its state. The operand stack is whatever follows the
+slots. What's the same in every state of a process, such as its function's
+name, isn't stored at all.
+"""
+
+from typing import Any
+from typing import List
+from typing import Tuple
+
+
+class _Unset:
+    def __repr__(self) -> str:
+        return "UNSET"
+
+
+# What a local's slot holds until it's assigned
+UNSET = _Unset()
+
+
+def encode_state(
+    pc: int, stepname: str, slots: List, kept: int, stack: List, dead_top: int = 0
+) -> List:
+    """
+    Only the slots set in the kept bitmap are stored; the others come back
+    unset. The top dead_top values of the stack are stored as None.
+    """
+    # Take what lazy lists hold: the Hashes of the subtrees still unread
+    out: List[Any] = [pc, stepname, None]
+    assigned = 0
+    for i, v in enumerate(list.__iter__(slots)):
+        if v is UNSET or not kept >> i & 1:
+            out.append(None)
+        else:
+            assigned |= 1 << i
+            out.append(v)
+    out[2] = assigned.to_bytes((len(slots) + 7) // 8, "little")
+    out.extend(list.__iter__(stack))
+    for i in range(1, min(dead_top, len(stack)) + 1):
+        out[-i] = None
+    return out
+
+
+def decode_state(node: List, n_slots: int) -> Tuple[int, str, List, List]:
+    """The pc, step name, slots and stack of a process with n_slots locals"""
+    assigned = int.from_bytes(node[2], "little")
+    slots = [
+        v if assigned >> i & 1 else UNSET for i, v in enumerate(node[3 : 3 + n_slots])
+    ]
+    return node[0], node[1], slots, node[3 + n_slots :]
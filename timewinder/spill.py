@@ -0,0 +1,205 @@
+"""
+A visited set and a frontier that spill to local disk.
+
+Past a threshold of entries held in memory, the visited set writes its keys
+out as a sorted run file. Each run keeps a Bloom filter and a sparse index of
+every INDEX_EVERY'th key in memory, so that a lookup that misses costs a few
+bit tests, and one that may hit reads a single block of the file. Runs of
+similar size are merged, as in a log-structured merge tree, so there are only
+ever logarithmically many to check.
+
+The frontier is a FIFO that appends the states past its threshold to a file,
+and reads them back in order.
+"""
+
+import heapq
+import mmap
+import msgpack
+import tempfile
+
+from bisect import bisect_right
+
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+
+from .graph import PendingState
+
+
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+INDEX_EVERY = 64
+
+
+class Bloom:
+    def __init__(self, n_keys: int):
+        self._bits = max(64, n_keys * BLOOM_BITS_PER_KEY)
+        self._array = bytearray((self._bits + 7) // 8)
+
+    def _positions(self, key: bytes) -> Iterator[int]:
+        # Keys are already hashes, so two slices of them serve as the two
+        # independent hashes for double hashing.
+        a = int.from_bytes(key[:8], "little")
+        b = int.from_bytes(key[-8:], "little") | 1
+        for i in range(BLOOM_HASHES):
+            yield (a + i * b) % self._bits
+
+    def add(self, key: bytes):
+        for p in self._positions(key):
+            self._array[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self._array[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class SortedRun:
+    """Fixed-width keys, sorted, in a temporary file"""
+
+    def __init__(self, directory: Optional[str], keys: Iterable[bytes], n_keys: int):
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self.bloom = Bloom(n_keys)
+        self.index: List[bytes] = []
+        self.width = 0
+        self.count = 0
+        for k in keys:
+            if self.width == 0:
+                self.width = len(k)
+            if self.count % INDEX_EVERY == 0:
+                self.index.append(k)
+            self._file.write(k)
+            self.bloom.add(k)
+            self.count += 1
+        self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, key: bytes) -> bool:
+        if key not in self.bloom:
+            return False
+        block = bisect_right(self.index, key) - 1
+        if block < 0:
+            return False
+        start = block * INDEX_EVERY
+        end = min(start + INDEX_EVERY, self.count)
+        w = self.width
+        data = self._map[start * w : end * w]
+        lo, hi = 0, end - start
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = data[mid * w : (mid + 1) * w]
+            if k == key:
+                return True
+            if k < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def __iter__(self) -> Iterator[bytes]:
+        w = self.width
+        for i in range(self.count):
+            yield self._map[i * w : (i + 1) * w]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class SpillingSet:
+    """A set of state hashes that moves to sorted runs on disk past a threshold"""
+
+    def __init__(self, directory: Optional[str], threshold: int):
+        self.directory = directory
+        self.threshold = threshold
+        self._mem: Set[bytes] = set()
+        self._runs: List[SortedRun] = []
+
+    def __contains__(self, key: bytes) -> bool:
+        if key in self._mem:
+            return True
+        # Newer runs are the smaller ones
+        for run in reversed(self._runs):
+            if key in run:
+                return True
+        return False
+
+    def add(self, key: bytes):
+        """Adds a key, which the caller has already found not to be in the set"""
+        self._mem.add(key)
+        if len(self._mem) >= self.threshold:
+            self._spill()
+
+    def _spill(self):
+        keys = sorted(self._mem)
+        self._runs.append(SortedRun(self.directory, keys, len(keys)))
+        self._mem.clear()
+        while len(self._runs) > 1 and self._runs[-1].count >= self._runs[-2].count:
+            newer = self._runs.pop()
+            older = self._runs.pop()
+            merged = SortedRun(
+                self.directory, heapq.merge(older, newer), older.count + newer.count
+            )
+            older.close()
+            newer.close()
+            self._runs.append(merged)
+
+    def __len__(self) -> int:
+        return len(self._mem) + sum(r.count for r in self._runs)
+
+    def on_disk(self) -> int:
+        return sum(r.count for r in self._runs)
+
+    def clear(self):
+        for r in self._runs:
+            r.close()
+        self._runs = []
+        self._mem.clear()
+
+
+class SpillingQueue:
+    """A FIFO of PendingStates that appends to a file past a threshold"""
+
+    def __init__(self, directory: Optional[str], threshold: int):
+        self.directory = directory
+        self.threshold = threshold
+        self._mem: List[PendingState] = []
+        self._file: Optional[Any] = None
+        self._packer = msgpack.Packer()
+        self._spilled = 0
+
+    def append(self, p: PendingState):
+        self._mem.append(p)
+        if len(self._mem) >= self.threshold:
+            self._flush()
+
+    def extend(self, ps: Iterable[PendingState]):
+        for p in ps:
+            self.append(p)
+
+    def _flush(self):
+        if self._file is None:
+            self._file = tempfile.NamedTemporaryFile(dir=self.directory)
+        self._file.write(b"".join(self._packer.pack(p.to_row()) for p in self._mem))
+        self._spilled += len(self._mem)
+        self._mem = []
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._mem)
+
+    def __iter__(self) -> Iterator[PendingState]:
+        if self._file is not None:
+            self._file.flush()
+            # A separate handle, so appending and reading don't interfere
+            with open(self._file.name, "rb") as f:
+                for i, row in enumerate(msgpack.Unpacker(f, raw=False)):
+                    if i == self._spilled:
+                        break
+                    yield PendingState.from_row(row)
+        yield from list(self._mem)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -3,4 +3,8 @@ from .tree import TreeableType
 from .controller import StateController
 from .cas import CAS
 from .cas import MemoryCAS
+from .sqlite_cas import SQLiteCAS
+from .log_cas import LogCAS
+from .shared_cas import SharedMemoryCAS
 from .tree import Hash
+from .tree import ThreadRef
@@ -1,20 +1,163 @@
 import copy
+import sys
+import zlib
 
 from abc import ABC
 from abc import abstractmethod
+from collections import OrderedDict
+from collections import deque
+from itertools import islice
 
+from typing import Any
+from typing import Callable
+from typing import Deque
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
 
+from .tree import DEFAULT_HASH
+from .tree import HASH_FUNCTIONS
 from .tree import TreeType
 from .tree import Hash
+from .tree import InternTable
+from .tree import hash_packed_tree
 from .tree import non_flat_keys
+from .tree import pack_node
+from .tree import serialize_flat_tree
+from .tree import unpack_node
+from .tracked import lazy
 
 
 _DEBUG = False
 
 
+class RestoreCache:
+    """
+    The most recently restored nodes, by hash, decoded once and shared by the
+    restores after. Up to roughly `size` bytes of them are kept.
+    """
+
+    def __init__(self, size: int = 32 << 20):
+        self.size = size
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._nodes: "OrderedDict[bytes, Tuple[TreeType, int]]" = OrderedDict()
+
+    def get(self, sha: Hash) -> Optional[TreeType]:
+        entry = self._nodes.get(sha.bytes)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._nodes.move_to_end(sha.bytes)
+        return entry[0]
+
+    def put(self, sha: Hash, node: TreeType):
+        n = _node_size(node)
+        old = self._nodes.pop(sha.bytes, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self._nodes[sha.bytes] = (node, n)
+        self.bytes += n
+        while self.bytes > self.size:
+            _, (_, m) = self._nodes.popitem(last=False)
+            self.bytes -= m
+
+
+def _node_size(node: TreeType) -> int:
+    """Roughly how many bytes a decoded flat node takes"""
+    n = sys.getsizeof(node)
+    if isinstance(node, dict):
+        n += sum(map(sys.getsizeof, node))
+        return n + sum(map(sys.getsizeof, node.values()))
+    return n + sum(map(sys.getsizeof, node))
+
+
+class RefCounts:
+    """
+    How many stored nodes, and pins, refer to each node. Nodes nothing
+    refers to are reclaimed by a sweep, along with whatever only they refer to.
+    """
+
+    def __init__(self):
+        self.counts: Dict[bytes, int] = {}
+        self.unreferenced: Set[bytes] = set()
+        self.reclaimed = 0
+
+    def added(self, key: bytes, node: TreeType):
+        self.counts[key] = 0
+        self.unreferenced.add(key)
+        for child in _children(node):
+            self.incref(child.bytes)
+
+    def incref(self, key: bytes):
+        c = self.counts[key]
+        if c == 0:
+            self.unreferenced.discard(key)
+        self.counts[key] = c + 1
+
+    def decref(self, key: bytes):
+        c = self.counts[key] - 1
+        self.counts[key] = c
+        if c == 0:
+            self.unreferenced.add(key)
+
+    def sweep(self, pop: Callable[[bytes], TreeType]) -> int:
+        """Deletes the unreferenced nodes with pop, returning how many"""
+        n = 0
+        while len(self.unreferenced) != 0:
+            key = self.unreferenced.pop()
+            del self.counts[key]
+            for child in _children(pop(key)):
+                self.decref(child.bytes)
+            n += 1
+        self.reclaimed += n
+        return n
+
+
+def _children(node: TreeType) -> Iterator[Hash]:
+    vals = node if isinstance(node, list) else node.values()
+    return (v for v in vals if isinstance(v, Hash))
+
+
 class CAS(ABC):
+    # Set to share decoded nodes between restores
+    restore_cache: Optional[RestoreCache] = None
+    # What the nodes put in are hashed with, from HASH_FUNCTIONS
+    hash_name: str = DEFAULT_HASH
+    # Set to look up the hashes of small nodes hashed before, which has to
+    # use the same function
+    interner: Optional[InternTable] = None
+    # Whether objects restore their subtrees only as they're read
+    lazy_restore: bool = False
+    # Set to reclaim the nodes that no pinned state reaches
+    refcounts: Optional[RefCounts] = None
+    # Whether the nodes are seen by every process using the store, so that
+    # they needn't be sent between them
+    shared: bool = False
+
+    def hash(self, tree: TreeType) -> Hash:
+        """Hashes a flat node to be put in this CAS"""
+        return self.hash_packed(tree)[0]
+
+    def hash_packed(self, tree: TreeType) -> Tuple[Hash, Optional[bytes]]:
+        """Hashes a flat node, along with the bytes hashed, if it took any"""
+        if self.interner is not None:
+            return self.interner.hash_packed(tree)
+        return hash_packed_tree(tree, HASH_FUNCTIONS[self.hash_name])
+
+    def put_tree(self, tree: TreeType) -> Hash:
+        """Hashes a flat node and puts it in, returning the hash"""
+        h = self.hash(tree)
+        self.put(h, tree)
+        return h
+
     @abstractmethod
     def put(self, sha: Hash, data: TreeType):
         pass
@@ -23,6 +166,10 @@ class CAS(ABC):
     def get(self, sha: Hash) -> TreeType:
         pass
 
+    def get_many(self, shas: Iterable[Hash]) -> List[TreeType]:
+        """Gets several nodes, in one go for stores that can batch them"""
+        return [self.get(h) for h in shas]
+
     @abstractmethod
     def debug_print(self):
         pass
@@ -31,43 +178,220 @@ class CAS(ABC):
     def size(self) -> int:
         pass
 
+    def items(self) -> Iterable[Tuple[bytes, TreeType]]:
+        """Every stored node, in the order they were first put"""
+        raise NotImplementedError(f"{type(self).__name__} can't list its contents")
+
+    def cursor(self) -> int:
+        """
+        Where the nodes put from now on start, for items_since. The cursor 0
+        is the start of the store.
+        """
+        return self.size()
+
+    def items_since(self, cursor: int) -> Iterable[Tuple[bytes, TreeType]]:
+        """The nodes put after the cursor was taken, in the order they were put"""
+        return islice(self.items(), cursor, None)
+
+    def flush(self):
+        """Makes every put so far durable, for stores that buffer them"""
+        pass
+
+    def pin(self, sha: Hash):
+        """Keeps a state's nodes from being collected, until unpinned"""
+        pass
+
+    def unpin(self, sha: Hash):
+        pass
+
+    def collect(self) -> int:
+        """
+        Reclaims the nodes no pinned state reaches, returning how many. Nodes
+        put since the last collection count as unreachable until a pinned
+        state refers to them, so only collect between states.
+        """
+        return 0
+
     def restore(self, sha: Hash) -> TreeType:
+        """
+        The tree stored at sha, for the caller to change as it likes. With a
+        restore cache, it's copied on write: each of its nodes is copied out
+        of the cache only once it's read, and the dicts not read yet are
+        committed again as their hashes.
+        """
+        if self.restore_cache is not None:
+            return lazy(self, sha, _unchanged)
         data = self.get(sha)
-        items: Iterable
-        if isinstance(data, list):
-            items = enumerate(data)
-        elif isinstance(data, dict):
-            items = data.items()
-        else:
-            raise TypeError("Returning a non-TreeType data?")
-        for k, v in items:
-            if isinstance(v, Hash):
-                data[k] = self.restore(v)
+        # A layer at a time, so that stores can fetch each in one go
+        layer = [data]
+        while len(layer) != 0:
+            refs: List[Tuple[Any, Any]] = []
+            for node in layer:
+                items: Iterable
+                if isinstance(node, list):
+                    items = enumerate(node)
+                elif isinstance(node, dict):
+                    items = node.items()
+                else:
+                    raise TypeError("Returning a non-TreeType data?")
+                refs.extend((node, k) for k, v in items if isinstance(v, Hash))
+            layer = self.get_many([node[k] for node, k in refs])
+            for (node, k), child in zip(refs, layer):
+                node[k] = child
         return data
 
+    def get_shared(self, sha: Hash) -> TreeType:
+        """
+        Gets a node that may be shared with other callers, through the restore
+        cache. It mustn't be changed; copy it to change it.
+        """
+        cache = self.restore_cache
+        if cache is None:
+            return self.get(sha)
+        node = cache.get(sha)
+        if node is None:
+            node = self.get(sha)
+            cache.put(sha, node)
+        return node
+
+    def get_many_shared(self, shas: List[Hash]) -> List[TreeType]:
+        """Gets several nodes as get_shared does, fetching the uncached together"""
+        cache = self.restore_cache
+        if cache is None:
+            return self.get_many(shas)
+        cached = [cache.get(h) for h in shas]
+        fetched = iter(self.get_many([h for h, n in zip(shas, cached) if n is None]))
+        nodes = []
+        for h, node in zip(shas, cached):
+            if node is None:
+                node = next(fetched)
+                cache.put(h, node)
+            nodes.append(node)
+        return nodes
+
+
+def _unchanged():
+    # Nothing keeps a clean hash for trees restored whole
+    pass
+
+
+# The first byte of a zlib stream, as we write them. Packed nodes are msgpack
+# maps or arrays, which never start with it.
+_ZLIB_HEADER = 0x78
+
 
 class MemoryCAS(CAS):
-    def __init__(self):
-        self.store: Dict[bytes, TreeType] = {}
+    """
+    Nodes kept in a dict. With `packed`, they're kept as their msgpack bytes
+    rather than as Python objects, which take several times the space, and
+    decoded again when got; with `compress_after` as well, all but that many
+    of the most recently put nodes are compressed with zlib.
+    """
+
+    def __init__(self, packed: bool = False, compress_after: Optional[int] = None):
+        if compress_after is not None and not packed:
+            raise ValueError("Only packed nodes can be compressed")
+        self.packed = packed
+        self.compress_after = compress_after
+        # Nodes, or their packed bytes
+        self.store: Dict[bytes, Any] = {}
+        # The most recently put nodes, which stay uncompressed
+        self._hot: Deque[bytes] = deque()
+        # The order the nodes were put in, once a cursor has been taken
+        self._order: Optional[List[bytes]] = None
 
     def put(self, sha: Hash, data: TreeType):
         if _DEBUG:
             assert len(non_flat_keys(data)) == 0
         if sha.bytes in self.store:
             return
-        self.store[sha.bytes] = copy.copy(data)
+        if self.packed:
+            self._put_packed(sha.bytes, pack_node(data))
+        else:
+            self.store[sha.bytes] = copy.copy(data)
+            if self._order is not None:
+                self._order.append(sha.bytes)
+        if self.refcounts is not None:
+            self.refcounts.added(sha.bytes, data)
+
+    def put_tree(self, tree: TreeType) -> Hash:
+        if not self.packed:
+            return super().put_tree(tree)
+        # Store the very bytes that were hashed
+        h, m = self.hash_packed(tree)
+        if h.bytes not in self.store:
+            if m is None:
+                m = serialize_flat_tree(tree)
+            self._put_packed(h.bytes, m)
+            if self.refcounts is not None:
+                self.refcounts.added(h.bytes, tree)
+        return h
+
+    def _put_packed(self, k: bytes, m: bytes):
+        self.store[k] = m
+        if self._order is not None:
+            self._order.append(k)
+        if self.compress_after is None:
+            return
+        self._hot.append(k)
+        if len(self._hot) > self.compress_after:
+            cold = self._hot.popleft()
+            # Unless it's been collected since
+            packed = self.store.get(cold)
+            if packed is not None:
+                z = zlib.compress(packed, 1)
+                if len(z) < len(packed):
+                    self.store[cold] = z
 
     def get(self, sha: Hash) -> TreeType:
-        return copy.copy(self.store[sha.bytes])
+        return self._decode(self.store[sha.bytes])
+
+    def _decode(self, data: Union[TreeType, bytes]) -> TreeType:
+        if not isinstance(data, bytes):
+            return copy.copy(data)
+        if data[0] == _ZLIB_HEADER:
+            data = zlib.decompress(data)
+        return unpack_node(data)
+
+    def _pop(self, k: bytes) -> TreeType:
+        return self._decode(self.store.pop(k))
+
+    def pin(self, sha: Hash):
+        if self.refcounts is not None:
+            self.refcounts.incref(sha.bytes)
+
+    def unpin(self, sha: Hash):
+        if self.refcounts is not None:
+            self.refcounts.decref(sha.bytes)
+
+    def collect(self) -> int:
+        if self.refcounts is None:
+            return 0
+        return self.refcounts.sweep(self._pop)
 
     def debug_print(self):
         import pprint
 
-        for k, v in self.store.items():
+        for k, v in self.items():
             print("")
             print(f"{k.hex()}")
             print("=" * 10)
             pprint.pprint(v)
 
+    def items(self) -> Iterable[Tuple[bytes, TreeType]]:
+        if not self.packed:
+            return self.store.items()
+        return ((k, self._decode(v)) for k, v in self.store.items())
+
+    def cursor(self) -> int:
+        if self._order is None:
+            self._order = list(self.store)
+        return len(self._order)
+
+    def items_since(self, cursor: int) -> Iterable[Tuple[bytes, TreeType]]:
+        if self._order is None:
+            return super().items_since(cursor)
+        return ((k, self._decode(self.store[k])) for k in self._order[cursor:])
+
     def size(self) -> int:
         return len(self.store)
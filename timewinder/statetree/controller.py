@@ -1,15 +1,22 @@
-import itertools
 import copy
+import random
+
+from functools import partial
 
 from .cas import CAS
 from .tree import non_flat_keys
 from .tree import Hash
-from .tree import hash_flat_tree
+from .symmetry import Symmetry
 from timewinder.generators import NonDeterministicSet
 
+from typing import Callable
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 from typing import Union
 from typing import TYPE_CHECKING
 
@@ -22,6 +29,18 @@ class StateController:
         self.cas = cas
         self.tree: Dict[str, "Object"] = {}
         self.checkouts: List[str] = []
+        self.symmetry: Optional[Symmetry] = None
+        # Names of the objects accessed, while tracked
+        self.accessed: Optional[Set[str]] = None
+        # How many values of each nondeterministic set to explore, and the
+        # generator to sample them with; see flatten_to_cas
+        self.max_choices: Optional[int] = None
+        self.rng: Optional[random.Random] = None
+
+    def track_accesses(self):
+        self.accessed = set()
+        for m in self.tree.values():
+            m.register_access_log(self.accessed)
 
     def get_object_list(self) -> Iterable["Object"]:
         return self.tree.values()
@@ -31,8 +50,21 @@ class StateController:
         self.tree[at] = obj
 
     def commit(self) -> Iterable[Hash]:
+        return [h for h, _ in self.commit_renumbered()]
+
+    def commit_renumbered(self) -> Iterator[Tuple[Hash, Dict[int, int]]]:
+        """
+        Commits the current state, yielding each resulting state hash along
+        with the threads renumbered to reach its canonical form under symmetry.
+        The hashes are generated as they're taken, so the state mustn't be
+        changed until they all have been.
+        """
         to_commit = {k: m.get_state() for k, m in self.tree.items()}
-        return flatten_to_cas(to_commit, self.cas)
+        for h in flatten_to_cas(to_commit, self.cas, self.max_choices, self.rng):
+            if self.symmetry is None:
+                yield h, {}
+            else:
+                yield self.symmetry.canonical(self.cas, h)
 
     def restore(self, state_hash: Hash):
         top_restored = self.cas.get(state_hash)
@@ -47,39 +79,90 @@ class StateController:
         return out
 
 
-def flatten_to_cas(tree: Union[dict, list], cas: CAS) -> Iterable[Hash]:
+def flatten_to_cas(
+    tree: Union[dict, list],
+    cas: CAS,
+    max_choices: Optional[int] = None,
+    rng: Optional[random.Random] = None,
+) -> Iterator[Hash]:
+    """
+    Stores a tree, yielding the hash of every state it stands for as it goes.
+
+    Every nondeterministic key is streamed, so no huge set ever sits in
+    memory: the choices for each key are gone through again for every
+    combination of the keys before it, and only kept once they've turned out
+    to be few. The tree mustn't change until every hash has been taken. Each
+    set is cut to `max_choices` values, or to a random sample of that many
+    given an `rng`.
+    """
+    # Take what tracked containers hold, rather than what they show: lazy
+    # ones hold the Hashes of the subtrees still unread.
+    if isinstance(tree, dict) and type(tree) is not dict:
+        tree = dict(dict.items(tree))
+    elif isinstance(tree, list) and type(tree) is not list:
+        tree = list(list.__iter__(tree))
     non_flats = non_flat_keys(tree)
 
     # Base case; store and return hash
     if len(non_flats) == 0:
-        h = hash_flat_tree(tree)
-        cas.put(h, tree)
-        return [h]
-
-    generators: List[Iterable] = []
+        yield cas.put_tree(tree)
+        return
 
-    # Create the list of generators to pair with the keys
-    # they came from
-    for key in non_flats:
+    def choices(key) -> Iterator:
         val = tree[key]
         if isinstance(val, dict) or isinstance(val, list):
-            generators.append(flatten_to_cas(val, cas))
+            return flatten_to_cas(val, cas, max_choices, rng)
         elif isinstance(val, NonDeterministicSet):
-            generators.append(val.to_generator())
+            return val.choices(max_choices, rng)
         else:
             raise TypeError("Unexpected type while flattening to CAS")
 
+    options: List[Iterable] = [choices(non_flats[0])]
+    for key in non_flats[1:]:
+        options.append(_Replayable(partial(choices, key), rng is not None))
+
     # Shallow copy this layer, so we can edit it.
     tree_copy = copy.copy(tree)
-    out: List[Hash] = []
+
     # Generate the full outer join of the possible values for each key
-    for state in itertools.product(*generators):
-        # Fill in each key
-        for k, v in zip(non_flats, state):
-            tree_copy[k] = v
-        # Now, if all the resulting keys are flat, the recursive call
-        # hits the base case. If any trees were generated, the recursive
-        # call will progress with the newly-flat values filled in and
-        # will generate the others.
-        out.extend(flatten_to_cas(tree_copy, cas))
-    return out
+    def fill(i: int) -> Iterator[Hash]:
+        if i == len(non_flats):
+            # Sets may choose between trees, which need flattening in turn
+            yield from flatten_to_cas(tree_copy, cas, max_choices, rng)
+            return
+        for choice in options[i]:
+            tree_copy[non_flats[i]] = choice
+            yield from fill(i + 1)
+
+    yield from fill(0)
+
+
+# How many choices for a key are kept, rather than worked out again
+_KEEP = 1 << 10
+
+
+class _Replayable:
+    """
+    The choices for a key, which can be gone through any number of times.
+    Those sampled at random are kept, so that each pass sees the same sample.
+    """
+
+    def __init__(self, make: Callable[[], Iterator], keep: bool):
+        self.make = make
+        self.kept: Optional[List] = list(make()) if keep else None
+
+    def __iter__(self) -> Iterator:
+        if self.kept is not None:
+            return iter(self.kept)
+        return self._first_pass()
+
+    def _first_pass(self) -> Iterator:
+        kept: Optional[List] = []
+        for v in self.make():
+            if kept is not None:
+                kept.append(v)
+                if len(kept) > _KEEP:
+                    kept = None
+            yield v
+        if kept is not None:
+            self.kept = kept
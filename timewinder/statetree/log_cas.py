@@ -0,0 +1,235 @@
+"""
+A CAS kept in a single append-only log file.
+
+Each node is appended as a record of its hash and its msgpack encoding, and
+read back by decoding straight out of a memory map of the log. The only
+thing held in memory per node is an entry in an open-addressing table from a
+64-bit fingerprint of its hash to its offset, which costs a few dozen bytes
+rather than a live dict.
+
+The log is its own source of truth: the index is rebuilt by scanning it when
+it is opened, and a record cut short by the process dying is dropped from the
+end, as its header is written after its body. That ordering only holds in
+memory, though: the OS writes the map's pages back to disk in whatever order
+it likes, so if the machine itself goes down, a header can reach the disk
+without its body. With `durable`, each body is flushed to disk before its
+header is written, and the header after it, at the cost of two syncs a put;
+otherwise only flush() makes what's been put so far durable.
+
+Other processes can open the same log read-only, and pick up what has been
+appended since with refresh().
+"""
+
+import mmap
+import os
+import struct
+
+from array import array
+
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+from timewinder.visited import fingerprint
+
+from .cas import CAS
+from .tree import Hash
+from .tree import TreeType
+from .tree import pack_node
+from .tree import unpack_node
+
+
+# Hash length, then encoded node length. A zero hash length ends the log;
+# the file past the last record is zeroes, reserved for the next ones.
+_HEADER = struct.Struct("<BI")
+_GROW_BY = 1 << 24
+_MAX_LOAD = 0.75
+
+
+class _OffsetIndex:
+    """Offsets into the log, by hash fingerprint"""
+
+    def __init__(self, capacity: int = 1 << 16):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._reset(size)
+
+    def _reset(self, size: int):
+        self._fps = array("Q", bytes(8 * size))
+        self._offsets = array("Q", bytes(8 * size))
+        self._mask = size - 1
+        self._len = 0
+        self._limit = int(size * _MAX_LOAD)
+
+    def candidates(self, key: bytes) -> Iterator[int]:
+        """Offsets of the records whose hash shares a fingerprint with key"""
+        fp = fingerprint(key)
+        fps = self._fps
+        mask = self._mask
+        i = fp & mask
+        while fps[i] != 0:
+            if fps[i] == fp:
+                yield self._offsets[i]
+            i = (i + 1) & mask
+
+    def add(self, key: bytes, offset: int):
+        self._insert(fingerprint(key), offset)
+        self._len += 1
+        if self._len > self._limit:
+            fps, offsets = self._fps, self._offsets
+            self._reset(2 * len(fps))
+            for fp, off in zip(fps, offsets):
+                if fp != 0:
+                    self._insert(fp, off)
+                    self._len += 1
+
+    def _insert(self, fp: int, offset: int):
+        i = fp & self._mask
+        while self._fps[i] != 0:
+            i = (i + 1) & self._mask
+        self._fps[i] = fp
+        self._offsets[i] = offset
+
+    def __len__(self) -> int:
+        return self._len
+
+
+class LogCAS(CAS):
+    def __init__(self, path: str, readonly: bool = False, durable: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self.durable = durable
+        flags = os.O_RDONLY if readonly else os.O_RDWR | os.O_CREAT
+        self._fd = os.open(path, flags, 0o644)
+        self._map: Optional[mmap.mmap] = None
+        self._mapped = 0
+        # Where the next record goes
+        self._end = 0
+        self._index = _OffsetIndex()
+        self.refresh()
+        if not readonly:
+            # Drop anything past the last whole record
+            os.ftruncate(self._fd, self._end)
+            self._remap(self._end)
+
+    def _remap(self, size: int):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._mapped = size
+        if size != 0:
+            access = mmap.ACCESS_READ if self.readonly else mmap.ACCESS_WRITE
+            self._map = mmap.mmap(self._fd, size, access=access)
+
+    def refresh(self):
+        """Indexes the records appended since the log was last scanned"""
+        size = os.fstat(self._fd).st_size
+        if size > self._mapped:
+            self._remap(size)
+        m = self._map
+        pos = self._end
+        while m is not None and pos + _HEADER.size <= self._mapped:
+            klen, dlen = _HEADER.unpack_from(m, pos)
+            start = pos + _HEADER.size
+            if klen == 0 or start + klen + dlen > self._mapped:
+                break
+            self._index.add(m[start : start + klen], pos)
+            pos = start + klen + dlen
+        self._end = pos
+
+    def _find(self, key: bytes) -> Optional[int]:
+        assert self._map is not None
+        for pos in self._index.candidates(key):
+            start = pos + _HEADER.size
+            if self._map[start : start + len(key)] == key:
+                return pos
+        return None
+
+    def put(self, sha: Hash, data: TreeType):
+        if self.readonly:
+            raise TypeError(f"{self.path} was opened read-only")
+        k = sha.bytes
+        if self._map is not None and self._find(k) is not None:
+            return
+        body = k + pack_node(data)
+        end = self._end + _HEADER.size + len(body)
+        if end > self._mapped:
+            size = max(end, self._mapped + max(self._mapped, _GROW_BY))
+            os.ftruncate(self._fd, size)
+            self._remap(size)
+        assert self._map is not None
+        start = self._end + _HEADER.size
+        self._map[start:end] = body
+        if self.durable:
+            self._sync(start, end)
+        # The header goes last, so that a torn write ends the log before it
+        _HEADER.pack_into(self._map, self._end, len(k), len(body) - len(k))
+        if self.durable:
+            self._sync(self._end, start)
+        self._index.add(k, self._end)
+        self._end = end
+
+    def _sync(self, start: int, end: int):
+        """Flushes the pages of the map holding [start, end) to disk"""
+        assert self._map is not None
+        first = start - start % mmap.ALLOCATIONGRANULARITY
+        self._map.flush(first, end - first)
+
+    def get(self, sha: Hash) -> TreeType:
+        k = sha.bytes
+        pos = self._find(k) if self._map is not None else None
+        if pos is None and self.readonly:
+            self.refresh()
+            pos = self._find(k) if self._map is not None else None
+        if pos is None:
+            raise KeyError(k)
+        return self._decode(pos)[1]
+
+    def _decode(self, pos: int) -> Tuple[bytes, TreeType, int]:
+        """The hash and node recorded at pos, and where the next record starts"""
+        assert self._map is not None
+        klen, dlen = _HEADER.unpack_from(self._map, pos)
+        start = pos + _HEADER.size
+        key = self._map[start : start + klen]
+        # Decoded in place, without copying the record out first
+        view = memoryview(self._map)[start + klen : start + klen + dlen]
+        try:
+            return key, unpack_node(view), start + klen + dlen
+        finally:
+            view.release()
+
+    def flush(self):
+        if self._map is not None and not self.readonly:
+            self._map.flush()
+
+    def close(self):
+        self.flush()
+        self._remap(0)
+        if not self.readonly:
+            os.ftruncate(self._fd, self._end)
+        os.close(self._fd)
+
+    def debug_print(self):
+        import pprint
+
+        for k, v in self.items():
+            print("")
+            print(f"{k.hex()}")
+            print("=" * 10)
+            pprint.pprint(v)
+
+    def items(self) -> Iterator[Tuple[bytes, TreeType]]:
+        return self.items_since(0)
+
+    def cursor(self) -> int:
+        return self._end
+
+    def items_since(self, cursor: int) -> Iterator[Tuple[bytes, TreeType]]:
+        pos = cursor
+        while pos < self._end:
+            k, node, pos = self._decode(pos)
+            yield k, node
+
+    def size(self) -> int:
+        return len(self._index)
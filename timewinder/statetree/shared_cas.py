@@ -0,0 +1,212 @@
+"""
+A CAS in shared memory, for the processes of one host to use together.
+
+A single `multiprocessing.shared_memory` block holds an open-addressing table
+from a 64-bit fingerprint of each hash to the offset of its record, and an
+arena the records are appended to: the hash and the msgpack-encoded node,
+as in a LogCAS. Every process attached to it puts to and gets from the same
+deduplicated store, so memory grows with the distinct nodes, not with the
+number of processes.
+
+Reads take no locks. A put appends its record under a lock on the arena's end,
+then claims a table slot under a lock on the stripe of slots it falls in,
+writing the offset before the fingerprint that publishes it. The block is
+sized up front; it doesn't grow.
+"""
+
+import multiprocessing
+import struct
+
+from multiprocessing.shared_memory import SharedMemory
+
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+from timewinder.visited import fingerprint
+
+from .cas import CAS
+from .tree import Hash
+from .tree import TreeType
+from .tree import pack_node
+from .tree import serialize_flat_tree
+from .tree import unpack_node
+
+
+# Hash length, then encoded node length
+_RECORD = struct.Struct("<BI")
+_MAX_LOAD = 0.9
+
+
+class SharedMemoryCAS(CAS):
+    shared = True
+
+    def __init__(
+        self, arena_size: int = 1 << 28, slots: int = 1 << 20, stripes: int = 64
+    ):
+        size = 1
+        while size < slots:
+            size <<= 1
+        self.arena_size = arena_size
+        self.slots = size
+        self.stripes = stripes
+        self._owner = True
+        self._shm = SharedMemory(create=True, size=self._layout())
+        # Locks made for spawning, which can also be inherited by forking
+        ctx = multiprocessing.get_context("spawn")
+        self._arena_lock = ctx.Lock()
+        self._locks = [ctx.Lock() for _ in range(stripes)]
+        self._attach()
+
+    def _layout(self) -> int:
+        # The arena's end, then a count of nodes per stripe, the table as
+        # (fingerprint, offset) pairs, and the arena.
+        self._table_at = 8 * (1 + self.stripes)
+        self._arena_at = self._table_at + 16 * self.slots
+        return self._arena_at + self.arena_size
+
+    def _attach(self):
+        buf = self._shm.buf
+        self._head = buf[: self._table_at].cast("Q")
+        self._table = buf[self._table_at : self._arena_at].cast("Q")
+        self._arena = buf[self._arena_at :]
+        self._mask = self.slots - 1
+
+    def __getstate__(self):
+        # Only picklable while starting a process, for the locks' sake. The
+        # process shares our resource tracker, so it won't remove the block
+        # when it exits.
+        return (
+            self._shm.name,
+            self.arena_size,
+            self.slots,
+            self.stripes,
+            self._arena_lock,
+            self._locks,
+        )
+
+    def __setstate__(self, state):
+        name, self.arena_size, self.slots, self.stripes, lock, locks = state
+        self._arena_lock = lock
+        self._locks = locks
+        self._owner = False
+        self._shm = SharedMemory(name=name)
+        self._layout()
+        self._attach()
+
+    def _find(self, key: bytes) -> Optional[int]:
+        fp = fingerprint(key)
+        table = self._table
+        i = fp & self._mask
+        while True:
+            slot_fp = table[2 * i]
+            if slot_fp == 0:
+                return None
+            if slot_fp == fp and self._key_at(table[2 * i + 1]) == key:
+                return table[2 * i + 1]
+            i = (i + 1) & self._mask
+
+    def _key_at(self, pos: int) -> bytes:
+        klen, _ = _RECORD.unpack_from(self._arena, pos)
+        start = pos + _RECORD.size
+        return bytes(self._arena[start : start + klen])
+
+    def put(self, sha: Hash, data: TreeType):
+        if self._find(sha.bytes) is None:
+            self._insert(sha.bytes, pack_node(data))
+
+    def put_tree(self, tree: TreeType) -> Hash:
+        h, m = self.hash_packed(tree)
+        if self._find(h.bytes) is None:
+            if m is None:
+                m = serialize_flat_tree(tree)
+            self._insert(h.bytes, m)
+        return h
+
+    def _insert(self, key: bytes, packed: bytes):
+        pos = self._append(key, packed)
+        fp = fingerprint(key)
+        table = self._table
+        i = fp & self._mask
+        while True:
+            if table[2 * i] == 0:
+                stripe = i % self.stripes
+                with self._locks[stripe]:
+                    # Claimed since we looked?
+                    if table[2 * i] == 0:
+                        table[2 * i + 1] = pos
+                        table[2 * i] = fp
+                        self._head[1 + stripe] += 1
+                        return
+            if table[2 * i] == fp and self._key_at(table[2 * i + 1]) == key:
+                # Another process put the same node first; its record wins
+                return
+            i = (i + 1) & self._mask
+
+    def _append(self, key: bytes, packed: bytes) -> int:
+        n = _RECORD.size + len(key) + len(packed)
+        with self._arena_lock:
+            pos = self._head[0]
+            if pos + n > self.arena_size:
+                raise MemoryError("The SharedMemoryCAS arena is full")
+            if self.size() >= _MAX_LOAD * self.slots:
+                raise MemoryError("The SharedMemoryCAS table is full")
+            self._head[0] = pos + n
+        _RECORD.pack_into(self._arena, pos, len(key), len(packed))
+        start = pos + _RECORD.size
+        self._arena[start : start + len(key)] = key
+        self._arena[start + len(key) : pos + n] = packed
+        return pos
+
+    def get(self, sha: Hash) -> TreeType:
+        pos = self._find(sha.bytes)
+        if pos is None:
+            raise KeyError(sha.bytes)
+        return self._decode(pos)[1]
+
+    def _decode(self, pos: int) -> Tuple[bytes, TreeType, int]:
+        """The hash and node recorded at pos, and where the next record starts"""
+        klen, dlen = _RECORD.unpack_from(self._arena, pos)
+        start = pos + _RECORD.size
+        key = bytes(self._arena[start : start + klen])
+        view = self._arena[start + klen : start + klen + dlen]
+        try:
+            return key, unpack_node(view), start + klen + dlen
+        finally:
+            view.release()
+
+    def items(self) -> Iterator[Tuple[bytes, TreeType]]:
+        return self.items_since(0)
+
+    def cursor(self) -> int:
+        return self._head[0]
+
+    def items_since(self, cursor: int) -> Iterator[Tuple[bytes, TreeType]]:
+        pos = cursor
+        end = self._head[0]
+        while pos < end:
+            k, node, next_pos = self._decode(pos)
+            # Records that lost a race to put the same node aren't indexed
+            if self._find(k) == pos:
+                yield k, node
+            pos = next_pos
+
+    def size(self) -> int:
+        return sum(self._head[1:])
+
+    def debug_print(self):
+        import pprint
+
+        for k, v in self.items():
+            print("")
+            print(f"{k.hex()}")
+            print("=" * 10)
+            pprint.pprint(v)
+
+    def close(self):
+        """Detaches this process, removing the block if it created it"""
+        for v in (self._head, self._table, self._arena):
+            v.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
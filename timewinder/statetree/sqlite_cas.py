@@ -0,0 +1,151 @@
+"""
+A CAS kept in an SQLite database.
+
+Nodes are stored msgpack-encoded, keyed by hash, so the store is bounded by
+disk rather than RAM, and outlives the run: reopening the same file gives
+back every node. Puts are buffered and written in batches, one transaction
+each, and the most recently used nodes are kept decoded in an LRU cache in
+front of the database. The database is in WAL mode, so that other processes
+can read it while a run writes.
+"""
+
+import copy
+import sqlite3
+
+from collections import OrderedDict
+
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+from .cas import CAS
+from .tree import Hash
+from .tree import TreeType
+from .tree import pack_node
+from .tree import unpack_node
+
+
+class SQLiteCAS(CAS):
+    def __init__(self, path: str, cache_size: int = 1 << 16, batch_size: int = 4096):
+        self.path = path
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # A crash may lose the last transactions, but not corrupt the store;
+        # the nodes are only ever rederivable caches of a run anyway.
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            "id INTEGER PRIMARY KEY, hash BLOB UNIQUE NOT NULL, data BLOB NOT NULL)"
+        )
+        self._db.commit()
+        (self._stored,) = self._db.execute("SELECT COUNT(*) FROM nodes").fetchone()
+        self._cache: "OrderedDict[bytes, TreeType]" = OrderedDict()
+        # Put, but not yet written out
+        self._pending: Dict[bytes, bytes] = {}
+
+    def put(self, sha: Hash, data: TreeType):
+        k = sha.bytes
+        if k in self._cache or k in self._pending:
+            return
+        # Stored before, and since dropped from the cache
+        if self._stored != 0 and self._written(k):
+            return
+        self._pending[k] = pack_node(data)
+        self._remember(k, copy.copy(data))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def get(self, sha: Hash) -> TreeType:
+        return copy.copy(self._get(sha.bytes))
+
+    def get_many(self, shas: Iterable[Hash]) -> List[TreeType]:
+        keys = [h.bytes for h in shas]
+        missing = [k for k in keys if k not in self._cache and k not in self._pending]
+        # Whatever the cache can't hold on to
+        fetched: Dict[bytes, TreeType] = {}
+        # Stay under SQLite's limit on bound parameters
+        for i in range(0, len(missing), 500):
+            chunk = missing[i : i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self._db.execute(
+                f"SELECT hash, data FROM nodes WHERE hash IN ({marks})", chunk
+            )
+            for k, data in rows:
+                fetched[k] = node = unpack_node(data)
+                self._remember(k, node)
+        return [copy.copy(fetched[k] if k in fetched else self._get(k)) for k in keys]
+
+    def _get(self, k: bytes) -> TreeType:
+        node = self._cache.get(k)
+        if node is not None:
+            self._cache.move_to_end(k)
+            return node
+        if k in self._pending:
+            node = unpack_node(self._pending[k])
+        else:
+            row = self._db.execute(
+                "SELECT data FROM nodes WHERE hash = ?", (k,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(k)
+            node = unpack_node(row[0])
+        self._remember(k, node)
+        return node
+
+    def _written(self, k: bytes) -> bool:
+        row = self._db.execute("SELECT 1 FROM nodes WHERE hash = ?", (k,)).fetchone()
+        return row is not None
+
+    def _remember(self, k: bytes, node: TreeType):
+        self._cache[k] = node
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def flush(self):
+        """Writes out the buffered puts"""
+        if len(self._pending) == 0:
+            return
+        cur = self._db.executemany(
+            "INSERT OR IGNORE INTO nodes (hash, data) VALUES (?, ?)",
+            self._pending.items(),
+        )
+        self._db.commit()
+        self._stored += cur.rowcount
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def debug_print(self):
+        import pprint
+
+        for k, v in self.items():
+            print("")
+            print(f"{k.hex()}")
+            print("=" * 10)
+            pprint.pprint(v)
+
+    def items(self) -> Iterator[Tuple[bytes, TreeType]]:
+        return self.items_since(0)
+
+    def cursor(self) -> int:
+        self.flush()
+        (last,) = self._db.execute("SELECT MAX(id) FROM nodes").fetchone()
+        return last or 0
+
+    def items_since(self, cursor: int) -> Iterator[Tuple[bytes, TreeType]]:
+        self.flush()
+        rows = self._db.execute(
+            "SELECT hash, data FROM nodes WHERE id > ? ORDER BY id", (cursor,)
+        )
+        for k, data in rows:
+            yield k, unpack_node(data)
+
+    def size(self) -> int:
+        self.flush()
+        return self._stored
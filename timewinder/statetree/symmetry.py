@@ -0,0 +1,137 @@
+"""
+Symmetry reduction.
+
+A symmetry group is a list of interchangeable members. Each member is a tuple
+of mount names -- typically a thread, plus any objects that belong to it --
+and every member of a group has the same shape. Permuting the members of a
+group, and renumbering the ThreadRefs that point at the threads among them,
+gives an equivalent state.
+
+Each committed state is replaced by a canonical representative of its
+equivalence class: the members of every group are sorted by their sub-hashes,
+taken with thread references blanked out so that the renumbering doesn't
+affect the order. Only representatives are ever explored, which is sound as
+long as the declared groups really are symmetric, including for the specs.
+"""
+
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+from .cas import CAS
+from .tree import Hash
+from .tree import ThreadRef
+from .tree import TreeType
+
+
+# Stands in for every thread reference when ordering members
+_BLANK = ThreadRef(-1)
+
+Member = Tuple[str, ...]
+
+
+class Symmetry:
+    def __init__(self, groups: Sequence[Sequence[Member]], threads: Dict[str, int]):
+        """
+        `threads` maps the mount name of every thread to its index, which is
+        what its ThreadRefs hold.
+        """
+        seen = set()
+        for group in groups:
+            if len(group) == 0:
+                continue
+            shape = [m in threads for m in group[0]]
+            for member in group:
+                if [m in threads for m in member] != shape:
+                    raise ValueError(f"Symmetric members differ in shape: {member}")
+                for m in member:
+                    if m in seen:
+                        raise ValueError(f"{m} appears in more than one symmetry")
+                    seen.add(m)
+        # A member alone is only symmetric to itself
+        self.groups = [list(g) for g in groups if len(g) >= 2]
+        self.threads = threads
+        # Both only depend on the (immutable) node behind a hash
+        self._blanked: Dict[bytes, Hash] = {}
+        self._has_refs: Dict[bytes, bool] = {}
+
+    def canonical(self, cas: CAS, h: Hash) -> Tuple[Hash, Dict[int, int]]:
+        """
+        Returns the representative of the state h, and how its threads were
+        renumbered to get there, as {old index: new index} for those that
+        moved.
+        """
+        top = cas.get(h)
+        assert isinstance(top, dict), "StateController only saves dicts"
+        moves: Dict[str, str] = {}
+        renumber: Dict[int, int] = {}
+        for group in self.groups:
+            keys = [tuple(self._blank(cas, top[m]) for m in member) for member in group]
+            order = sorted(range(len(group)), key=lambda i: (keys[i], i))
+            for new, old in enumerate(order):
+                if new == old:
+                    continue
+                for dst, src in zip(group[new], group[old]):
+                    moves[dst] = src
+                    if src in self.threads:
+                        renumber[self.threads[src]] = self.threads[dst]
+        if len(moves) == 0:
+            return h, renumber
+
+        out = {}
+        for name in top:
+            v = top[moves.get(name, name)]
+            out[name] = self._renumber(cas, v, renumber)
+        return cas.put_tree(out), renumber
+
+    def _refs_in(self, cas: CAS, h: Hash) -> bool:
+        if h.bytes not in self._has_refs:
+            node = cas.get(h)
+            self._has_refs[h.bytes] = any(
+                isinstance(v, ThreadRef)
+                or (isinstance(v, Hash) and self._refs_in(cas, v))
+                for v in _keys_and_values(node)
+            )
+        return self._has_refs[h.bytes]
+
+    def _blank(self, cas: CAS, v) -> bytes:
+        if isinstance(v, ThreadRef):
+            return b""
+        if not isinstance(v, Hash):
+            return cas.hash([v]).bytes
+        if not self._refs_in(cas, v):
+            return v.bytes
+        if v.bytes not in self._blanked:
+            node = _map_node(cas.get(v), lambda x: self._blank_value(cas, x))
+            self._blanked[v.bytes] = cas.hash(node)
+        return self._blanked[v.bytes].bytes
+
+    def _blank_value(self, cas: CAS, v):
+        if isinstance(v, ThreadRef):
+            return _BLANK
+        if isinstance(v, Hash) and self._refs_in(cas, v):
+            return Hash(self._blank(cas, v))
+        return v
+
+    def _renumber(self, cas: CAS, v, renumber: Dict[int, int]):
+        if isinstance(v, ThreadRef):
+            return ThreadRef(renumber.get(v, v))
+        if not isinstance(v, Hash) or len(renumber) == 0:
+            return v
+        if not self._refs_in(cas, v):
+            return v
+        node = _map_node(cas.get(v), lambda x: self._renumber(cas, x, renumber))
+        return cas.put_tree(node)
+
+
+def _keys_and_values(node: TreeType) -> List:
+    if isinstance(node, dict):
+        return list(node.keys()) + list(node.values())
+    return list(node)
+
+
+def _map_node(node: TreeType, f) -> TreeType:
+    if isinstance(node, dict):
+        return {f(k): f(v) for k, v in node.items()}
+    return [f(v) for v in node]
@@ -0,0 +1,237 @@
+"""
+Containers that report their own mutation.
+
+Objects restored from the CAS hold their lists and dicts as these, so that
+they know whether they've changed since, and can hand back the hash they were
+restored from at commit time instead of being flattened again.
+
+Restored lazily, dicts are LazyDicts, which leave their subtrees in the CAS
+until read. Lists are restored whole, with their items restored lazily in
+turn: a plain list concatenated with a list subclass, as in `[x] + lst`,
+copies its storage directly, so a lazy list handed to the model could leak
+its unread Hashes into the model's values.
+"""
+
+from typing import Callable
+from typing import TYPE_CHECKING
+
+from .tree import Hash
+
+if TYPE_CHECKING:
+    from .cas import CAS
+
+
+def _notifying(base: type, name: str):
+    method = getattr(base, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._on_change()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+class TrackedList(list):
+    __slots__ = ("_on_change",)
+
+    def __init__(self, items, on_change: Callable[[], None]):
+        super().__init__(items)
+        self._on_change = on_change
+
+    def __copy__(self):
+        # Copies are stored or handed out, and never report back
+        return list(self)
+
+
+class TrackedDict(dict):
+    __slots__ = ("_on_change",)
+
+    def __init__(self, items, on_change: Callable[[], None]):
+        super().__init__(items)
+        self._on_change = on_change
+
+    def __copy__(self):
+        return dict(self)
+
+
+for _name in (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+):
+    setattr(TrackedList, _name, _notifying(list, _name))
+
+for _name in (
+    "__setitem__",
+    "__delitem__",
+    "__ior__",
+    "pop",
+    "popitem",
+    "clear",
+    "update",
+    "setdefault",
+):
+    # dict only has in-place union from 3.9
+    if hasattr(dict, _name):
+        setattr(TrackedDict, _name, _notifying(dict, _name))
+
+
+def track(v, on_change: Callable[[], None]):
+    """Swaps every list and dict in a restored tree for a tracked one"""
+    if isinstance(v, list):
+        return TrackedList((track(x, on_change) for x in v), on_change)
+    if isinstance(v, dict):
+        return TrackedDict(((k, track(x, on_change)) for k, x in v.items()), on_change)
+    return v
+
+
+class LazyList(TrackedList):
+    """
+    A restored list whose subtrees are only fetched from the CAS when read.
+    Until then they're held as their Hash, which is also what gets committed
+    for them. Only for lists the model never gets hold of itself, such as a
+    process's locals.
+    """
+
+    __slots__ = ("_cas", "_lazy")
+
+    def __init__(self, items, on_change: Callable[[], None], cas: "CAS"):
+        super().__init__(items, on_change)
+        self._cas = cas
+        self._lazy = True
+
+    def _load(self, i, v):
+        if v.__class__ is Hash:
+            v = lazy(self._cas, v, self._on_change)
+            list.__setitem__(self, i, v)
+        return v
+
+    def _realize(self):
+        if self._lazy:
+            for i, v in enumerate(list.__iter__(self)):
+                self._load(i, v)
+            self._lazy = False
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            self._realize()
+            return list.__getitem__(self, i)
+        return self._load(i, list.__getitem__(self, i))
+
+    def pop(self, *args):
+        v = TrackedList.pop(self, *args)
+        return lazy(self._cas, v, self._on_change)
+
+
+class LazyDict(TrackedDict):
+    """A restored dict whose subtrees are only fetched from the CAS when read"""
+
+    __slots__ = ("_cas", "_lazy")
+
+    def __init__(self, items, on_change: Callable[[], None], cas: "CAS"):
+        super().__init__(items, on_change)
+        self._cas = cas
+        self._lazy = True
+
+    def _load(self, k, v):
+        if v.__class__ is Hash:
+            v = lazy(self._cas, v, self._on_change)
+            dict.__setitem__(self, k, v)
+        return v
+
+    def _realize(self):
+        if self._lazy:
+            for k, v in list(dict.items(self)):
+                self._load(k, v)
+            self._lazy = False
+
+    def __getitem__(self, k):
+        return self._load(k, dict.__getitem__(self, k))
+
+    def __iter__(self):
+        # Overriding it at all keeps dict() and update() from copying the
+        # unread Hashes straight out of the storage.
+        return dict.__iter__(self)
+
+    def get(self, k, default=None):
+        return self[k] if dict.__contains__(self, k) else default
+
+    def setdefault(self, k, default=None):
+        if dict.__contains__(self, k):
+            return self[k]
+        return TrackedDict.setdefault(self, k, default)
+
+    def pop(self, *args):
+        v = TrackedDict.pop(self, *args)
+        return lazy(self._cas, v, self._on_change)
+
+
+def _realizing(base: type, name: str):
+    method = getattr(base, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._realize()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+# Whatever looks at every item, or compares them, loads them all first
+_WHOLE = (
+    "__eq__",
+    "__ne__",
+    "__lt__",
+    "__le__",
+    "__gt__",
+    "__ge__",
+    "__repr__",
+    "copy",
+)
+
+for _name in _WHOLE + (
+    "__iter__",
+    "__reversed__",
+    "__contains__",
+    "__add__",
+    "__mul__",
+    "__rmul__",
+    "index",
+    "count",
+    "sort",
+    "remove",
+):
+    setattr(LazyList, _name, _realizing(TrackedList, _name))
+
+for _name in _WHOLE + ("values", "items", "popitem", "__or__", "__ror__"):
+    if hasattr(dict, _name):
+        setattr(LazyDict, _name, _realizing(TrackedDict, _name))
+
+
+def lazy(cas: "CAS", v, on_change: Callable[[], None]):
+    """Restores the node behind a Hash, leaving its dicts lazy; other values pass through"""
+    if v.__class__ is not Hash:
+        return v
+    return _wrap(cas, cas.get_shared(v), on_change)
+
+
+def _wrap(cas: "CAS", node, on_change: Callable[[], None]):
+    # Copied into the container, so the node can be shared
+    if isinstance(node, dict):
+        return LazyDict(node, on_change, cas)
+    refs = [i for i, x in enumerate(node) if x.__class__ is Hash]
+    items = list(node)
+    # A list's items are restored with it, fetched together
+    for i, child in zip(refs, cas.get_many_shared([node[i] for i in refs])):
+        items[i] = _wrap(cas, child, on_change)
+    return TrackedList(items, on_change)
@@ -1,11 +1,17 @@
+from hashlib import blake2b
+from hashlib import md5
 from hashlib import sha256
+from collections import OrderedDict
 from functools import total_ordering
 import msgpack
 
 from timewinder.generators import NonDeterministicSet
 
+from typing import Callable
+from typing import Dict
 from typing import Iterable
 from typing import List
+from typing import Optional
 from typing import Tuple
 from typing import Union
 
@@ -31,6 +37,18 @@ class Hash:
         return hash(self.bytes)
 
 
+class ThreadRef(int):
+    """
+    A thread's index, as returned by ThreadID().
+
+    Behaves as the plain int, but is told apart when hashing, so that
+    symmetry reduction can renumber the threads a state refers to.
+    """
+
+    def __repr__(self) -> str:
+        return "ThreadRef(%d)" % self
+
+
 TreeType = Union[dict, list]
 FlatValueType = Union[Hash, str, int, bool, float, None, bytes]
 ValidValueType = Union[FlatValueType, NonDeterministicSet]
@@ -47,10 +65,27 @@ def _is_deep_type(v) -> bool:
 def msgpack_ext_default(obj):
     if isinstance(obj, Hash):
         return msgpack.ExtType(1, obj.bytes)
+    if isinstance(obj, ThreadRef):
+        return msgpack.ExtType(2, int(obj).to_bytes(4, "big", signed=True))
+    # The packer is strict about types, so that ThreadRefs arrive here;
+    # other subclasses of the builtins serialize as their base type.
+    for base in (bool, int, float, str, bytes, dict):
+        if isinstance(obj, base):
+            return base(obj)
+    if isinstance(obj, (list, tuple)):
+        return list(obj)
     raise TypeError(f"Unsupported type for serializing tree: {type(obj)}")
 
 
-_packer = msgpack.Packer(default=msgpack_ext_default)
+def msgpack_ext_hook(code: int, data: bytes):
+    if code == 1:
+        return Hash(data)
+    if code == 2:
+        return ThreadRef(int.from_bytes(data, "big", signed=True))
+    return msgpack.ExtType(code, data)
+
+
+_packer = msgpack.Packer(default=msgpack_ext_default, strict_types=True)
 
 
 def _serialize_tree(tree) -> bytes:
@@ -61,16 +96,125 @@ def _serialize_list(l) -> bytes:
     return _packer.pack(l)
 
 
-def hash_flat_tree(tree: Union[list, dict]) -> Hash:
-    hasher = sha256()
+def pack_node(node: TreeType) -> bytes:
+    """Serializes a flat node for storage, rather than for hashing"""
+    return _packer.pack(node)
+
+
+def unpack_node(data) -> TreeType:
+    return msgpack.unpackb(
+        data, ext_hook=msgpack_ext_hook, raw=False, strict_map_key=False
+    )
+
+
+def _sha256(m: bytes) -> bytes:
+    return sha256(m).digest()
+
+
+def _blake2b_128(m: bytes) -> bytes:
+    return blake2b(m, digest_size=16).digest()
+
+
+def _md5(m: bytes) -> bytes:
+    # Only used to tell states apart, not for security
+    return md5(m).digest()
+
+
+HashFunction = Callable[[bytes], bytes]
+
+# The functions states can be hashed with, by name. Every hash is at least
+# 16 bytes, so the fingerprints and filters slicing them can take 8.
+HASH_FUNCTIONS: Dict[str, HashFunction] = {
+    "sha256": _sha256,
+    "blake2b-128": _blake2b_128,
+    "md5": _md5,
+}
+DEFAULT_HASH = "sha256"
+
+
+def serialize_flat_tree(tree: Union[list, dict]) -> bytes:
+    """
+    The bytes a flat node is hashed by; unpack_node reads them back, as the
+    same node with its dict keys sorted.
+    """
     if isinstance(tree, dict):
-        m = _serialize_tree(tree)
+        return _serialize_tree(tree)
     elif isinstance(tree, list):
-        m = _serialize_list(tree)
+        return _serialize_list(tree)
     else:
         raise TypeError("Can only hash dicts or lists")
-    hasher.update(m)
-    return Hash(hasher.digest())
+
+
+def hash_flat_tree(tree: Union[list, dict], function: HashFunction = _sha256) -> Hash:
+    return Hash(function(serialize_flat_tree(tree)))
+
+
+def hash_packed_tree(
+    tree: Union[list, dict], function: HashFunction = _sha256
+) -> Tuple[Hash, bytes]:
+    """Hashes a flat node, also returning the bytes it was hashed by"""
+    m = serialize_flat_tree(tree)
+    return Hash(function(m)), m
+
+
+_INTERNABLE = frozenset((str, int, bool, bytes, type(None), Hash, ThreadRef))
+
+
+class InternTable:
+    """
+    Hashes of small flat nodes, by their contents, so that hashing a node
+    seen before skips serializing it.
+    """
+
+    def __init__(
+        self, function: HashFunction = _sha256, size: int = 1 << 16, max_items: int = 8
+    ):
+        self.function = function
+        self.size = size
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._hashes: "OrderedDict[tuple, Hash]" = OrderedDict()
+
+    def hash(self, tree: Union[list, dict]) -> Hash:
+        return self.hash_packed(tree)[0]
+
+    def hash_packed(self, tree: Union[list, dict]) -> Tuple[Hash, Optional[bytes]]:
+        """
+        Hashes a flat node, also returning the bytes it was hashed by, unless
+        the hash was remembered and it didn't need serializing.
+        """
+        if len(tree) > self.max_items:
+            return hash_packed_tree(tree, self.function)
+        # Types are part of the key, since equal values of different types,
+        # like 1 and True, serialize differently. Dicts in another order only
+        # miss, as their items aren't sorted.
+        key: tuple
+        if isinstance(tree, dict):
+            types = tuple(map(type, tree.values())) + tuple(map(type, tree))
+            key = (tuple(tree.items()), types)
+        else:
+            types = tuple(map(type, tree))
+            key = (tuple(tree), types)
+        if not _INTERNABLE.issuperset(types):
+            # Only scalars whose equality is their serialization: not floats,
+            # as 0.0 == -0.0, nor tuples, which would hide their items' types
+            return hash_packed_tree(tree, self.function)
+        h = self._hashes.get(key)
+        if h is not None:
+            self.hits += 1
+            self._hashes.move_to_end(key)
+            return h, None
+        self.misses += 1
+        h, m = hash_packed_tree(tree, self.function)
+        self._hashes[key] = h
+        if len(self._hashes) > self.size:
+            self._hashes.popitem(last=False)
+        return h, m
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total != 0 else 0.0
 
 
 def non_flat_keys(tree: Union[list, dict]) -> List:
@@ -0,0 +1,91 @@
+"""
+Compact visited-state sets.
+
+The exact visited set holds every state hash as a bytes object, at around a
+hundred bytes each. A FingerprintSet keeps only 64 bits of each hash, packed
+into an open-addressing table, for around eleven bytes a state. The price is
+that two distinct states sharing a fingerprint look like one, and the second
+is never explored; collision_probability estimates the odds of that.
+"""
+
+import math
+
+from array import array
+
+
+# Slots are 64-bit fingerprints; zero marks an empty one
+_EMPTY = 0
+_MAX_LOAD = 0.75
+
+
+def fingerprint(key: bytes) -> int:
+    fp = int.from_bytes(key[:8], "little")
+    return fp if fp != _EMPTY else 1
+
+
+class FingerprintSet:
+    """A set of state hashes, each stored as a 64-bit fingerprint"""
+
+    def __init__(self, capacity: int = 1 << 16):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._reset(size)
+
+    def _reset(self, size: int):
+        self._table = array("Q", bytes(8 * size))
+        self._mask = size - 1
+        self._len = 0
+        self._limit = int(size * _MAX_LOAD)
+
+    def _slot(self, fp: int) -> int:
+        table = self._table
+        mask = self._mask
+        i = fp & mask
+        while True:
+            v = table[i]
+            if v == _EMPTY or v == fp:
+                return i
+            i = (i + 1) & mask
+
+    def __contains__(self, key: bytes) -> bool:
+        fp = fingerprint(key)
+        return self._table[self._slot(fp)] == fp
+
+    def add(self, key: bytes):
+        fp = fingerprint(key)
+        i = self._slot(fp)
+        if self._table[i] == fp:
+            return
+        self._table[i] = fp
+        self._len += 1
+        if self._len > self._limit:
+            self._grow()
+
+    def _grow(self):
+        old = self._table
+        self._reset(2 * len(old))
+        for fp in old:
+            if fp != _EMPTY:
+                self._table[self._slot(fp)] = fp
+                self._len += 1
+
+    def clear(self):
+        self._reset(len(self._table))
+
+    def __len__(self) -> int:
+        return self._len
+
+    def memory(self) -> int:
+        """Bytes used by the table"""
+        return self._table.itemsize * len(self._table)
+
+
+def collision_probability(n_states: int, bits: int = 64) -> float:
+    """
+    The chance that some two of n distinct states share a fingerprint, so that
+    one of them was never explored. This assumes the hash spreads states
+    evenly, which is the optimistic case.
+    """
+    pairs = n_states * (n_states - 1) / 2
+    return -math.expm1(-pairs / 2.0**bits)